@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""FireWallBot log query: parallel streaming search over live JSONL and logkeeper archives."""
+from __future__ import annotations
+
+import argparse
+import datetime as _dt
+import heapq
+import json
+import os
+import pathlib
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(REPO_ROOT / "scripts" / "logkeeper"))
+
+from logkeeper import INDEX_SUFFIX, KIND_RE, ROTATING_SUFFIX, TS_RE, iter_archive_lines, parse_ts  # noqa: E402
+
+LOG_DIR = pathlib.Path(os.getenv("FIREWALLBOT_LOG_DIR", str(REPO_ROOT / "log")))
+SOURCES = ("syswatcher", "filewatcher", "commands")
+# Matches a worker holds in memory before sorting them into a spill file ("run").
+RUN_BYTES = int(float(os.getenv("FIREWALLBOT_QUERY_RUN_MB", "32")) * 1024 * 1024)
+
+# Fields consulted by each filter; the first one present in a record wins.
+KIND_FIELDS = ("kind", "type")
+PATH_FIELDS = ("path",)
+REMOTE_FIELDS = ("remote_addr", "ip")
+
+RELATIVE_RE = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+RELATIVE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_time(value: str) -> float:
+    """``--since``/``--until`` value to epoch seconds: ISO8601 (naive = local time) or ``30m``/``2h``/``7d`` ago."""
+    match = RELATIVE_RE.match(value.strip())
+    if match:
+        return time.time() - float(match.group(1)) * RELATIVE_UNITS[match.group(2)]
+    try:
+        return _dt.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无法解析时间: {value}") from None
+
+
+def json_fragment(value: str) -> bytes:
+    """``value`` as it appears inside a JSON string written with ``ensure_ascii=False``."""
+    return json.dumps(value, ensure_ascii=False)[1:-1].encode("utf-8")
+
+
+def source_files(log_dir: pathlib.Path, sources: Sequence[str]) -> List[pathlib.Path]:
+    """Live logs, in-flight ``.rotating`` files and ``.gz`` archives of the selected sources."""
+    files: List[pathlib.Path] = []
+    for source in sources:
+        live = log_dir / f"{source}.jsonl"
+        if live.exists():
+            files.append(live)
+        files.extend(sorted(log_dir.glob(f"{source}-*.jsonl{ROTATING_SUFFIX}")))
+        files.extend(
+            path for path in sorted(log_dir.glob(f"{source}-*.jsonl.gz")) if not path.name.endswith(INDEX_SUFFIX)
+        )
+    return files
+
+
+def event_type_aliases(value: str) -> List[str]:
+    """``MODIFY`` and ``IN_MODIFY`` name the same event; filewatcher writes ``IN_*`` except for moves."""
+    if value.startswith("IN_"):
+        return [value, value[3:]]
+    return [value, "IN_" + value]
+
+
+class Filter:
+    """Compiled query: byte-level needles for the prefilter plus exact per-record checks.
+
+    Instances are pickled into the worker processes, so they only hold plain data.
+    """
+
+    def __init__(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        kinds: Optional[Sequence[str]] = None,
+        pid: Optional[int] = None,
+        path_prefix: Optional[str] = None,
+        remote: Optional[str] = None,
+        contains: Optional[str] = None,
+        event_types: Optional[Sequence[str]] = None,
+    ) -> None:
+        self.since = since
+        self.until = until
+        self.kinds = set(kinds or ())
+        self.event_types = {alias for value in event_types or () for alias in event_type_aliases(value)}
+        self.pid = pid
+        self.path_prefix = path_prefix
+        self.remote = remote
+        self.contains = contains.encode("utf-8") if contains else None
+        # Every needle must occur somewhere in a matching line; cheap ``in`` checks on raw bytes.
+        self.needles: List[bytes] = [
+            needle
+            for needle in (
+                self.contains,
+                str(pid).encode("ascii") if pid is not None else None,
+                json_fragment(path_prefix) if path_prefix else None,
+                json_fragment(remote) if remote else None,
+            )
+            if needle
+        ]
+        # Each group needs at least one of its alternatives to occur.
+        self.any_needles: List[List[bytes]] = [
+            [b'"' + json_fragment(value) + b'"' for value in group] for group in (self.kinds, self.event_types) if group
+        ]
+        self.needs_record = bool(self.kinds or self.event_types or pid is not None or path_prefix or remote)
+
+    def prefilter(self, line: bytes) -> bool:
+        for needle in self.needles:
+            if needle not in line:
+                return False
+        for group in self.any_needles:
+            for needle in group:
+                if needle in line:
+                    break
+            else:
+                return False
+        return True
+
+    def in_window(self, stamp: Optional[float]) -> bool:
+        if stamp is None:
+            return self.since is None and self.until is None
+        if self.since is not None and stamp < self.since:
+            return False
+        if self.until is not None and stamp > self.until:
+            return False
+        return True
+
+    def matches(self, record: Dict) -> bool:
+        if self.kinds and not any(record.get(field) in self.kinds for field in KIND_FIELDS):
+            return False
+        if self.event_types and record.get("event_type") not in self.event_types:
+            return False
+        if self.pid is not None and record.get("pid") != self.pid:
+            return False
+        if self.path_prefix and not str(first_field(record, PATH_FIELDS) or "").startswith(self.path_prefix):
+            return False
+        if self.remote and not str(first_field(record, REMOTE_FIELDS) or "").startswith(self.remote):
+            return False
+        return True
+
+
+def first_field(record: Dict, fields: Sequence[str]):
+    for field in fields:
+        if field in record:
+            return record[field]
+    return None
+
+
+def iter_lines(path: pathlib.Path, flt: Filter) -> Iterator[bytes]:
+    if path.name.endswith(".gz"):
+        # The sidecar index (min/max ts and kind/type per member) lets whole members
+        # be skipped before any decompression.
+        kinds = flt.kinds or None
+        return iter_archive_lines(path, flt.since, flt.until, kinds)
+    return _iter_plain(path)
+
+
+def _iter_plain(path: pathlib.Path) -> Iterator[bytes]:
+    try:
+        with path.open("rb") as handle:
+            yield from handle
+    except FileNotFoundError:
+        # Rotated away between listing and opening; its archive is picked up by the next query.
+        return
+
+
+def iter_matches(path: pathlib.Path, flt: Filter) -> Iterator[Tuple[float, Optional[Dict], bytes]]:
+    """``(epoch, record, line)`` for every matching line; ``record`` is None when no field check needed parsing."""
+    stamps: Dict[bytes, Optional[float]] = {}
+    timed = flt.since is not None or flt.until is not None
+    for line in iter_lines(path, flt):
+        if not flt.prefilter(line):
+            continue
+        match = TS_RE.search(line)
+        raw_ts = match.group(1) if match else b""
+        stamp = stamps.get(raw_ts, -1.0)
+        if stamp == -1.0:
+            # Watchers write second-resolution stamps, so bursts share one parse.
+            stamp = parse_ts(raw_ts.decode("ascii", "replace")) if raw_ts else None
+            if len(stamps) > 4096:
+                stamps.clear()
+            stamps[raw_ts] = stamp
+        if timed and not flt.in_window(stamp):
+            continue
+        record = None
+        if flt.needs_record:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict) or not flt.matches(record):
+                continue
+        yield (stamp or 0.0, record, line)
+
+
+def write_run(found: List[Tuple[float, bytes]], limit: Optional[int], spill_dir: str) -> str:
+    """Sort ``found`` by timestamp (stable within equal stamps) into a spill file ``<epoch>\\t<line>``."""
+    found.sort(key=lambda item: item[0])
+    if limit is not None:
+        # Only the earliest ``limit`` lines of any run can survive the merge.
+        del found[limit:]
+    fd, run = tempfile.mkstemp(dir=spill_dir, suffix=".run")
+    with os.fdopen(fd, "wb") as handle:
+        handle.writelines(b"%.6f\t%s" % item for item in found)
+    return run
+
+
+def read_run(run: str) -> Iterator[Tuple[float, bytes]]:
+    with open(run, "rb") as handle:
+        for raw in handle:
+            stamp, line = raw.split(b"\t", 1)
+            yield float(stamp), line
+
+
+def scan_lines(path: str, flt: Filter, limit: Optional[int], spill_dir: str) -> List[str]:
+    """Worker: matching lines of one file as sorted spill files of at most ``RUN_BYTES`` each.
+
+    Only the run names travel back to the parent, so neither side holds more
+    than one run per worker in memory however many lines match.
+    """
+    runs: List[str] = []
+    found: List[Tuple[float, bytes]] = []
+    size = 0
+    for stamp, _, line in iter_matches(pathlib.Path(path), flt):
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        found.append((stamp, line))
+        size += len(line)
+        if size >= RUN_BYTES:
+            runs.append(write_run(found, limit, spill_dir))
+            found = []
+            size = 0
+    if found:
+        runs.append(write_run(found, limit, spill_dir))
+    return runs
+
+
+def field_pattern(field: str) -> "re.Pattern[bytes]":
+    """First ``"field": value`` pair of a raw line; the value is a JSON string or scalar."""
+    return re.compile(b'"' + re.escape(field.encode("utf-8")) + rb'"\s*:\s*("(?:[^"\\]|\\.)*"|[^,}\]\s]+)')
+
+
+def scan_counts(path: str, flt: Filter, fields: Optional[Sequence[str]]) -> Counter:
+    """Worker: counts per ``fields`` value (or per kind/type) read straight off the raw lines.
+
+    Values are pulled out with per-field patterns, so lines are never decoded into
+    full records beyond what the filters themselves require.
+    """
+    counts: Counter = Counter()
+    patterns = [field_pattern(field) for field in fields] if fields else [KIND_RE]
+    for _, record, line in iter_matches(pathlib.Path(path), flt):
+        values = []
+        for field, pattern in zip(fields or [None], patterns):
+            if record is not None and field is not None:
+                value = record.get(field)
+                values.append("" if value is None else str(value))
+                continue
+            match = pattern.search(line)
+            if match is None:
+                values.append("")
+                continue
+            raw = match.group(1)
+            if raw.startswith(b'"'):
+                try:
+                    values.append(json.loads(raw))
+                except ValueError:
+                    values.append(raw.decode("utf-8", "replace"))
+            else:
+                values.append(raw.decode("utf-8", "replace"))
+        if fields and not any(values):
+            continue
+        counts[":".join(values)] += 1
+    return counts
+
+
+def run_query(files: List[pathlib.Path], flt: Filter, jobs: int, limit: Optional[int], out) -> int:
+    """Scan ``files`` in parallel, then k-way merge their spill files into ``out`` in timestamp order."""
+    emitted = 0
+    spill_dir = tempfile.mkdtemp(prefix="firewallbot-query-")
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(scan_lines, str(path), flt, limit, spill_dir) for path in files]
+            runs = [run for future in futures for run in future.result()]
+        streams = [read_run(run) for run in runs]
+        for _, line in heapq.merge(*streams, key=lambda item: item[0]):
+            out.write(line)
+            emitted += 1
+            if limit is not None and emitted >= limit:
+                break
+        out.flush()
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return emitted
+
+
+def run_counts(files: List[pathlib.Path], flt: Filter, jobs: int, fields: Optional[Sequence[str]]) -> Counter:
+    total: Counter = Counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for counts in pool.map(scan_counts, [str(path) for path in files], [flt] * len(files), [fields] * len(files)):
+            total.update(counts)
+    return total
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="并行检索 FireWallBot 日志（log/*.jsonl 及 logkeeper 归档），按时间顺序输出匹配的 JSONL 记录",
+    )
+    parser.add_argument(
+        "--source", action="append", choices=SOURCES,
+        help="日志来源，可重复指定；默认全部（syswatcher/filewatcher/commands）",
+    )
+    parser.add_argument("--log-dir", type=pathlib.Path, default=LOG_DIR, help="日志目录（默认 FIREWALLBOT_LOG_DIR 或 log/）")
+    parser.add_argument("--since", type=parse_time, help="起始时间：ISO8601（无时区按本地时间）或相对值如 30m/2h/7d")
+    parser.add_argument("--until", type=parse_time, help="结束时间，格式同 --since")
+    parser.add_argument("--kind", action="append", help="匹配 kind/type 字段，可重复指定（任一即可）")
+    parser.add_argument("--event-type", action="append", help="匹配 filewatcher 的 event_type 字段（如 IN_MODIFY、MOVED_TO，可省略 IN_ 前缀），可重复指定")
+    parser.add_argument("--pid", type=int, help="匹配 pid 字段")
+    parser.add_argument("--path-prefix", help="匹配 path 字段前缀（filewatcher）")
+    parser.add_argument("--remote", help="匹配 remote_addr/ip 字段前缀（syswatcher 连接、cmdwatcher 会话）")
+    parser.add_argument("--contains", help="原始行子串匹配（区分大小写）")
+    parser.add_argument("--limit", type=int, help="最多输出的记录数（按时间最早的优先）")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--count", action="store_true", help="只统计匹配数量，并按 kind/type 分组")
+    mode.add_argument(
+        "--top", metavar="FIELD[,FIELD...]",
+        help="按字段值聚合计数，如 remote_addr,remote_port 或 path",
+    )
+    parser.add_argument("-n", "--top-n", type=int, default=10, help="--top 输出的条目数（默认 10）")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="并行进程数（默认 CPU 数）")
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    files = source_files(args.log_dir, args.source or SOURCES)
+    if not files:
+        print(f"未在 {args.log_dir} 找到日志文件", file=sys.stderr)
+        return 1
+    flt = Filter(
+        since=args.since,
+        until=args.until,
+        kinds=args.kind,
+        pid=args.pid,
+        path_prefix=args.path_prefix,
+        remote=args.remote,
+        contains=args.contains,
+        event_types=args.event_type,
+    )
+    jobs = max(1, min(args.jobs, len(files)))
+
+    if args.count:
+        counts = run_counts(files, flt, jobs, None)
+        print(json.dumps({"total": sum(counts.values()), "by_kind": dict(counts.most_common())}, ensure_ascii=False))
+        return 0
+    if args.top:
+        fields = [field.strip() for field in args.top.split(",") if field.strip()]
+        counts = run_counts(files, flt, jobs, fields)
+        for key, count in counts.most_common(args.top_n):
+            print(f"{count}\t{key}")
+        return 0
+
+    try:
+        run_query(files, flt, jobs, args.limit, sys.stdout.buffer)
+    except BrokenPipeError:
+        # ``query.py ... | head`` closing the pipe early is not an error.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
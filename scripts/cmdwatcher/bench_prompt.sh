@@ -0,0 +1,54 @@
+#!/usr/bin/env bash
+# FireWallBot - cmdwatcher prompt hook benchmark
+# Measures the per-prompt cost of fwbot_log_last_command for one or more
+# versions of profile.sh, e.g. before/after a change:
+#   bash scripts/cmdwatcher/bench_prompt.sh
+#   bash scripts/cmdwatcher/bench_prompt.sh -n 2000 <(git show HEAD~1:scripts/cmdwatcher/profile.sh) scripts/cmdwatcher/profile.sh
+
+set -euo pipefail
+
+iterations=500
+while getopts "n:" opt; do
+  case "$opt" in
+    n) iterations=$OPTARG ;;
+    *) echo "用法: $0 [-n 次数] [profile.sh ...]" >&2; exit 2 ;;
+  esac
+done
+shift $((OPTIND - 1))
+
+here="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)"
+if [[ $# -eq 0 ]]; then
+  set -- "${here}/profile.sh"
+fi
+
+workdir=$(mktemp -d)
+trap 'rm -rf -- "$workdir"' EXIT
+
+for profile in "$@"; do
+  # Copy first so process substitutions (<(git show ...)) can be read by the child shell
+  cp -- "$profile" "${workdir}/profile.sh"
+  : > "${workdir}/commands.jsonl"
+  # Interactive child shell so the hook installs itself; logs go to the temp dir only
+  # The socket points into the temp dir too, so a running collector never receives benchmark events
+  result=$(FIREWALLBOT_LOG_DIR="$workdir" FIREWALLBOT_CMD_LOG="${workdir}/commands.jsonl" \
+    FIREWALLBOT_CMD_SOCKET="${workdir}/collector.sock" \
+    bash --noprofile --norc -i -c '
+      source "$1" >/dev/null 2>&1
+      n=$2
+      # The last allocated pid (/proc/loadavg) approximates how many processes were spawned
+      read -r _ _ _ _ pid_start </proc/loadavg
+      start=$EPOCHREALTIME
+      for ((i = 0; i < n; i++)); do
+        FWBOT_LAST_CMD="echo benchmark $i"
+        fwbot_log_last_command
+      done
+      end=$EPOCHREALTIME
+      read -r _ _ _ _ pid_end </proc/loadavg
+      printf "%s %s %s\n" "${start/[.,]/}" "${end/[.,]/}" "$((pid_end - pid_start))"
+    ' bench "${workdir}/profile.sh" "$iterations" 2>/dev/null)
+  read -r start end spawned <<<"$result"
+  lines=$(grep -c '"type":"exec"' "${workdir}/commands.jsonl" || true)
+  per_us=$(( (end - start) / iterations ))
+  printf '%-40s %6d 次  %8d us/次  约 %d 个新进程  写入 %d 条 exec\n' \
+    "$profile" "$iterations" "$per_us" "$spawned" "$lines"
+done
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""FireWallBot cmdwatcher collector.
+
+Receives one datagram per command event from the profile hook on a Unix
+datagram socket and appends them to ``commands.jsonl`` as the single writer,
+batching writes (group commit). The kernel-supplied sender credentials
+(SO_PASSCRED) are attached to every record, so the uid cannot be forged by
+the shell.
+"""
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import os
+import pathlib
+import signal
+import socket
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[2]
+LOG_DIR = pathlib.Path(os.getenv("FIREWALLBOT_LOG_DIR", str(REPO_ROOT / "log")))
+LOG_FILE = pathlib.Path(os.getenv("FIREWALLBOT_CMD_LOG", str(LOG_DIR / "commands.jsonl")))
+SOCKET_PATH = pathlib.Path(os.getenv("FIREWALLBOT_CMD_SOCKET", "/run/firewallbot/cmdwatcher.sock"))
+# Largest datagram accepted; the hook sends bigger events through the direct-append path.
+MAX_DATAGRAM = int(os.getenv("FIREWALLBOT_CMD_MAX_BYTES", "65536"))
+RCVBUF_BYTES = int(float(os.getenv("FIREWALLBOT_CMD_RCVBUF_MB", "4")) * 1024 * 1024)
+# Group commit: after the first datagram of a batch, keep collecting for up to
+# COMMIT_WINDOW seconds or BATCH_MAX events, then write (and fsync) once.
+COMMIT_WINDOW = float(os.getenv("FIREWALLBOT_CMD_COMMIT_MS", "20")) / 1000.0
+BATCH_MAX = int(os.getenv("FIREWALLBOT_CMD_BATCH", "512"))
+FSYNC = os.getenv("FIREWALLBOT_CMD_FSYNC", "1").lower() not in {"0", "false", "no"}
+STATS_INTERVAL = float(os.getenv("FIREWALLBOT_CMD_STATS_INTERVAL", "3600"))
+
+CREDENTIALS = struct.Struct("iII")  # struct ucred: pid, uid, gid
+SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33)  # not exported by the socket module
+
+
+class LogFile:
+    """Append-only binary log that reopens its path after logkeeper renames it away."""
+
+    def __init__(self, path: pathlib.Path, check_interval: float = 1.0) -> None:
+        self.path = path
+        self.check_interval = check_interval
+        self._next_check = 0.0
+        self._fd = -1
+        self._open()
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC, 0o644)
+        st = os.fstat(self._fd)
+        self._ident = (st.st_dev, st.st_ino)
+
+    def _reopen_if_rotated(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            st = os.stat(self.path)
+            if (st.st_dev, st.st_ino) == self._ident:
+                return
+        except FileNotFoundError:
+            pass
+        os.close(self._fd)
+        self._open()
+
+    def write(self, data: bytes, sync: bool = False) -> None:
+        """Append ``data`` with a single O_APPEND write so it never interleaves with fallback writers."""
+        self._reopen_if_rotated()
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        if sync:
+            os.fdatasync(self._fd)
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def iso_local() -> str:
+    return _dt.datetime.now().astimezone().isoformat(timespec="seconds")
+
+
+def peer_credentials(ancillary: List[Tuple[int, int, bytes]]) -> Optional[Tuple[int, int, int]]:
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_CREDENTIALS and len(data) >= CREDENTIALS.size:
+            return CREDENTIALS.unpack_from(data)
+    return None
+
+
+def decode_event(datagram: bytes, creds: Optional[Tuple[int, int, int]]) -> Dict:
+    """Event for a received datagram, stamped with the sender's credentials.
+
+    The hook relays through ``logger``, which prefixes a syslog header; everything
+    before the first ``{`` is dropped. Payloads that are not a JSON object are
+    kept verbatim as ``malformed`` records rather than discarded.
+    """
+    start = datagram.find(b"{")
+    payload = datagram[start:] if start >= 0 else datagram
+    try:
+        event = json.loads(payload)
+        if not isinstance(event, dict):
+            raise ValueError("not an object")
+    except ValueError:
+        event = {"type": "malformed", "ts": iso_local(), "data": datagram.decode("utf-8", "replace")}
+    if creds is not None:
+        pid, uid, gid = creds
+        event["peer_pid"] = pid
+        event["peer_uid"] = uid
+        event["peer_gid"] = gid
+        claimed = event.get("uid")
+        if claimed is not None and claimed != uid:
+            event["uid_mismatch"] = True
+    return event
+
+
+def pid_path(path: pathlib.Path) -> pathlib.Path:
+    """``<socket>.pid``: shells compare it with the pid their relay connected to, to notice restarts."""
+    return path.with_name(path.name + ".pid")
+
+
+def write_pid_file(path: pathlib.Path) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(f"{os.getpid()}\n", encoding="ascii")
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def bind_socket(path: pathlib.Path) -> socket.socket:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_PASSCRED, 1)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, RCVBUF_BYTES)
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_BYTES)
+    sock.bind(str(path))
+    # Every user's shell must be able to send; the credentials say who it was.
+    os.chmod(path, 0o666)
+    return sock
+
+
+class Collector:
+    """Receive loop with group commit."""
+
+    def __init__(self, sock: socket.socket, log: LogFile) -> None:
+        self.sock = sock
+        self.log = log
+        self.ancillary = socket.CMSG_SPACE(CREDENTIALS.size)
+        self.stats: Dict[str, int] = {"events": 0, "batches": 0, "bytes": 0, "malformed": 0, "spoofed": 0}
+        self.running = True
+
+    def receive(self, timeout: Optional[float]) -> Optional[bytes]:
+        self.sock.settimeout(timeout)
+        try:
+            datagram, ancillary, _flags, _addr = self.sock.recvmsg(MAX_DATAGRAM, self.ancillary)
+        except (socket.timeout, BlockingIOError, InterruptedError):
+            return None
+        event = decode_event(datagram, peer_credentials(ancillary))
+        if event.get("type") == "malformed":
+            self.stats["malformed"] += 1
+        if event.get("uid_mismatch"):
+            self.stats["spoofed"] += 1
+        return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def run(self) -> None:
+        next_stats = time.monotonic() + STATS_INTERVAL
+        while self.running:
+            first = self.receive(1.0)
+            if first is None:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + COMMIT_WINDOW
+            while len(batch) < BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                line = self.receive(remaining if remaining > 0 else 0.0)
+                if line is None:
+                    break
+                batch.append(line)
+            self.commit(batch)
+            if time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + STATS_INTERVAL
+                print(f"[cmdwatcher] stats {json.dumps(self.stats)}")
+
+    def drain(self) -> None:
+        """Write whatever is still queued in the socket buffer."""
+        batch = []
+        while True:
+            line = self.receive(0.0)
+            if line is None:
+                break
+            batch.append(line)
+        if batch:
+            self.commit(batch)
+
+    def commit(self, batch: List[bytes]) -> None:
+        data = b"".join(batch)
+        self.log.write(data, sync=FSYNC)
+        self.stats["events"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["bytes"] += len(data)
+
+    def stop(self, *_args) -> None:
+        self.running = False
+
+
+def main() -> int:
+    log = LogFile(LOG_FILE)
+    sock = bind_socket(SOCKET_PATH)
+    write_pid_file(pid_path(SOCKET_PATH))
+    collector = Collector(sock, log)
+    signal.signal(signal.SIGTERM, collector.stop)
+    signal.signal(signal.SIGINT, collector.stop)
+    print(
+        f"[cmdwatcher] collecting on {SOCKET_PATH} -> {LOG_FILE} "
+        f"(commit window {COMMIT_WINDOW * 1000:.0f}ms, batch {BATCH_MAX}, fsync={'on' if FSYNC else 'off'})"
+    )
+    try:
+        collector.run()
+    finally:
+        # Remove the socket first so shells fall back to direct append immediately.
+        for path in (SOCKET_PATH, pid_path(SOCKET_PATH)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        collector.drain()
+        sock.close()
+        log.close()
+        print(f"[cmdwatcher] stopped {json.dumps(collector.stats)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
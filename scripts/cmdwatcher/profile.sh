@@ -23,17 +23,142 @@ _FWBOT_REPO_ROOT="$(cd -- "${_FWBOT_DIR}/../../" && pwd)"
 FIREWALLBOT_LOG_DIR="${FIREWALLBOT_LOG_DIR:-${_FWBOT_REPO_ROOT}/log}"
 mkdir -p -- "${FIREWALLBOT_LOG_DIR}" 2>/dev/null || true
 _FWBOT_CMD_LOG_FILE="${FIREWALLBOT_CMD_LOG:-${FIREWALLBOT_LOG_DIR}/commands.jsonl}"
+# Socket of the collector service (collector.py); without it events are appended directly
+_FWBOT_CMD_SOCKET="${FIREWALLBOT_CMD_SOCKET:-/run/firewallbot/cmdwatcher.sock}"
+_FWBOT_CMD_MAX_BYTES="${FIREWALLBOT_CMD_MAX_BYTES:-65536}"
 
 __FWBOT_LOGGING=0
 
+# Escape $2 for use inside a JSON string and store it in the variable named $1.
+# Uses printf -v so callers never pay for a $(...) subshell.
+fwbot__json_escape_to() {
+  local bs='\' dq='"'
+  # Quoted replacements are literal on every bash version (5.2 changed unquoted ones)
+  local s=${2//"$bs"/"$bs$bs"}
+  s=${s//"$dq"/"$bs$dq"}
+  s=${s//$'\n'/"${bs}n"}
+  s=${s//$'\r'/"${bs}r"}
+  s=${s//$'\t'/"${bs}t"}
+  printf -v "$1" '%s' "$s"
+}
+
 fwbot__json_escape() {
-  local s=${1//\/\\}
-  local dq='"' escdq='\\"'
-  s=${s//${dq}/${escdq}}
-  s=${s//$'\n'/\\n}
-  s=${s//$'\r'/\\r}
-  s=${s//$'\t'/\\t}
-  printf '%s' "$s"
+  local out
+  fwbot__json_escape_to out "$1"
+  printf '%s' "$out"
+}
+
+# Fields that never change during a shell's lifetime are resolved once here
+# (the only place that may fork) and reused by every event afterwards.
+fwbot__init_session_fields() {
+  [[ -n "${_FWBOT_FIELDS_READY:-}" ]] && return 0
+  _FWBOT_USER=${USER:-$(id -un 2>/dev/null)}
+  _FWBOT_UID=${UID:-$(id -u 2>/dev/null)}
+  _FWBOT_GID=$(id -g 2>/dev/null || echo 0)
+  if [[ -n "${HOSTNAME:-}" ]]; then
+    _FWBOT_HOST=${HOSTNAME%%.*}
+  else
+    _FWBOT_HOST=$(hostname -s 2>/dev/null || hostname)
+  fi
+  _FWBOT_TTY=$(tty 2>/dev/null) || _FWBOT_TTY="unknown"
+  if [[ -n "${SSH_CONNECTION:-}" ]]; then
+    local _rest
+    _FWBOT_IP=${SSH_CONNECTION%% *}
+    _rest=${SSH_CONNECTION#* }
+    _FWBOT_PORT=${_rest%% *}
+  else
+    _FWBOT_IP="local"; _FWBOT_PORT=""
+  fi
+  fwbot__json_escape_to _FWBOT_USER "$_FWBOT_USER"
+  fwbot__json_escape_to _FWBOT_TTY "$_FWBOT_TTY"
+  _FWBOT_LOGGER=$(type -P logger 2>/dev/null) || _FWBOT_LOGGER=""
+  _FWBOT_FIELDS_READY=1
+}
+
+# Start the per-shell relay to the collector: one long-lived `logger` coprocess
+# that turns each line on its stdin into one datagram (the kernel attaches its
+# uid/gid, which equal the shell's). Writing to the coprocess pipe is a builtin,
+# so logging a command still forks nothing. The shell keeps its own write and
+# read ends of that pipe (bash drops the coproc variables once logger exits),
+# the latter to see whether logger has taken everything written so far.
+fwbot__start_sink() {
+  [[ -n "${_FWBOT_SINK_PID:-}" || -z "${_FWBOT_LOGGER:-}" ]] && return 1
+  # After a failure, wait before retrying the same collector; a restarted one is tried at once
+  [[ "$1" == "${_FWBOT_SINK_FAILED:-}" ]] && (( EPOCHSECONDS < ${_FWBOT_SINK_RETRY:-0} )) && return 1
+  { coproc FWBOT_SINK { exec "$_FWBOT_LOGGER" --socket-errors=on -d -u "$_FWBOT_CMD_SOCKET" -t cmdwatcher -S "$_FWBOT_CMD_MAX_BYTES" 2>/dev/null; }; } 2>/dev/null
+  [[ -n "${FWBOT_SINK_PID:-}" ]] || return 1
+  _FWBOT_SINK_PID=$FWBOT_SINK_PID
+  disown "$_FWBOT_SINK_PID" 2>/dev/null || true
+  {
+    exec {_FWBOT_SINK_WFD}>&"${FWBOT_SINK[1]}" {_FWBOT_SINK_RFD}< "/proc/self/fd/${FWBOT_SINK[1]}"
+    exec {FWBOT_SINK[0]}<&- {FWBOT_SINK[1]}>&-
+  } 2>/dev/null
+  if [[ -z "${_FWBOT_SINK_WFD:-}" || -z "${_FWBOT_SINK_RFD:-}" ]]; then
+    fwbot__stop_sink
+    _FWBOT_SINK_FAILED=$1 _FWBOT_SINK_RETRY=$(( EPOCHSECONDS + 10 ))
+    return 1
+  fi
+  _FWBOT_SINK_PEER=$1
+}
+
+# Tear the relay down. If logger already exited (it does on any send error),
+# the lines it never read are taken back out of the pipe and appended directly.
+fwbot__stop_sink() {
+  local line alive=
+  kill -0 "${_FWBOT_SINK_PID:-x}" 2>/dev/null && alive=1
+  [[ -n "${_FWBOT_SINK_WFD:-}" ]] && exec {_FWBOT_SINK_WFD}>&-
+  if [[ -n "${_FWBOT_SINK_RFD:-}" ]]; then
+    if [[ -z "$alive" ]]; then
+      while IFS= read -r -t 1 -u "$_FWBOT_SINK_RFD" line; do
+        printf '%s\n' "$line" >> "${_FWBOT_CMD_LOG_FILE}" 2>/dev/null
+      done
+    fi
+    exec {_FWBOT_SINK_RFD}<&-
+  fi
+  unset _FWBOT_SINK_PID _FWBOT_SINK_WFD _FWBOT_SINK_RFD _FWBOT_SINK_PEER
+}
+
+# Send one event line to the collector, or append it to the log directly when
+# the collector is not running, is not keeping up, or the event does not fit in
+# one datagram. Never blocks the prompt.
+fwbot__emit() {
+  local LC_ALL=C peer=
+  # The collector publishes its pid next to the socket; a different pid means it
+  # restarted and the relay's connection points at the old, dead socket.
+  [[ -S "${_FWBOT_CMD_SOCKET}" ]] && { read -r peer < "${_FWBOT_CMD_SOCKET}.pid"; } 2>/dev/null
+  if [[ -n "${_FWBOT_SINK_PID:-}" ]]; then
+    if [[ "$peer" != "${_FWBOT_SINK_PEER:-}" ]]; then
+      fwbot__stop_sink
+    elif ! kill -0 "$_FWBOT_SINK_PID" 2>/dev/null; then
+      # Same collector but the relay died on a send error: retry later, not on every prompt
+      fwbot__stop_sink
+      _FWBOT_SINK_FAILED=$peer _FWBOT_SINK_RETRY=$(( EPOCHSECONDS + 10 ))
+    fi
+  fi
+  if [[ -n "$peer" ]] && (( ${#1} < _FWBOT_CMD_MAX_BYTES - 128 )); then
+    if [[ -n "${_FWBOT_SINK_PID:-}" ]] || fwbot__start_sink "$peer"; then
+      # logger empties the pipe whenever it can send, so unread data means the
+      # collector is stalled; an empty pipe always has room for one event.
+      if ! read -t 0 -u "$_FWBOT_SINK_RFD"; then
+        printf '%s\n' "$1" >&"$_FWBOT_SINK_WFD" 2>/dev/null && return 0
+      fi
+    fi
+  fi
+  printf '%s\n' "$1" >> "${_FWBOT_CMD_LOG_FILE}" 2>/dev/null || true
+}
+
+# Set ts/tz_offset/tz_json in the caller's scope from bash builtins only.
+# The same second is used for all three so they always agree.
+fwbot__now() {
+  local epoch stamp tz_name
+  epoch=${EPOCHREALTIME:-}
+  epoch=${epoch%[.,]*}
+  printf -v stamp '%(%Y-%m-%dT%H:%M:%S %z %Z)T' "${epoch:--1}"
+  tz_offset=${stamp#* }
+  tz_name=${tz_offset#* }
+  tz_offset=${tz_offset%% *}
+  ts="${stamp%% *}${tz_offset:0:3}:${tz_offset:3}"
+  fwbot__json_escape_to tz_json "$tz_name"
 }
 
 fwbot__capture_last_command() {
@@ -61,34 +186,26 @@ fwbot__should_ignore_command() {
 
 # Emit one-time session_start when a new interactive shell begins
 fwbot__maybe_session_start() {
+  # Per-shell cache: nested shells inherit the session id but not these fields
+  fwbot__init_session_fields
   if [[ -n "${FIREWALLBOT_SESSION_STARTED:-}" ]]; then
     return 0
   fi
   # Generate a lightweight session id and export it so subshells inherit
-  local rnd ts
-  ts=$(date -u +%s)
+  local rnd epoch
+  epoch=${EPOCHREALTIME:-}
+  epoch=${epoch%[.,]*}
+  printf -v epoch '%(%s)T' "${epoch:--1}"
   rnd=$(( (RANDOM<<16) ^ RANDOM ))
-  export FIREWALLBOT_SESSION_ID="${ts}-${PPID:-0}-${rnd}"
+  export FIREWALLBOT_SESSION_ID="${epoch}-${PPID:-0}-${rnd}"
   export FIREWALLBOT_SESSION_STARTED=1
 
-  local epoch_iso user uid gid cwd host tty ip port tz_offset tz_name tz_json
-  epoch_iso=$(date +%Y-%m-%dT%H:%M:%S%:z)
-  tz_offset=$(date +%z)
-  tz_name=$(date +%Z)
-  tz_json=$(fwbot__json_escape "$tz_name")
-  user=${USER:-$(id -un)}
-  uid=${UID:-$(id -u)}
-  gid=${GID:-$(id -g)}
-  cwd=${PWD}
-  host=$(hostname -s 2>/dev/null || hostname)
-  tty=$(tty 2>/dev/null || echo "unknown")
-  if [[ -n "$SSH_CONNECTION" ]]; then
-    ip=$(awk '{print $1}' <<<"$SSH_CONNECTION"); port=$(awk '{print $2}' <<<"$SSH_CONNECTION")
-  else
-    ip="local"; port=""
-  fi
-  printf '{"type":"session_start","ts":"%s","tz_offset":"%s","tz_name":"%s","sid":"%s","user":"%s","uid":%s,"gid":%s,"ip":"%s","port":"%s","tty":"%s","cwd":"%s","ppid":%s,"pid":%s,"host":"%s"}\n' \
-    "$epoch_iso" "$tz_offset" "$tz_json" "$FIREWALLBOT_SESSION_ID" "$user" "$uid" "$gid" "$ip" "$port" "$tty" "$cwd" "${PPID:-0}" "$$" "$host" >> "${_FWBOT_CMD_LOG_FILE}" 2>/dev/null || true
+  local ts tz_offset tz_json cwd line
+  fwbot__now
+  fwbot__json_escape_to cwd "$PWD"
+  printf -v line '{"type":"session_start","ts":"%s","tz_offset":"%s","tz_name":"%s","sid":"%s","user":"%s","uid":%s,"gid":%s,"ip":"%s","port":"%s","tty":"%s","cwd":"%s","ppid":%s,"pid":%s,"host":"%s"}' \
+    "$ts" "$tz_offset" "$tz_json" "$FIREWALLBOT_SESSION_ID" "$_FWBOT_USER" "$_FWBOT_UID" "$_FWBOT_GID" "$_FWBOT_IP" "$_FWBOT_PORT" "$_FWBOT_TTY" "$cwd" "${PPID:-0}" "$$" "$_FWBOT_HOST"
+  fwbot__emit "$line"
 }
 
 fwbot__log_session_stop() {
@@ -101,25 +218,13 @@ fwbot__log_session_stop() {
     return 0
   fi
 
-  local epoch_iso user uid gid cwd host tty ip port tz_offset tz_name tz_json
-  epoch_iso=$(date +%Y-%m-%dT%H:%M:%S%:z)
-  tz_offset=$(date +%z)
-  tz_name=$(date +%Z)
-  tz_json=$(fwbot__json_escape "$tz_name")
-  user=${USER:-$(id -un)}
-  uid=${UID:-$(id -u)}
-  gid=${GID:-$(id -g)}
-  cwd=${PWD}
-  host=$(hostname -s 2>/dev/null || hostname)
-  tty=$(tty 2>/dev/null || echo "unknown")
-  if [[ -n "$SSH_CONNECTION" ]]; then
-    ip=$(awk '{print $1}' <<<"$SSH_CONNECTION"); port=$(awk '{print $2}' <<<"$SSH_CONNECTION")
-  else
-    ip="local"; port=""
-  fi
-
-  printf '{"type":"session_stop","ts":"%s","tz_offset":"%s","tz_name":"%s","sid":"%s","user":"%s","uid":%s,"gid":%s,"ip":"%s","port":"%s","tty":"%s","cwd":"%s","rc":%s,"host":"%s"}\n' \
-    "$epoch_iso" "$tz_offset" "$tz_json" "$FIREWALLBOT_SESSION_ID" "$user" "$uid" "$gid" "$ip" "$port" "$tty" "$cwd" "$rc" "$host" >> "${_FWBOT_CMD_LOG_FILE}" 2>/dev/null || true
+  local ts tz_offset tz_json cwd line
+  fwbot__init_session_fields
+  fwbot__now
+  fwbot__json_escape_to cwd "$PWD"
+  printf -v line '{"type":"session_stop","ts":"%s","tz_offset":"%s","tz_name":"%s","sid":"%s","user":"%s","uid":%s,"gid":%s,"ip":"%s","port":"%s","tty":"%s","cwd":"%s","rc":%s,"host":"%s"}' \
+    "$ts" "$tz_offset" "$tz_json" "$FIREWALLBOT_SESSION_ID" "$_FWBOT_USER" "$_FWBOT_UID" "$_FWBOT_GID" "$_FWBOT_IP" "$_FWBOT_PORT" "$_FWBOT_TTY" "$cwd" "$rc" "$_FWBOT_HOST"
+  fwbot__emit "$line"
 }
 
 fwbot__install_exit_trap() {
@@ -148,30 +253,20 @@ fwbot_log_last_command() {
     fwbot_log_last_command*|history\ *|history) __FWBOT_LOGGING=0; return 0 ;;
   esac
 
-  local epoch_iso user uid gid cwd host tty ip port tz_offset tz_name tz_json
-  epoch_iso=$(date +%Y-%m-%dT%H:%M:%S%:z)
-  tz_offset=$(date +%z)
-  tz_name=$(date +%Z)
-  tz_json=$(fwbot__json_escape "$tz_name")
-  user=${USER:-$(id -un)}
-  uid=${UID:-$(id -u)}
-  gid=${GID:-$(id -g)}
-  cwd=${PWD}
-  host=$(hostname -s 2>/dev/null || hostname)
-  tty=$(tty 2>/dev/null || echo "unknown")
-  if [[ -n "$SSH_CONNECTION" ]]; then
-    ip=$(awk '{print $1}' <<<"$SSH_CONNECTION"); port=$(awk '{print $2}' <<<"$SSH_CONNECTION")
-  else
-    ip="local"; port=""
-  fi
-  local cmd_json; cmd_json=$(fwbot__json_escape "$cmd")
+  # No external processes here: everything comes from builtins or the session cache
+  local ts tz_offset tz_json cwd cmd_json line
+  fwbot__init_session_fields
+  fwbot__now
+  fwbot__json_escape_to cwd "$PWD"
+  fwbot__json_escape_to cmd_json "$cmd"
   if [[ -n "${FIREWALLBOT_SESSION_ID:-}" ]]; then
-    printf '{"type":"exec","ts":"%s","tz_offset":"%s","tz_name":"%s","sid":"%s","user":"%s","uid":%s,"gid":%s,"ip":"%s","port":"%s","tty":"%s","cwd":"%s","rc":%s,"cmd":"%s","host":"%s"}\n' \
-      "$epoch_iso" "$tz_offset" "$tz_json" "$FIREWALLBOT_SESSION_ID" "$user" "$uid" "$gid" "$ip" "$port" "$tty" "$cwd" "$rc" "$cmd_json" "$host" >> "${_FWBOT_CMD_LOG_FILE}" 2>/dev/null || true
+    printf -v line '{"type":"exec","ts":"%s","tz_offset":"%s","tz_name":"%s","sid":"%s","user":"%s","uid":%s,"gid":%s,"ip":"%s","port":"%s","tty":"%s","cwd":"%s","rc":%s,"cmd":"%s","host":"%s"}' \
+      "$ts" "$tz_offset" "$tz_json" "$FIREWALLBOT_SESSION_ID" "$_FWBOT_USER" "$_FWBOT_UID" "$_FWBOT_GID" "$_FWBOT_IP" "$_FWBOT_PORT" "$_FWBOT_TTY" "$cwd" "$rc" "$cmd_json" "$_FWBOT_HOST"
   else
-    printf '{"type":"exec","ts":"%s","tz_offset":"%s","tz_name":"%s","user":"%s","uid":%s,"gid":%s,"ip":"%s","port":"%s","tty":"%s","cwd":"%s","rc":%s,"cmd":"%s","host":"%s"}\n' \
-      "$epoch_iso" "$tz_offset" "$tz_json" "$user" "$uid" "$gid" "$ip" "$port" "$tty" "$cwd" "$rc" "$cmd_json" "$host" >> "${_FWBOT_CMD_LOG_FILE}" 2>/dev/null || true
+    printf -v line '{"type":"exec","ts":"%s","tz_offset":"%s","tz_name":"%s","user":"%s","uid":%s,"gid":%s,"ip":"%s","port":"%s","tty":"%s","cwd":"%s","rc":%s,"cmd":"%s","host":"%s"}' \
+      "$ts" "$tz_offset" "$tz_json" "$_FWBOT_USER" "$_FWBOT_UID" "$_FWBOT_GID" "$_FWBOT_IP" "$_FWBOT_PORT" "$_FWBOT_TTY" "$cwd" "$rc" "$cmd_json" "$_FWBOT_HOST"
   fi
+  fwbot__emit "$line"
   FWBOT_LAST_CMD=''
   __FWBOT_LOGGING=0
 }
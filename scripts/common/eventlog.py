@@ -0,0 +1,274 @@
+"""FireWallBot shared JSONL event writer.
+
+``EventWriter`` buffers serialized events and hands them to the log file in
+batches (group commit): a batch is written once ``FIREWALLBOT_LOG_FLUSH_KB``
+have accumulated or the oldest buffered event is ``FIREWALLBOT_LOG_FLUSH_MS``
+old. ``FIREWALLBOT_LOG_DURABILITY`` decides what happens after each batch
+write: ``none`` leaves it in the file object's buffer, ``flush`` pushes it to
+the kernel, ``fsync`` also waits for the disk.
+
+Long-running writers publish ``<log>.pid`` so logkeeper can send SIGHUP after
+renaming the log away; the file is also reopened when its inode changes. They
+also turn SIGTERM into ``SystemExit`` so buffered events are written on stop.
+"""
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import os
+import pathlib
+import signal
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+FLUSH_BYTES = int(float(os.getenv("FIREWALLBOT_LOG_FLUSH_KB", "64")) * 1024)
+FLUSH_INTERVAL = float(os.getenv("FIREWALLBOT_LOG_FLUSH_MS", "200")) / 1000.0
+DURABILITY = os.getenv("FIREWALLBOT_LOG_DURABILITY", "flush").strip().lower()
+DURABILITY_LEVELS = ("none", "flush", "fsync")
+# High-volume kinds are only written to the log, never mirrored to stdout/journald.
+QUIET_KINDS: Set[str] = {
+    kind.strip()
+    for kind in os.getenv(
+        "FIREWALLBOT_JOURNAL_QUIET_KINDS",
+        "network_connection,network_connection_closed,process_exec,process_exit,file_event",
+    ).split(",")
+    if kind.strip()
+}
+STATS_INTERVAL = float(os.getenv("FIREWALLBOT_LOG_STATS_INTERVAL", "300"))
+REOPEN_CHECK_INTERVAL = 1.0
+PID_SUFFIX = ".pid"
+
+_SIGNAL_WRITERS: List["EventWriter"] = []
+
+
+def iso_local(ts: Optional[float] = None) -> str:
+    moment = _dt.datetime.fromtimestamp(ts or time.time(), tz=_dt.timezone.utc).astimezone()
+    return moment.replace(microsecond=0).isoformat()
+
+
+def pid_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(path.name + PID_SUFFIX)
+
+
+def _on_terminate(_signum, _frame) -> None:
+    # Unwind normally so ``with EventWriter(...)`` blocks write out their buffers.
+    raise SystemExit(0)
+
+
+def _on_reopen_signal(_signum, _frame) -> None:
+    # Only set flags here; the flusher thread reopens outside signal context.
+    for writer in list(_SIGNAL_WRITERS):
+        writer._reopen_requested = True
+
+
+class EventWriter:
+    """Buffered, thread-safe JSONL writer with group commit."""
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        *,
+        mirror: bool = False,
+        quiet_kinds: Optional[Set[str]] = None,
+        flush_bytes: int = FLUSH_BYTES,
+        flush_interval: float = FLUSH_INTERVAL,
+        durability: str = DURABILITY,
+        stats_interval: float = STATS_INTERVAL,
+        reopen_signal: bool = False,
+    ) -> None:
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_LEVELS)}, got {durability!r}")
+        self.path = pathlib.Path(path)
+        self.mirror = mirror
+        self.quiet_kinds = QUIET_KINDS if quiet_kinds is None else quiet_kinds
+        self.flush_bytes = max(1, flush_bytes)
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.stats_interval = stats_interval
+        self._cond = threading.Condition(threading.Lock())
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._oldest = 0.0
+        self._closed = False
+        self._reopen_requested = False
+        self._next_check = 0.0
+        self._counters: Dict[str, int] = {
+            "events": 0,
+            "bytes_written": 0,
+            "batches": 0,
+            "size_flushes": 0,
+            "time_flushes": 0,
+            "max_queue_depth": 0,
+            "mirrored": 0,
+            "mirror_skipped": 0,
+            "reopens": 0,
+        }
+        self._open()
+        self._pid_file: Optional[pathlib.Path] = None
+        if reopen_signal:
+            self._register_reopen_signal()
+        self._flusher = threading.Thread(target=self._run, name="eventlog-flush", daemon=True)
+        self._flusher.start()
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = self.path.open("ab")
+        st = os.fstat(self._fh.fileno())
+        self._ident = (st.st_dev, st.st_ino)
+
+    def _register_reopen_signal(self) -> None:
+        try:
+            if not _SIGNAL_WRITERS:
+                signal.signal(signal.SIGHUP, _on_reopen_signal)
+                if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+                    signal.signal(signal.SIGTERM, _on_terminate)
+        except ValueError:
+            # Not the main thread: rely on the inode check alone.
+            return
+        _SIGNAL_WRITERS.append(self)
+        self._pid_file = pid_path(self.path)
+        tmp = self._pid_file.with_name(self._pid_file.name + ".tmp")
+        tmp.write_text(f"{os.getpid()}\n", encoding="ascii")
+        os.replace(tmp, self._pid_file)
+
+    def _reopen_if_rotated(self, now: float) -> None:
+        if not self._reopen_requested:
+            if now < self._next_check:
+                return
+            self._next_check = now + REOPEN_CHECK_INTERVAL
+            try:
+                st = os.stat(self.path)
+                if (st.st_dev, st.st_ino) == self._ident:
+                    return
+            except FileNotFoundError:
+                pass
+        self._reopen_requested = False
+        self._fh.close()
+        self._open()
+        self._counters["reopens"] += 1
+
+    def write(self, event: Dict) -> None:
+        line = json.dumps(event, ensure_ascii=False)
+        mirrored = None
+        if self.mirror:
+            mirrored = event.get("kind") not in self.quiet_kinds
+            if mirrored:
+                print(line, flush=True)
+        self.write_line(line, mirrored)
+
+    def write_line(self, line: str, mirrored: Optional[bool] = None) -> None:
+        """Queue one already-serialized JSON line (without the trailing newline)."""
+        data = (line + "\n").encode("utf-8", "backslashreplace")
+        with self._cond:
+            if self._closed:
+                raise ValueError("write to closed EventWriter")
+            if mirrored is not None:
+                self._counters["mirrored" if mirrored else "mirror_skipped"] += 1
+            if not self._buffer:
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            self._buffer.append(data)
+            self._buffered += len(data)
+            self._counters["events"] += 1
+            if len(self._buffer) > self._counters["max_queue_depth"]:
+                self._counters["max_queue_depth"] = len(self._buffer)
+            if self._buffered >= self.flush_bytes:
+                self._counters["size_flushes"] += 1
+                self._commit()
+
+    def _commit(self) -> None:
+        """Write the buffered batch with one call and apply the durability policy; lock held."""
+        self._reopen_if_rotated(time.monotonic())
+        if not self._buffer:
+            return
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        self._fh.write(data)
+        if self.durability != "none":
+            self._fh.flush()
+        if self.durability == "fsync":
+            os.fdatasync(self._fh.fileno())
+        self._counters["bytes_written"] += len(data)
+        self._counters["batches"] += 1
+
+    def flush(self) -> None:
+        with self._cond:
+            self._commit()
+            self._fh.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters plus the current queue depth (events/bytes buffered but not yet written)."""
+        with self._cond:
+            return {"queue_depth": len(self._buffer), "queue_bytes": self._buffered, **self._counters}
+
+    def _run(self) -> None:
+        next_stats = time.monotonic() + self.stats_interval if self.stats_interval > 0 else None
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                if self._buffer and now - self._oldest >= self.flush_interval:
+                    self._counters["time_flushes"] += 1
+                    self._commit()
+                else:
+                    # Idle writers still pick up a rotation promptly so logkeeper's
+                    # grace period covers anything left in the old file.
+                    self._reopen_if_rotated(now)
+                if next_stats is not None and now >= next_stats:
+                    next_stats = now + self.stats_interval
+                    self._queue_stats()
+                timeout = REOPEN_CHECK_INTERVAL
+                if self._buffer:
+                    timeout = min(timeout, max(0.0, self._oldest + self.flush_interval - now))
+                if next_stats is not None:
+                    timeout = min(timeout, max(0.0, next_stats - now))
+                self._cond.wait(timeout)
+
+    def _queue_stats(self) -> None:
+        event = {
+            "ts": iso_local(),
+            "kind": "event_writer_stats",
+            "log": self.path.name,
+            "queue_depth": len(self._buffer),
+            "queue_bytes": self._buffered,
+            **self._counters,
+        }
+        data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append(data)
+        self._buffered += len(data)
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._commit()
+            self._closed = True
+            self._cond.notify()
+        self._flusher.join()
+        self._fh.close()
+        if self in _SIGNAL_WRITERS:
+            _SIGNAL_WRITERS.remove(self)
+        if self._pid_file is not None:
+            try:
+                if self._pid_file.read_text(encoding="ascii").strip() == str(os.getpid()):
+                    self._pid_file.unlink()
+            except OSError:
+                pass
+
+    def __enter__(self) -> "EventWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_event(handle, event: Dict) -> None:
+    """Write ``event`` through an ``EventWriter``, or as one flushed line to a plain text stream."""
+    if isinstance(handle, EventWriter):
+        handle.write(event)
+        return
+    handle.write(json.dumps(event, ensure_ascii=False) + "\n")
+    handle.flush()
@@ -0,0 +1,95 @@
+"""FireWallBot shared inotify bindings.
+
+ctypes declarations for ``inotify_init1``/``inotify_add_watch``/
+``inotify_rm_watch``, the ``IN_*`` constants from ``linux/inotify.h`` and a
+decoder for the ``struct inotify_event`` records returned by ``read(2)``.
+Used by filewatcher's native engine and logkeeper's log directory watch.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+# Sorted by bit value; event name lists derived from it keep this order.
+INOTIFY_FLAGS: Dict[str, int] = {
+    "IN_ACCESS": 0x00000001,
+    "IN_MODIFY": 0x00000002,
+    "IN_ATTRIB": 0x00000004,
+    "IN_CLOSE_WRITE": 0x00000008,
+    "IN_CLOSE_NOWRITE": 0x00000010,
+    "IN_OPEN": 0x00000020,
+    "IN_MOVED_FROM": 0x00000040,
+    "IN_MOVED_TO": 0x00000080,
+    "IN_CREATE": 0x00000100,
+    "IN_DELETE": 0x00000200,
+    "IN_DELETE_SELF": 0x00000400,
+    "IN_MOVE_SELF": 0x00000800,
+    "IN_UNMOUNT": 0x00002000,
+    "IN_Q_OVERFLOW": 0x00004000,
+    "IN_IGNORED": 0x00008000,
+    "IN_ISDIR": 0x40000000,
+}
+IN_ALL_EVENTS = 0x00000FFF
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+IN_MODIFY = INOTIFY_FLAGS["IN_MODIFY"]
+IN_ATTRIB = INOTIFY_FLAGS["IN_ATTRIB"]
+IN_CLOSE_WRITE = INOTIFY_FLAGS["IN_CLOSE_WRITE"]
+IN_CLOSE_NOWRITE = INOTIFY_FLAGS["IN_CLOSE_NOWRITE"]
+IN_MOVED_FROM = INOTIFY_FLAGS["IN_MOVED_FROM"]
+IN_MOVED_TO = INOTIFY_FLAGS["IN_MOVED_TO"]
+IN_CREATE = INOTIFY_FLAGS["IN_CREATE"]
+IN_DELETE = INOTIFY_FLAGS["IN_DELETE"]
+IN_DELETE_SELF = INOTIFY_FLAGS["IN_DELETE_SELF"]
+IN_Q_OVERFLOW = INOTIFY_FLAGS["IN_Q_OVERFLOW"]
+IN_IGNORED = INOTIFY_FLAGS["IN_IGNORED"]
+IN_ISDIR = INOTIFY_FLAGS["IN_ISDIR"]
+# struct inotify_event: wd, mask, cookie, len, followed by ``len`` bytes of NUL-padded name
+INOTIFY_EVENT = struct.Struct("iIII")
+
+InotifyEvent = Tuple[int, int, int, str]
+
+
+def load_libc() -> Optional[ctypes.CDLL]:
+    """libc with the inotify signatures declared, or None when they are unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        libc.inotify_rm_watch.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def inotify_init(libc: ctypes.CDLL, flags: int = IN_NONBLOCK | IN_CLOEXEC) -> int:
+    """``inotify_init1(flags)``; raises OSError on failure."""
+    fd = libc.inotify_init1(flags)
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+    return fd
+
+
+def parse_events(data: bytes) -> List[InotifyEvent]:
+    """Decode a ``read(2)`` buffer into ``(wd, mask, cookie, name)`` tuples."""
+    view = memoryview(data)
+    size = len(data)
+    header = INOTIFY_EVENT.size
+    unpack = INOTIFY_EVENT.unpack_from
+    events: List[InotifyEvent] = []
+    offset = 0
+    while offset + header <= size:
+        wd, mask, cookie, length = unpack(view, offset)
+        start = offset + header
+        offset = start + length
+        name = os.fsdecode(bytes(view[start:offset]).split(b"\0", 1)[0]) if length else ""
+        events.append((wd, mask, cookie, name))
+    return events
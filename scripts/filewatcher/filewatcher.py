@@ -2,20 +2,62 @@
 """FireWallBot file system watcher for monitoring file changes."""
 from __future__ import annotations
 
+import abc
+import argparse
+import ctypes
 import datetime as _dt
-import importlib
+import errno
+import fnmatch
+import functools
+import hashlib
 import json
 import os
 import pathlib
+import queue
 import re
+import select
+import stat as _stat
+import struct
 import subprocess
 import sys
+import threading
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Dict, List, Optional, Set, Tuple
 
 import shutil
 
+try:
+    import grp
+    import pwd
+except ImportError:  # 非 POSIX 平台
+    grp = pwd = None
+
 REPO_ROOT = pathlib.Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "scripts" / "common"))
+
+from eventlog import EventWriter, write_event  # noqa: E402
+from inotify import (  # noqa: E402
+    IN_ALL_EVENTS,
+    IN_CLOEXEC,
+    IN_CREATE,
+    IN_DELETE,
+    IN_DELETE_SELF,
+    IN_IGNORED,
+    IN_ISDIR,
+    IN_MODIFY,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_NONBLOCK,
+    IN_ONLYDIR,
+    IN_Q_OVERFLOW,
+    INOTIFY_FLAGS,
+    inotify_init,
+    parse_events,
+)
+from inotify import load_libc as load_inotify_libc  # noqa: E402
+
 LOG_DIR = pathlib.Path(os.getenv("FIREWALLBOT_LOG_DIR", str(REPO_ROOT / "log")))
 LOG_FILE = pathlib.Path(os.getenv("FIREWALLBOT_FILEWATCH_LOG", str(LOG_DIR / "filewatcher.jsonl")))
 
@@ -46,8 +88,81 @@ WATCH_EVENTS = [e.strip() for e in WATCH_EVENTS if e.strip()]
 EXCLUDE_PATTERNS = os.getenv("FIREWALLBOT_EXCLUDE_PATTERNS", "*.tmp,*.log,*.swp").split(",")
 EXCLUDE_PATTERNS = [p.strip() for p in EXCLUDE_PATTERNS if p.strip()]
 
+FILEWATCH_BACKEND = os.getenv("FIREWALLBOT_FILEWATCH_BACKEND", "inotify").strip().lower()
+INOTIFY_READ_BUFFER = int(os.getenv("FIREWALLBOT_INOTIFY_READ_BUFFER", str(256 * 1024)))
+WALK_WORKERS = int(os.getenv("FIREWALLBOT_WALK_WORKERS", "8"))
+WATCH_LIMIT_WARN_RATIO = 0.9
+ENRICH_WORKERS = int(os.getenv("FIREWALLBOT_ENRICH_WORKERS", "4"))
+ENRICH_QUEUE_SIZE = int(os.getenv("FIREWALLBOT_ENRICH_QUEUE", "8192"))
+NAME_CACHE_TTL = float(os.getenv("FIREWALLBOT_NAME_CACHE_TTL", "300"))
+PIPELINE_STATS_INTERVAL = float(os.getenv("FIREWALLBOT_PIPELINE_STATS_INTERVAL", "300"))
+HASH_DIRS = [d.strip() for d in os.getenv("FIREWALLBOT_HASH_DIRS", "").split(",") if d.strip()]
+HASH_INDEX = pathlib.Path(os.getenv("FIREWALLBOT_HASH_INDEX", str(LOG_DIR / "filewatcher_hashes.json")))
+HASH_MAX_SIZE = int(os.getenv("FIREWALLBOT_HASH_MAX_SIZE", str(256 * 1024 * 1024)))
+HASH_WORKERS = int(os.getenv("FIREWALLBOT_HASH_WORKERS", "4"))
+HASH_SAVE_INTERVAL = float(os.getenv("FIREWALLBOT_HASH_SAVE_INTERVAL", "60"))
+HASH_CHUNK = 1024 * 1024
+# 默认关闭：开启后 file_event 会多出 event_types/count/first_ts/last_ts 字段
+COALESCE_WINDOW = float(os.getenv("FIREWALLBOT_COALESCE_WINDOW", "0"))
+COALESCE_MAX_PENDING = int(os.getenv("FIREWALLBOT_COALESCE_MAX_PENDING", "4096"))
+SNAPSHOT_QUEUE_SIZE = int(os.getenv("FIREWALLBOT_SNAPSHOT_QUEUE", "65536"))
+# 溢出重建后每轮事件循环最多补发的合成事件数，其余留到下一轮
+RESYNC_BATCH = 4096
+
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
+# 可能改变文件内容、需要计算哈希的事件
+IN_HASH = (
+    INOTIFY_FLAGS["IN_CREATE"]
+    | INOTIFY_FLAGS["IN_MODIFY"]
+    | INOTIFY_FLAGS["IN_ATTRIB"]
+    | INOTIFY_FLAGS["IN_CLOSE_WRITE"]
+    | INOTIFY_FLAGS["IN_MOVED_TO"]
+)
+# 可在窗口内合并的事件；其余（删除、移动等）作为屏障立即输出
+IN_COALESCE = (
+    INOTIFY_FLAGS["IN_MODIFY"]
+    | INOTIFY_FLAGS["IN_ATTRIB"]
+    | INOTIFY_FLAGS["IN_CLOSE_WRITE"]
+    | INOTIFY_FLAGS["IN_CLOSE_NOWRITE"]
+    | INOTIFY_FLAGS["IN_CREATE"]
+)
+# fanotify 常量（linux/fanotify.h）；事件位与 inotify 相同，FAN_ONDIR 与 IN_ISDIR 相同
+FAN_CLOEXEC = 0x00000001
+FAN_NONBLOCK = 0x00000002
+FAN_CLASS_NOTIF = 0x00000000
+FAN_REPORT_DIR_FID = 0x00000400
+FAN_REPORT_NAME = 0x00000800
+FAN_REPORT_DFID_NAME = FAN_REPORT_DIR_FID | FAN_REPORT_NAME
+FAN_MARK_ADD = 0x00000001
+FAN_MARK_MOUNT = 0x00000010
+FAN_MARK_FILESYSTEM = 0x00000100
+FAN_ONDIR = 0x40000000
+FAN_EVENT_INFO_TYPE_DFID_NAME = 2
+FAN_EVENT_INFO_TYPE_DFID = 3
+FAN_DIRENT_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+# 按文件描述符上报（旧内核）时只支持内容类事件
+FAN_FD_EVENTS = IN_MODIFY | INOTIFY_FLAGS["IN_CLOSE_WRITE"]
+FAN_FID_EVENTS = FAN_FD_EVENTS | INOTIFY_FLAGS["IN_ATTRIB"] | FAN_DIRENT_EVENTS
+# 挂载点标记不能订阅的事件（内核返回 EINVAL），只有文件系统标记可以
+FAN_INODE_EVENTS = FAN_DIRENT_EVENTS | INOTIFY_FLAGS["IN_ATTRIB"]
+# fanotify 会把同一对象上的多个事件合并成一条，按发生的逻辑顺序拆开
+FAN_SPLIT_ORDER = (
+    IN_CREATE,
+    IN_MOVED_TO,
+    IN_MODIFY,
+    INOTIFY_FLAGS["IN_ATTRIB"],
+    INOTIFY_FLAGS["IN_CLOSE_WRITE"],
+    IN_MOVED_FROM,
+    IN_DELETE,
+)
+AT_FDCWD = -100
+# struct fanotify_event_metadata
+FANOTIFY_EVENT = struct.Struct("IBBHQii")
+# struct fanotify_event_info_header + __kernel_fsid_t + struct file_handle 头部
+FANOTIFY_INFO = struct.Struct("BBHiiIi")
+FANOTIFY_DIR_CACHE = 4096
+
 
 class DependencyError(RuntimeError):
     """Raised when a required dependency is missing."""
@@ -61,52 +176,771 @@ def log_service_error(message: str, **extra: Dict) -> None:
     print(json.dumps(payload, ensure_ascii=False), file=sys.stderr)
 
 
-def dependency_status() -> Tuple[bool, bool]:
-    """Return availability flags for inotify.adapters and fswatch."""
+def load_libc():
+    """加载 libc（inotify 签名见 common/inotify.py）并声明 fanotify 系统调用签名，不可用时返回 None"""
+    libc = load_inotify_libc()
+    if libc is None:
+        return None
     try:
-        importlib.import_module("inotify.adapters")
-        inotify_available = True
-    except ModuleNotFoundError:
-        inotify_available = False
+        libc.fanotify_init.argtypes = [ctypes.c_uint, ctypes.c_uint]
+        libc.fanotify_init.restype = ctypes.c_int
+        libc.fanotify_mark.argtypes = [ctypes.c_int, ctypes.c_uint, ctypes.c_uint64, ctypes.c_int, ctypes.c_char_p]
+        libc.fanotify_mark.restype = ctypes.c_int
+        libc.open_by_handle_at.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        libc.open_by_handle_at.restype = ctypes.c_int
+    except AttributeError:
+        # fanotify 为可选后端，缺失时仅影响 FIREWALLBOT_FILEWATCH_BACKEND=fanotify
+        pass
+    return libc
 
+
+def dependency_status() -> Tuple[bool, bool]:
+    """Return availability flags for the native inotify engine and fswatch."""
+    inotify_available = hasattr(select, "epoll") and load_libc() is not None
     fswatch_available = shutil.which("fswatch") is not None
     return inotify_available, fswatch_available
 
 
+def mask_names(mask: int) -> List[str]:
+    """把事件掩码展开为名称列表（按位值排序）"""
+    return [name for name, bit in INOTIFY_FLAGS.items() if mask & bit]
+
+
+SnapshotEntry = Tuple[int, int, int, bool]
+
+
+class ExcludeMatcher:
+    """启动时把排除规则编译成一个匹配器，事件路径上只做集合/字典查找。
+
+    - ``*.ext`` 形式归入后缀集合，按后缀长度切片查找；
+    - 不含通配符的文件名归入精确匹配集合；
+    - 以 ``/`` 开头的绝对路径（如 ``/var/log/journal``）或以 ``/`` 结尾的目录名
+      （如 ``node_modules/``）为目录级规则：路径前缀进入按路径分量构建的前缀树，
+      目录名进入目录名集合，命中的子树在建立监控时直接跳过，不占用 watch；
+    - 其余通配符规则（``prefix*``、``*word*``、``?``、``[...]``）合并为一个正则。
+    """
+
+    _TERMINAL = ""
+
+    def __init__(self, patterns: List[str]) -> None:
+        self.suffixes: Set[str] = set()
+        self.names: Set[str] = set()
+        self.dir_names: Set[str] = set()
+        self.prefix_trie: Dict[str, Dict] = {}
+        globs: List[str] = []
+        for pattern in patterns:
+            if pattern.startswith("/"):
+                self._add_prefix(pattern)
+            elif pattern.endswith("/"):
+                self.dir_names.add(pattern.rstrip("/"))
+            elif pattern.startswith("*") and not any(ch in pattern[1:] for ch in "*?["):
+                self.suffixes.add(pattern[1:])
+            elif not any(ch in pattern for ch in "*?["):
+                self.names.add(pattern)
+            else:
+                globs.append(fnmatch.translate(pattern))
+        self._suffix_lengths = sorted({len(suffix) for suffix in self.suffixes})
+        self._glob = re.compile("|".join(globs)) if globs else None
+
+    def _add_prefix(self, pattern: str) -> None:
+        node = self.prefix_trie
+        for part in pattern.strip("/").split("/"):
+            if part:
+                node = node.setdefault(part, {})
+        node[self._TERMINAL] = {}
+
+    def under_excluded_dir(self, path: str) -> bool:
+        """path 本身或其任一上级目录命中目录级规则"""
+        parts = [part for part in path.split("/") if part]
+        if self.dir_names and not self.dir_names.isdisjoint(parts):
+            return True
+        node = self.prefix_trie
+        if not node:
+            return False
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                return False
+            if self._TERMINAL in node:
+                return True
+        return False
+
+    def match_name(self, filename: str) -> bool:
+        if filename in self.names:
+            return True
+        for length in self._suffix_lengths:
+            if length <= len(filename) and filename[-length:] in self.suffixes:
+                return True
+        return self._glob is not None and self._glob.match(filename) is not None
+
+    def match(self, filepath: str) -> bool:
+        return self.match_name(os.path.basename(filepath)) or self.under_excluded_dir(filepath)
+
+
+EXCLUDE_MATCHER = ExcludeMatcher(EXCLUDE_PATTERNS)
+
+
+class TreeSnapshot:
+    """监控树的 stat 快照：路径 -> (inode, size, mtime_ns, is_dir)。
+
+    随事件增量更新；inotify 队列溢出后重新扫描并与之比对，补发丢失的事件。
+    """
+
+    def __init__(self) -> None:
+        self.entries: Dict[str, SnapshotEntry] = {}
+        # 初始遍历的后台线程通过 merge 写入，快照线程的修改与遍历同样持有该锁
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def entry(st: os.stat_result) -> SnapshotEntry:
+        return (st.st_ino, st.st_size, st.st_mtime_ns, (st.st_mode & 0o170000) == 0o040000)
+
+    def refresh(self, path: str) -> None:
+        try:
+            entry = self.entry(os.lstat(path))
+        except OSError:
+            self.discard(path)
+            return
+        with self._lock:
+            self.entries[path] = entry
+
+    def discard(self, path: str) -> None:
+        with self._lock:
+            old = self.entries.pop(path, None)
+            if old is not None and old[3]:
+                prefix = path.rstrip("/") + "/"
+                for child in [p for p in self.entries if p.startswith(prefix)]:
+                    del self.entries[child]
+
+    def merge(self, found: Dict[str, SnapshotEntry], overwrite: bool = True) -> None:
+        """并入一批扫描结果；overwrite=False 时保留事件循环已写入的较新条目"""
+        with self._lock:
+            if overwrite:
+                self.entries.update(found)
+            else:
+                for path, entry in found.items():
+                    self.entries.setdefault(path, entry)
+
+    def diff(self, fresh: Dict[str, SnapshotEntry]) -> Tuple[List[str], List[str], List[str]]:
+        """返回 (新增, 修改, 删除) 路径列表，并以 fresh 替换当前快照"""
+        with self._lock:
+            old = self.entries
+            created = [path for path in fresh if path not in old]
+            deleted = [path for path in old if path not in fresh]
+            modified = [path for path, entry in fresh.items() if path in old and old[path] != entry]
+            self.entries = fresh
+        return created, modified, deleted
+
+
+class SnapshotUpdater:
+    """在后台线程按顺序维护快照并执行溢出重建，读取线程只负责入队。
+
+    事件对应的 lstat、新目录扫描结果的合并以及溢出后的整树重新遍历都在该线程
+    完成，三者共用一个队列，按事件读取顺序生效。重建得到的差异放入 ``results``，
+    由事件循环分批补发（见 ``ResyncReplay``）。队列已满时入队会阻塞。
+    """
+
+    def __init__(self, snapshot: TreeSnapshot, rescan, queue_size: int = SNAPSHOT_QUEUE_SIZE) -> None:
+        self.snapshot = snapshot
+        self.rescan = rescan
+        self.results: "queue.Queue[Dict]" = queue.Queue()
+        self._queue: "queue.Queue[Tuple]" = queue.Queue(maxsize=max(1, queue_size))
+        self._resync_queued = False
+        threading.Thread(target=self._run, name="fw-snapshot", daemon=True).start()
+
+    def update(self, path: str, removed: bool) -> None:
+        self._queue.put(("update", path, removed))
+
+    def merge(self, found: Dict[str, SnapshotEntry]) -> None:
+        self._queue.put(("merge", found))
+
+    def request_resync(self, overflow_count: int, resync_count: int) -> bool:
+        """排队一次重建；已有尚未开始的重建时由它一并覆盖，返回 False"""
+        if self._resync_queued:
+            return False
+        self._resync_queued = True
+        self._queue.put(("resync", overflow_count, resync_count))
+        return True
+
+    def _run(self) -> None:
+        while True:
+            task = self._queue.get()
+            try:
+                if task[0] == "update":
+                    if task[2]:
+                        self.snapshot.discard(task[1])
+                    else:
+                        self.snapshot.refresh(task[1])
+                elif task[0] == "merge":
+                    self.snapshot.merge(task[1])
+                else:
+                    # 先清除标记再遍历：之后的溢出需要新的一次重建
+                    self._resync_queued = False
+                    self._resync(task[1], task[2])
+            except Exception as e:  # pylint: disable=broad-except
+                log_service_error("快照维护失败", details=str(e))
+            finally:
+                self._queue.task_done()
+
+    def _resync(self, overflow_count: int, resync_count: int) -> None:
+        started = time.monotonic()
+        created, modified, deleted = self.rescan()
+        entries = self.snapshot.entries
+        self.results.put({
+            "overflow_count": overflow_count,
+            "resync_count": resync_count,
+            "created": [(path, entries[path][3] if path in entries else False) for path in created],
+            "modified": modified,
+            "deleted": deleted,
+            "entries": len(self.snapshot),
+            "duration": round(time.monotonic() - started, 3),
+        })
+
+
+class ResyncReplay:
+    """把一次重建的差异补发为合成事件，每轮事件循环最多 ``batch`` 条"""
+
+    def __init__(self, result: Dict, batch: int = RESYNC_BATCH) -> None:
+        self.result = result
+        self.batch = batch
+        self._events: "deque[Tuple[int, str]]" = deque()
+        self._events.extend((IN_DELETE, path) for path in result["deleted"])
+        self._events.extend((IN_CREATE | (IN_ISDIR if is_dir else 0), path) for path, is_dir in result["created"])
+        self._events.extend((IN_MODIFY, path) for path in result["modified"])
+
+    def step(self, pipeline: "EnrichPipeline", engine: "InotifyEngine", coalescer: Optional["EventCoalescer"]) -> bool:
+        """补发下一批，全部补发后写出 resync_complete 并返回 True"""
+        synthetic = {"synthetic": True, "reason": "queue_overflow"}
+        for _ in range(min(self.batch, len(self._events))):
+            mask, path = self._events.popleft()
+            process_inotify_event(pipeline, engine, coalescer, mask, 0, *os.path.split(path), extra=synthetic)
+        if self._events:
+            return False
+        result = self.result
+        pipeline.emit({
+            "ts": iso_local(),
+            "kind": "resync_complete",
+            "overflow_count": result["overflow_count"],
+            "resync_count": result["resync_count"],
+            "created": len(result["created"]),
+            "modified": len(result["modified"]),
+            "deleted": len(result["deleted"]),
+            "entries": result["entries"],
+            "watches": len(engine.watches),
+            "duration": result["duration"],
+        })
+        return True
+
+
+class WatchEngine(abc.ABC):
+    """inotify 与 fanotify 引擎的公共接口；写出 file_event 时只用到快照相关属性"""
+
+    snapshot: Optional[TreeSnapshot] = None
+    updater: Optional[SnapshotUpdater] = None
+
+    @abc.abstractmethod
+    def read_events(self, timeout: Optional[float] = None) -> List[Tuple]:
+        """等待并返回一批事件，元组格式由各引擎定义"""
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """释放内核对象"""
+
+
+class InotifyEngine(WatchEngine):
+    """基于 ctypes 的原生 inotify 引擎。
+
+    通过 epoll 等待可读，一次读取大缓冲区并用 ``parse_events``（common/inotify.py）
+    批量解码 ``inotify_event``；wd -> 路径映射由引擎自行维护，
+    新建/移入的子目录会自动加入监控，移出监控树的目录会被移除。
+
+    初始监控树由后台线程并行遍历（``start_walk``），事件循环无需等待遍历结束；
+    映射表的修改由 ``_lock`` 保护。
+    """
+
+    def __init__(
+        self,
+        mask: int,
+        buffer_size: int = INOTIFY_READ_BUFFER,
+        exclude: Optional[ExcludeMatcher] = None,
+    ) -> None:
+        libc = load_libc()
+        if libc is None:
+            raise DependencyError("libc inotify functions not available")
+        self._libc = libc
+        self.fd = inotify_init(libc, IN_NONBLOCK | IN_CLOEXEC)
+        self.mask = mask | IN_CREATE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+        self.buffer_size = buffer_size
+        self.watches: Dict[int, str] = {}
+        self.paths: Dict[str, int] = {}
+        self._pending_moves: Dict[int, str] = {}
+        self.snapshot: Optional[TreeSnapshot] = None
+        self.updater: Optional[SnapshotUpdater] = None
+        self.exclude = exclude
+        self.pruned = 0
+        self.walk_done = threading.Event()
+        self.walk_seconds: Optional[float] = None
+        self._lock = threading.RLock()
+        self._epoll = select.epoll()
+        self._epoll.register(self.fd, select.EPOLLIN)
+
+    def close(self) -> None:
+        self._epoll.close()
+        os.close(self.fd)
+
+    def add_watch(self, path: str) -> Optional[int]:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                log_service_error(
+                    "inotify watch 数量已达上限，请调大 fs.inotify.max_user_watches",
+                    directory=path,
+                )
+            elif err not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                log_service_error("添加 inotify watch 失败", directory=path, details=os.strerror(err))
+            return None
+        with self._lock:
+            old = self.watches.get(wd)
+            if old is not None and old != path:
+                self.paths.pop(old, None)
+            self.watches[wd] = path
+            self.paths[path] = wd
+        return wd
+
+    def _watch_and_scan(self, path: str, entries: Optional[Dict[str, SnapshotEntry]]) -> Optional[List[str]]:
+        """注册 path 的 watch 后再列出目录，返回子目录；未注册时返回 None。
+
+        先 watch 后 scandir：遍历期间新建的子目录要么出现在列表里，要么由
+        父目录的 IN_CREATE 事件补上，不会遗漏。entries 只能是调用线程私有的字典。
+        """
+        if self.exclude is not None and self.exclude.under_excluded_dir(path):
+            # 目录级排除：整棵子树不注册 watch
+            with self._lock:
+                self.pruned += 1
+            return None
+        if self.add_watch(path) is None:
+            return None
+        subdirs: List[str] = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    if entries is not None:
+                        try:
+                            entries[entry.path] = TreeSnapshot.entry(entry.stat(follow_symlinks=False))
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+        return subdirs
+
+    def add_tree(self, root: str, entries: Optional[Dict[str, SnapshotEntry]] = None) -> int:
+        """在当前线程递归监控 root 下的全部目录，返回新增的 watch 数量。
+
+        启用快照时顺带记录遍历到的每个条目的 stat。
+        """
+        added = 0
+        stack = [root]
+        while stack:
+            subdirs = self._watch_and_scan(stack.pop(), entries)
+            if subdirs is None:
+                continue
+            added += 1
+            stack.extend(subdirs)
+        return added
+
+    def _scan_private(self, path: str, record: bool) -> Tuple[Optional[List[str]], Optional[Dict[str, SnapshotEntry]]]:
+        found: Optional[Dict[str, SnapshotEntry]] = {} if record else None
+        return self._watch_and_scan(path, found), found
+
+    def walk(
+        self,
+        roots: List[str],
+        entries: Optional[Dict[str, SnapshotEntry]] = None,
+        workers: int = WALK_WORKERS,
+    ) -> float:
+        """用线程池并行遍历多棵目录树（scandir 与 inotify_add_watch 均会释放 GIL），返回耗时秒数。
+
+        每个任务写入自己的字典，由调用线程汇总：传入 entries 时并入其中，
+        否则并入快照（不覆盖事件循环期间已更新的条目）。
+        """
+        started = time.monotonic()
+        snapshot = self.snapshot if entries is None else None
+        record = entries is not None or snapshot is not None
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fw-walk") as pool:
+            pending = {pool.submit(self._scan_private, root, record) for root in roots}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    subdirs, found = future.result()
+                    if found:
+                        if entries is not None:
+                            entries.update(found)
+                        elif snapshot is not None:
+                            snapshot.merge(found, overwrite=False)
+                    for subdir in subdirs or ():
+                        pending.add(pool.submit(self._scan_private, subdir, record))
+        return time.monotonic() - started
+
+    def start_walk(self, roots: List[str]) -> None:
+        """立即监控顶层目录，更深的层级交给后台线程并行补齐"""
+        for root in roots:
+            self.add_watch(root)
+
+        def run() -> None:
+            try:
+                self.walk_seconds = self.walk(roots)
+            except Exception as e:  # pylint: disable=broad-except
+                log_service_error("监控目录初始化失败", directory=",".join(roots), details=str(e))
+            finally:
+                self.walk_done.set()
+
+        threading.Thread(target=run, name="fw-walk", daemon=True).start()
+
+    def resync(self, roots: List[str]) -> Tuple[List[str], List[str], List[str]]:
+        """溢出后重新遍历监控树（补注册遗漏的目录），返回与快照的差异"""
+        fresh: Dict[str, SnapshotEntry] = {}
+        self.walk(roots, fresh)
+        if self.snapshot is None:
+            self.snapshot = TreeSnapshot()
+        return self.snapshot.diff(fresh)
+
+    def _subtree(self, root: str) -> List[str]:
+        prefix = root.rstrip("/") + "/"
+        return [path for path in self.paths if path == root or path.startswith(prefix)]
+
+    def remove_tree(self, root: str) -> None:
+        with self._lock:
+            for path in self._subtree(root):
+                wd = self.paths.pop(path)
+                self.watches.pop(wd, None)
+                self._libc.inotify_rm_watch(self.fd, wd)
+
+    def _rename_tree(self, old_root: str, new_root: str) -> None:
+        with self._lock:
+            for path in self._subtree(old_root):
+                wd = self.paths.pop(path)
+                new_path = new_root + path[len(old_root):]
+                self.watches[wd] = new_path
+                self.paths[new_path] = wd
+
+    def _merge_snapshot(self, found: Dict[str, SnapshotEntry]) -> None:
+        if self.updater is not None:
+            self.updater.merge(found)
+        elif self.snapshot is not None:
+            self.snapshot.merge(found)
+
+    def _read_raw(self) -> bytes:
+        chunks: List[bytes] = []
+        while True:
+            try:
+                data = os.read(self.fd, self.buffer_size)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            chunks.append(data)
+            if len(data) < self.buffer_size // 2:
+                break
+        return b"".join(chunks)
+
+    def read_events(self, timeout: Optional[float] = None) -> List[Tuple[int, int, str, str]]:
+        """等待并返回一批事件：``(mask, cookie, watch_path, filename)``"""
+        if not self._epoll.poll(timeout if timeout is not None else -1):
+            return []
+        watches = self.watches
+        events: List[Tuple[int, int, str, str]] = []
+        for wd, mask, cookie, name in parse_events(self._read_raw()):
+            if mask & IN_IGNORED:
+                with self._lock:
+                    path = watches.pop(wd, None)
+                    if path is not None and self.paths.get(path) == wd:
+                        del self.paths[path]
+                continue
+            watch_path = watches.get(wd, "")
+            if mask & IN_ISDIR and name:
+                full_path = os.path.join(watch_path, name)
+                if mask & IN_MOVED_FROM:
+                    self._pending_moves[cookie] = full_path
+                elif mask & IN_MOVED_TO and cookie in self._pending_moves:
+                    self._rename_tree(self._pending_moves.pop(cookie), full_path)
+                elif mask & IN_CREATE:
+                    # 子目录在 watch 建立前就可能已有内容（如 mkdir -p），扫描到的条目补发 IN_CREATE
+                    found: Dict[str, SnapshotEntry] = {}
+                    self.add_tree(full_path, found)
+                    self._merge_snapshot(found)
+                    events.append((mask, cookie, watch_path, name))
+                    for path, entry in found.items():
+                        parent, child = os.path.split(path)
+                        events.append((IN_CREATE | (IN_ISDIR if entry[3] else 0), 0, parent, child))
+                    continue
+                elif mask & IN_MOVED_TO:
+                    moved: Dict[str, SnapshotEntry] = {}
+                    self.add_tree(full_path, moved)
+                    self._merge_snapshot(moved)
+            events.append((mask, cookie, watch_path, name))
+        # 同一批次内没有配对 MOVED_TO 的目录已移出监控树
+        for old_path in self._pending_moves.values():
+            self.remove_tree(old_path)
+        self._pending_moves.clear()
+        return events
+
+
+class FanotifyEngine(WatchEngine):
+    """基于 fanotify 的整文件系统监控后端。
+
+    对每个监控目录所在的文件系统做一次 ``FAN_MARK_FILESYSTEM`` 标记，注册开销与
+    目录树规模无关；事件带有触发进程的 pid。不支持文件系统标记时，只在所选事件
+    不含创建/删除/移动/属性变更时退回 ``FAN_MARK_MOUNT``，否则抛出 DependencyError。
+    优先使用 ``FAN_REPORT_DFID_NAME``：事件携带父目录的 file handle 与文件名，
+    父目录路径通过 ``open_by_handle_at`` 解析并缓存；内核不支持时退回按文件描述符
+    上报，只能得到修改类事件。需要 CAP_SYS_ADMIN，权限不足时抛出 DependencyError。
+    """
+
+    def __init__(self, mask: int, roots: List[str], buffer_size: int = INOTIFY_READ_BUFFER) -> None:
+        libc = load_libc()
+        if libc is None or not hasattr(libc, "fanotify_init") or not hasattr(libc, "open_by_handle_at"):
+            raise DependencyError("libc fanotify functions not available")
+        self._libc = libc
+        self.buffer_size = buffer_size
+        self.snapshot: Optional[TreeSnapshot] = None
+        self.report = "dfid_name"
+        self.fd = libc.fanotify_init(
+            FAN_CLOEXEC | FAN_NONBLOCK | FAN_CLASS_NOTIF | FAN_REPORT_DFID_NAME,
+            os.O_RDONLY | os.O_LARGEFILE,
+        )
+        if self.fd < 0 and ctypes.get_errno() == errno.EINVAL:
+            self.report = "fd"
+            self.fd = libc.fanotify_init(FAN_CLOEXEC | FAN_NONBLOCK | FAN_CLASS_NOTIF, os.O_RDONLY | os.O_LARGEFILE)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise DependencyError(f"fanotify_init failed: {os.strerror(err)}")
+        supported = FAN_FID_EVENTS if self.report == "dfid_name" else FAN_FD_EVENTS
+        self.mask = mask & supported
+        if self.report == "dfid_name":
+            self.mask |= FAN_ONDIR
+        if not self.mask & supported:
+            os.close(self.fd)
+            raise DependencyError("fanotify 不支持所选的监控事件")
+        self.marks: List[Dict[str, str]] = []
+        self._mount_fds: Dict[int, int] = {}
+        self._dirs: "OrderedDict[Tuple[int, bytes], str]" = OrderedDict()
+        marked_devs: Set[int] = set()
+        for root in roots:
+            try:
+                dev = os.stat(root).st_dev
+            except OSError:
+                continue
+            if dev in marked_devs:
+                continue
+            mark_type = self._mark(root)
+            if mark_type is None:
+                continue
+            marked_devs.add(dev)
+            self.marks.append({"path": root, "type": mark_type})
+            self._mount_fds[os.statvfs(root).f_fsid] = os.open(root, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        if not self.marks:
+            self.close()
+            raise DependencyError("fanotify_mark 对所有监控目录均失败")
+        self._epoll = select.epoll()
+        self._epoll.register(self.fd, select.EPOLLIN)
+
+    def close(self) -> None:
+        if getattr(self, "_epoll", None) is not None:
+            self._epoll.close()
+        for fd in self._mount_fds.values():
+            os.close(fd)
+        os.close(self.fd)
+
+    def _mark(self, root: str) -> Optional[str]:
+        err = 0
+        for flag, mark_type in ((FAN_MARK_FILESYSTEM, "filesystem"), (FAN_MARK_MOUNT, "mount")):
+            if flag == FAN_MARK_MOUNT and self.mask & FAN_INODE_EVENTS:
+                # 挂载点标记无法订阅创建/删除/移动/属性事件，与其注定失败地尝试，不如整体回退到 inotify
+                self.close()
+                raise DependencyError(
+                    f"{root} 不支持文件系统标记（{os.strerror(err)}），挂载点标记无法上报目录项事件"
+                )
+            if self._libc.fanotify_mark(self.fd, FAN_MARK_ADD | flag, self.mask, AT_FDCWD, os.fsencode(root)) == 0:
+                return mark_type
+            err = ctypes.get_errno()
+            if err == errno.EPERM:
+                self.close()
+                raise DependencyError(f"fanotify_mark: {os.strerror(err)}")
+        log_service_error("fanotify_mark 失败", directory=root, details=os.strerror(err))
+        return None
+
+    def _dir_path(self, fsid: int, handle: bytes) -> Optional[str]:
+        """把目录 file handle 解析为路径（LRU 缓存）"""
+        key = (fsid, handle)
+        path = self._dirs.get(key)
+        if path is not None:
+            self._dirs.move_to_end(key)
+            return path
+        mount_fd = self._mount_fds.get(fsid)
+        candidates = [mount_fd] if mount_fd is not None else list(self._mount_fds.values())
+        for candidate in candidates:
+            fd = self._libc.open_by_handle_at(candidate, handle, os.O_PATH | os.O_CLOEXEC)
+            if fd < 0:
+                continue
+            try:
+                path = os.readlink(f"/proc/self/fd/{fd}")
+            except OSError:
+                path = None
+            finally:
+                os.close(fd)
+            break
+        if path is None:
+            return None
+        self._dirs[key] = path
+        if len(self._dirs) > FANOTIFY_DIR_CACHE:
+            self._dirs.popitem(last=False)
+        return path
+
+    @staticmethod
+    def _append_split(events: List[Tuple[int, str, str, int]], mask: int, dir_path: str, name: str, pid: int) -> None:
+        flags = mask & FAN_ONDIR
+        for bit in FAN_SPLIT_ORDER:
+            if mask & bit:
+                events.append((bit | flags, dir_path, name, pid))
+
+    def read_events(self, timeout: Optional[float] = None) -> List[Tuple[int, str, str, int]]:
+        """等待并返回一批事件：``(mask, dir_path, filename, pid)``，mask 与 inotify 位兼容"""
+        if not self._epoll.poll(timeout if timeout is not None else -1):
+            return []
+        try:
+            data = os.read(self.fd, self.buffer_size)
+        except BlockingIOError:
+            return []
+        view = memoryview(data)
+        size = len(data)
+        events: List[Tuple[int, str, str, int]] = []
+        offset = 0
+        while offset + FANOTIFY_EVENT.size <= size:
+            event_len, _, _, meta_len, mask, fd, pid = FANOTIFY_EVENT.unpack_from(view, offset)
+            end = offset + event_len
+            if event_len < FANOTIFY_EVENT.size:
+                break
+            if mask & IN_Q_OVERFLOW:
+                events.append((IN_Q_OVERFLOW, "", "", 0))
+            elif fd >= 0:
+                try:
+                    dir_path, name = os.path.split(os.readlink(f"/proc/self/fd/{fd}"))
+                    self._append_split(events, mask, dir_path, name, pid)
+                except OSError:
+                    pass
+                finally:
+                    os.close(fd)
+            else:
+                info = offset + meta_len
+                while info + FANOTIFY_INFO.size <= end:
+                    info_type, _, info_len, fsid0, fsid1, handle_bytes, _ = FANOTIFY_INFO.unpack_from(view, info)
+                    if info_len == 0:
+                        break
+                    if info_type in (FAN_EVENT_INFO_TYPE_DFID_NAME, FAN_EVENT_INFO_TYPE_DFID):
+                        handle_start = info + 12
+                        handle_end = handle_start + 8 + handle_bytes
+                        fsid = (fsid0 & 0xFFFFFFFF) | ((fsid1 & 0xFFFFFFFF) << 32)
+                        dir_path = self._dir_path(fsid, bytes(view[handle_start:handle_end]))
+                        name = ""
+                        if info_type == FAN_EVENT_INFO_TYPE_DFID_NAME:
+                            name = os.fsdecode(bytes(view[handle_end:info + info_len]).split(b"\0", 1)[0])
+                        if dir_path is not None:
+                            if name in ("", "."):
+                                # 事件对象是目录自身
+                                dir_path, name = os.path.split(dir_path)
+                            self._append_split(events, mask, dir_path, name, pid)
+                        break
+                    info += info_len
+            if mask & FAN_ONDIR and mask & (IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE):
+                # 目录被移动或删除，缓存中其下的路径可能已失效
+                self._dirs.clear()
+            offset = end
+        return events
+
+
+class ProcAttribution:
+    """pid -> {pid, exe, cmdline}，带短 TTL 缓存。
+
+    进程可能在事件读出前已经退出，此时只保留 pid。
+    """
+
+    def __init__(self, ttl: float = 2.0, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[int, Tuple[float, Dict]] = {}
+
+    def get(self, pid: int) -> Dict:
+        now = time.monotonic()
+        hit = self._entries.get(pid)
+        if hit is not None and hit[0] > now:
+            return hit[1]
+        info: Dict = {"pid": pid}
+        base = pathlib.Path("/proc") / str(pid)
+        try:
+            info["exe"] = os.readlink(base / "exe")
+        except OSError:
+            pass
+        try:
+            raw = (base / "cmdline").read_bytes()
+        except OSError:
+            pass
+        else:
+            parts = [seg.decode("utf-8", "replace") for seg in raw.split(b"\0") if seg]
+            if parts:
+                info["cmdline"] = " ".join(parts)
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+        self._entries[pid] = (now + self.ttl, info)
+        return info
+
+
 def iso_local(ts: Optional[float] = None) -> str:
     """生成本地时区的 ISO8601 时间戳"""
     moment = _dt.datetime.fromtimestamp(ts or time.time(), tz=_dt.timezone.utc).astimezone()
     return moment.replace(microsecond=0).isoformat()
 
 
-def write_event(handle, event: Dict) -> None:
-    """写入事件到日志文件"""
-    line = json.dumps(event, ensure_ascii=False)
-    handle.write(line + "\n")
-    handle.flush()
-
-
 def should_exclude_file(filepath: str) -> bool:
     """检查文件是否应该被排除"""
-    filename = os.path.basename(filepath)
-    for pattern in EXCLUDE_PATTERNS:
-        if pattern.startswith("*") and pattern.endswith("*"):
-            # 包含匹配
-            if pattern[1:-1] in filename:
-                return True
-        elif pattern.startswith("*"):
-            # 后缀匹配
-            if filename.endswith(pattern[1:]):
-                return True
-        elif pattern.endswith("*"):
-            # 前缀匹配
-            if filename.startswith(pattern[:-1]):
-                return True
-        else:
-            # 精确匹配
-            if filename == pattern:
-                return True
-    return False
+    return EXCLUDE_MATCHER.match(filepath)
+
+
+class NameCache:
+    """uid/gid -> 名称缓存（带 TTL）。
+
+    NSS/LDAP 后端的 ``getpwuid``/``getgrgid`` 可能阻塞数毫秒；查不到的 id 同样缓存，
+    避免对同一个未知 id 反复查询。
+    """
+
+    def __init__(self, lookup, ttl: float = NAME_CACHE_TTL) -> None:
+        self._lookup = lookup
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[Optional[str], float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: int) -> Optional[str]:
+        now = time.monotonic()
+        hit = self._entries.get(key)
+        if hit is not None and hit[1] > now:
+            return hit[0]
+        try:
+            name = self._lookup(key)
+        except (KeyError, OverflowError):
+            name = None
+        self._entries[key] = (name, now + self.ttl)
+        return name
+
+
+USER_NAMES = NameCache(lambda uid: pwd.getpwuid(uid).pw_name if pwd else None)
+GROUP_NAMES = NameCache(lambda gid: grp.getgrgid(gid).gr_name if grp else None)
 
 
 def get_file_info(filepath: str) -> Dict:
@@ -114,48 +948,275 @@ def get_file_info(filepath: str) -> Dict:
     info = {}
     try:
         stat = os.stat(filepath)
-        info.update({
-            "size": stat.st_size,
-            "mode": oct(stat.st_mode)[-3:],
-            "uid": stat.st_uid,
-            "gid": stat.st_gid,
-            "mtime": iso_local(stat.st_mtime),
-            "ctime": iso_local(stat.st_ctime)
-        })
-        
-        # 获取用户名和组名
+    except OSError:
+        return info
+    info.update({
+        "size": stat.st_size,
+        "mode": oct(stat.st_mode)[-3:],
+        "uid": stat.st_uid,
+        "gid": stat.st_gid,
+        "mtime": iso_local(stat.st_mtime),
+        "ctime": iso_local(stat.st_ctime)
+    })
+
+    # 获取用户名和组名
+    user = USER_NAMES.get(stat.st_uid)
+    if user is not None:
+        info["user"] = user
+    group = GROUP_NAMES.get(stat.st_gid)
+    if group is not None:
+        info["group"] = group
+    return info
+
+
+_HASH_BUFFERS = threading.local()
+
+
+def sha256_file(path: str) -> str:
+    """流式计算文件 SHA-256：每个线程复用一块缓冲区，readinto 后直接以 memoryview 喂给 hashlib"""
+    buffer = getattr(_HASH_BUFFERS, "buffer", None)
+    if buffer is None:
+        buffer = _HASH_BUFFERS.buffer = bytearray(HASH_CHUNK)
+    view = memoryview(buffer)
+    digest = hashlib.sha256()
+    with open(path, "rb", buffering=0) as fh:
+        while True:
+            count = fh.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+
+class HashIndex:
+    """持久化的 SHA-256 索引：路径 -> [dev, inode, size, mtime_ns, sha256]。
+
+    (dev, inode, size, mtime_ns) 未变的文件直接复用已有哈希，不会重新读取；
+    重命名或硬链接到同一 inode 的文件同样命中。索引以 JSON 原子替换写入
+    ``HASH_INDEX``，daemon 周期性保存，``--baseline`` 扫描结束时保存。
+    """
+
+    def __init__(self, path: pathlib.Path, dirs: List[str], max_size: int = HASH_MAX_SIZE) -> None:
+        self.path = path
+        self.prefixes = tuple(d.rstrip("/") + "/" for d in dirs)
+        self.max_size = max_size
+        self.files: Dict[str, List] = {}
+        self._by_key: Dict[Tuple[int, int, int, int], str] = {}
+        self._lock = threading.Lock()
+        self.dirty = False
+        self.hashed = 0
+        self.reused = 0
+        self.load()
+
+    def covers(self, path: str) -> bool:
+        return path.startswith(self.prefixes)
+
+    def load(self) -> None:
         try:
-            import pwd
-            info["user"] = pwd.getpwuid(stat.st_uid).pw_name
-        except (ImportError, KeyError):
-            pass
-            
+            with self.path.open("r", encoding="utf-8") as fh:
+                files = json.load(fh).get("files", {})
+        except (OSError, ValueError, AttributeError):
+            return
+        self.files = {path: entry for path, entry in files.items() if isinstance(entry, list) and len(entry) == 5}
+        self._by_key = {tuple(entry[:4]): entry[4] for entry in self.files.values()}
+
+    def save(self) -> None:
+        with self._lock:
+            if not self.dirty:
+                return
+            files = dict(self.files)
+            self._by_key = {tuple(entry[:4]): entry[4] for entry in files.values()}
+            self.dirty = False
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with tmp.open("w", encoding="utf-8") as fh:
+                json.dump({"version": 1, "files": files}, fh, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log_service_error("保存哈希索引失败", path=str(self.path), details=str(e))
+
+    def discard(self, path: str) -> None:
+        with self._lock:
+            if self.files.pop(path, None) is not None:
+                self.dirty = True
+
+    def digest(self, path: str) -> Tuple[Optional[str], Optional[str]]:
+        """返回 (sha256, 变化前的 sha256)；非普通文件、超过大小上限或无法读取时返回 (None, None)"""
         try:
-            import grp
-            info["group"] = grp.getgrgid(stat.st_gid).gr_name
-        except (ImportError, KeyError):
+            st = os.stat(path)
+        except OSError:
+            return None, None
+        if not _stat.S_ISREG(st.st_mode) or st.st_size > self.max_size:
+            return None, None
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            old = self.files.get(path)
+            sha = self._by_key.get(key)
+        if old is not None and tuple(old[:4]) == key:
+            self.reused += 1
+            return old[4], None
+        if sha is None:
+            try:
+                sha = sha256_file(path)
+            except OSError:
+                return None, None
+            self.hashed += 1
+        else:
+            self.reused += 1
+        with self._lock:
+            self.files[path] = [*key, sha]
+            self._by_key[key] = sha
+            self.dirty = True
+        previous = old[4] if old is not None and old[4] != sha else None
+        return sha, previous
+
+    def enrich(self, path: str) -> Dict:
+        sha, previous = self.digest(path)
+        if sha is None:
+            return {}
+        info = {"sha256": sha}
+        if previous is not None:
+            info["sha256_previous"] = previous
+        return info
+
+
+class EnrichPipeline:
+    """读取与补充文件信息解耦：事件循环只负责读 inotify，stat 与用户/组查询交给线程池。
+
+    事件循环按顺序为每条记录分配序号放入有界队列（``submit``，从不阻塞）；
+    worker 补充文件信息后交给写线程，写线程按序号重排后写出，保证输出顺序与
+    读取顺序一致。补充队列已满时进入降级模式：记录不做补充、带
+    ``"enriched": false`` 直接交给写线程；写队列也满时丢弃并计数。
+    补充过程抛出异常时同样输出未补充的记录，worker 继续工作。
+    某个 worker 长时间阻塞导致重排缓冲区超限时，写线程放弃等待并按序输出已完成的记录。
+    """
+
+    def __init__(
+        self,
+        handle,
+        workers: int = ENRICH_WORKERS,
+        queue_size: int = ENRICH_QUEUE_SIZE,
+        hasher: Optional[HashIndex] = None,
+    ) -> None:
+        self.handle = handle
+        self.hasher = hasher
+        self._enrich: "queue.Queue[Tuple[int, Dict, Dict, str]]" = queue.Queue(maxsize=queue_size)
+        self._output: "queue.Queue[Tuple[int, Dict]]" = queue.Queue(maxsize=queue_size * 2)
+        self._reorder_limit = queue_size * 2
+        self._seq = 0
+        self.submitted = 0
+        self.degraded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.reorder_skips = 0
+        self.max_depth = 0
+        self._threads = [
+            threading.Thread(target=self._work, name=f"fw-enrich-{index}", daemon=True)
+            for index in range(max(1, workers))
+        ]
+        self._threads.append(threading.Thread(target=self._write, name="fw-writer", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, head: Dict, tail: Dict, path: str) -> None:
+        """提交一条待补充的记录：输出为 head + 文件信息 + tail（仅由事件循环调用）"""
+        self.submitted += 1
+        try:
+            self._enrich.put_nowait((self._seq, head, tail, path))
+            self._seq += 1
+            self.max_depth = max(self.max_depth, self._enrich.qsize())
+            return
+        except queue.Full:
             pass
-            
-    except (OSError, IOError):
-        pass
-        
-    return info
+        record = dict(head)
+        record.update(tail)
+        record["enriched"] = False
+        try:
+            self._output.put_nowait((self._seq, record))
+            self._seq += 1
+            self.degraded += 1
+        except queue.Full:
+            self.dropped += 1
 
+    def emit(self, record: Dict) -> None:
+        """按顺序写出一条无需补充的记录（启动、溢出等控制事件）"""
+        self._output.put((self._seq, record))
+        self._seq += 1
 
-def monitor_with_inotify() -> None:
-    """使用 inotify 监控文件系统"""
-    try:
-        import inotify.adapters
-        import inotify.constants  # type: ignore
-    except ImportError as exc:
-        log_service_error(
-            "inotify module not available. Install with: pip install inotify",
-            dependency="inotify.adapters",
-            details=str(exc),
-        )
-        raise DependencyError("inotify.adapters not available")
+    def stats(self) -> Dict:
+        depth = self.max_depth
+        self.max_depth = 0
+        return {
+            "submitted": self.submitted,
+            "degraded": self.degraded,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "reorder_skips": self.reorder_skips,
+            "queue_depth": self._enrich.qsize(),
+            "queue_depth_max": depth,
+            "queue_capacity": self._enrich.maxsize,
+            "output_depth": self._output.qsize(),
+            "user_cache": len(USER_NAMES),
+            "group_cache": len(GROUP_NAMES),
+            **({"hashed": self.hasher.hashed, "hash_reused": self.hasher.reused} if self.hasher else {}),
+        }
+
+    def close(self, timeout: float = 5.0) -> None:
+        """等待已提交的记录写出（最多 timeout 秒）"""
+        deadline = time.monotonic() + timeout
+        while (self._enrich.unfinished_tasks or self._output.unfinished_tasks) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self.hasher is not None:
+            self.hasher.save()
+
+    def _work(self) -> None:
+        while True:
+            seq, head, tail, path = self._enrich.get()
+            try:
+                record = dict(head)
+                record.update(get_file_info(path))
+                if self.hasher is not None and head["mask"] & IN_HASH and self.hasher.covers(path):
+                    record.update(self.hasher.enrich(path))
+                record.update(tail)
+            except Exception as e:  # pylint: disable=broad-except
+                # 补充失败也必须交出该序号，否则写线程会一直等到重排超限
+                record = dict(head)
+                record.update(tail)
+                record["enriched"] = False
+                self.failed += 1
+                log_service_error("补充文件信息失败", path=path, details=str(e))
+            try:
+                self._output.put((seq, record))
+            finally:
+                self._enrich.task_done()
 
-    # 验证监控目录
+    def _write(self) -> None:
+        pending: Dict[int, Dict] = {}
+        next_seq = 0
+        while True:
+            seq, record = self._output.get()
+            try:
+                if seq < next_seq:
+                    # 重排超限后迟到的记录直接写出
+                    write_event(self.handle, record)
+                    continue
+                pending[seq] = record
+                while next_seq in pending:
+                    write_event(self.handle, pending.pop(next_seq))
+                    next_seq += 1
+                if len(pending) > self._reorder_limit:
+                    self.reorder_skips += 1
+                    for ready in sorted(pending):
+                        write_event(self.handle, pending.pop(ready))
+                        next_seq = ready + 1
+            except Exception as e:  # pylint: disable=broad-except
+                log_service_error("写入文件事件失败", details=str(e))
+            finally:
+                self._output.task_done()
+
+
+def resolve_watch_dirs() -> List[str]:
+    """验证监控目录，返回存在的绝对路径"""
     valid_dirs = []
     for watch_dir in WATCH_DIRS:
         if os.path.exists(watch_dir) and os.path.isdir(watch_dir):
@@ -169,17 +1230,19 @@ def monitor_with_inotify() -> None:
             "kind": "error", 
             "message": "No valid directories to monitor"
         })
-        return
-    
-    # 解析事件掩码
+    return valid_dirs
+
+
+def parse_event_mask() -> int:
+    """把 FIREWALLBOT_WATCH_EVENTS 解析为 inotify 事件掩码"""
     event_mask = 0
     missing_events: List[str] = []
     for name in WATCH_EVENTS:
         key = name.strip().upper()
         if not key:
             continue
-        if hasattr(inotify.constants, key):
-            event_mask |= getattr(inotify.constants, key)
+        if key in INOTIFY_FLAGS:
+            event_mask |= INOTIFY_FLAGS[key]
         else:
             missing_events.append(key)
 
@@ -190,87 +1253,385 @@ def monitor_with_inotify() -> None:
         )
 
     if event_mask == 0:
-        event_mask = inotify.constants.IN_ALL_EVENTS
+        event_mask = IN_ALL_EVENTS
+    return event_mask
+
+
+def monitor_with_inotify() -> None:
+    """使用内置的原生 inotify 引擎监控文件系统"""
+    valid_dirs = resolve_watch_dirs()
+    if not valid_dirs:
+        return
+    event_mask = parse_event_mask()
 
     # 创建 inotify 监控器
     try:
-        i = inotify.adapters.InotifyTree(valid_dirs[0], mask=event_mask)
-        for extra_dir in valid_dirs[1:]:
-            try:
-                i._load_tree(extra_dir)
-            except Exception as e:  # pylint: disable=broad-except
-                log_service_error(
-                    "额外监控目录初始化失败",
-                    directory=extra_dir,
-                    details=str(e),
-                )
-    except Exception as e:  # pylint: disable=broad-except
+        engine = InotifyEngine(event_mask, exclude=EXCLUDE_MATCHER)
+    except OSError as e:
         log_service_error(
             "Failed to create inotify watcher",
             details=str(e),
         )
         return
-    
-    with LOG_FILE.open("a", encoding="utf-8") as handle:
-        write_event(handle, {
-            "ts": iso_local(),
-            "kind": "filewatcher_start",
-            "watch_dirs": valid_dirs,
-            "watch_events": WATCH_EVENTS,
-            "exclude_patterns": EXCLUDE_PATTERNS
-        })
-        
-        for event in i.event_gen():
-            if event is not None:
-                (header, type_names, watch_path, filename) = event
-                
-                # 构建完整文件路径
-                if filename:
-                    full_path = os.path.join(watch_path, filename)
-                else:
-                    full_path = watch_path
-                
-                # 检查是否应该排除
-                if should_exclude_file(full_path):
-                    continue
-                
-                # 获取文件信息
-                file_info = get_file_info(full_path)
-                
-                # 构建事件记录
-                primary_type = type_names[0] if type_names else "UNKNOWN"
-                if primary_type not in WATCH_EVENTS and not {
-                    "IN_MOVED_FROM",
-                    "IN_MOVED_TO",
-                    "IN_CLOSE_WRITE",
-                    "IN_CLOSE_NOWRITE",
-                    "IN_DELETE_SELF",
-                    "IN_MOVE_SELF",
-                }.intersection(type_names):
-                    # 跳过未订阅的事件，减少噪音
-                    continue
+    engine.snapshot = TreeSnapshot()
+    engine.updater = SnapshotUpdater(engine.snapshot, functools.partial(engine.resync, valid_dirs))
+    engine.start_walk(valid_dirs)
+
+    with EventWriter(LOG_FILE, reopen_signal=True) as handle:
+        hasher = HashIndex(HASH_INDEX, HASH_DIRS) if HASH_DIRS else None
+        pipeline = EnrichPipeline(handle, hasher=hasher)
+        try:
+            run_inotify_loop(pipeline, engine, valid_dirs)
+        finally:
+            pipeline.close()
 
-                event_record = {
+
+def run_inotify_loop(pipeline: EnrichPipeline, engine: InotifyEngine, valid_dirs: List[str]) -> None:
+    """事件循环：读取 inotify、处理溢出重建，记录交给 pipeline 补充与写出"""
+    start_reported = False
+    coalescer: Optional[EventCoalescer] = None
+    if COALESCE_WINDOW > 0:
+        coalescer = EventCoalescer(functools.partial(write_file_event, pipeline, engine))
+    read_timeout = min(1.0, COALESCE_WINDOW) if coalescer is not None else 1.0
+    overflow_count = 0
+    resync_count = 0
+    resync_pending = False
+    replay: Optional[ResyncReplay] = None
+    next_stats = time.monotonic() + PIPELINE_STATS_INTERVAL
+    next_save = time.monotonic() + HASH_SAVE_INTERVAL
+    while True:
+        if not start_reported and engine.walk_done.is_set():
+            # 初始遍历完成后再写启动事件，便于给出完整的 watch 统计
+            pipeline.emit(start_event(engine, valid_dirs))
+            start_reported = True
+        if resync_pending and engine.walk_done.is_set():
+            # 初始遍历期间的溢出推迟到遍历结束后再比对，避免与未建完的快照比较
+            resync_pending = False
+            if engine.updater.request_resync(overflow_count, resync_count + 1):
+                resync_count += 1
+        # 重建在后台线程遍历，这里只分批补发已算好的差异
+        if replay is None and not engine.updater.results.empty():
+            replay = ResyncReplay(engine.updater.results.get_nowait())
+        if replay is not None and replay.step(pipeline, engine, coalescer):
+            replay = None
+        if time.monotonic() >= next_stats:
+            pipeline.emit({"ts": iso_local(), "kind": "pipeline_stats", **pipeline.stats()})
+            next_stats = time.monotonic() + PIPELINE_STATS_INTERVAL
+        if pipeline.hasher is not None and time.monotonic() >= next_save:
+            pipeline.hasher.save()
+            next_save = time.monotonic() + HASH_SAVE_INTERVAL
+        timeout = 0 if replay is not None else read_timeout
+        for mask, cookie, watch_path, filename in engine.read_events(timeout=timeout):
+            if mask & IN_Q_OVERFLOW:
+                if coalescer is not None:
+                    coalescer.flush()
+                overflow_count += 1
+                pipeline.emit({
                     "ts": iso_local(),
-                    "kind": "file_event",
-                    "event_type": primary_type,
-                    "path": full_path,
-                    "watch_path": watch_path,
-                    "filename": filename,
-                    "mask": header.mask,
-                    "cookie": header.cookie if hasattr(header, 'cookie') else None
-                }
-                
-                # 添加文件信息
-                event_record.update(file_info)
-                
-                # 特殊处理移动事件
-                if "IN_MOVED_FROM" in type_names:
-                    event_record["event_type"] = "MOVED_FROM"
-                elif "IN_MOVED_TO" in type_names:
-                    event_record["event_type"] = "MOVED_TO"
-                
-                write_event(handle, event_record)
+                    "kind": "queue_overflow",
+                    "overflow_count": overflow_count,
+                    "max_queued_events": read_inotify_limit("max_queued_events"),
+                })
+                if not engine.walk_done.is_set():
+                    resync_pending = True
+                elif engine.updater.request_resync(overflow_count, resync_count + 1):
+                    resync_count += 1
+                continue
+            process_inotify_event(pipeline, engine, coalescer, mask, cookie, watch_path, filename)
+        if coalescer is not None:
+            coalescer.flush(time.time())
+
+
+def monitor_with_fanotify() -> None:
+    """使用 fanotify 后端监控监控目录所在的整个文件系统，事件附带进程归属"""
+    valid_dirs = resolve_watch_dirs()
+    if not valid_dirs:
+        return
+    started = time.monotonic()
+    engine = FanotifyEngine(parse_event_mask(), valid_dirs)
+    setup_seconds = time.monotonic() - started
+    try:
+        with EventWriter(LOG_FILE, reopen_signal=True) as handle:
+            hasher = HashIndex(HASH_INDEX, HASH_DIRS) if HASH_DIRS else None
+            pipeline = EnrichPipeline(handle, hasher=hasher)
+            try:
+                pipeline.emit({
+                    "ts": iso_local(),
+                    "kind": "filewatcher_start",
+                    "backend": "fanotify",
+                    "watch_dirs": valid_dirs,
+                    "watch_events": WATCH_EVENTS,
+                    "exclude_patterns": EXCLUDE_PATTERNS,
+                    "marks": engine.marks,
+                    "report": engine.report,
+                    "setup_seconds": round(setup_seconds, 3),
+                })
+                run_fanotify_loop(pipeline, engine, valid_dirs)
+            finally:
+                pipeline.close()
+    finally:
+        engine.close()
+
+
+def run_fanotify_loop(pipeline: EnrichPipeline, engine: FanotifyEngine, valid_dirs: List[str]) -> None:
+    """fanotify 事件循环：按监控目录过滤整文件系统的事件，补充进程归属后交给 pipeline"""
+    prefixes = tuple(root.rstrip("/") + "/" for root in valid_dirs)
+    own_pid = os.getpid()
+    attribution = ProcAttribution()
+    coalescer: Optional[EventCoalescer] = None
+    if COALESCE_WINDOW > 0:
+        coalescer = EventCoalescer(functools.partial(write_file_event, pipeline, engine))
+    read_timeout = min(1.0, COALESCE_WINDOW) if coalescer is not None else 1.0
+    overflow_count = 0
+    next_stats = time.monotonic() + PIPELINE_STATS_INTERVAL
+    next_save = time.monotonic() + HASH_SAVE_INTERVAL
+    while True:
+        if time.monotonic() >= next_stats:
+            pipeline.emit({"ts": iso_local(), "kind": "pipeline_stats", **pipeline.stats()})
+            next_stats = time.monotonic() + PIPELINE_STATS_INTERVAL
+        if pipeline.hasher is not None and time.monotonic() >= next_save:
+            pipeline.hasher.save()
+            next_save = time.monotonic() + HASH_SAVE_INTERVAL
+        for mask, dir_path, filename, pid in engine.read_events(timeout=read_timeout):
+            if mask & IN_Q_OVERFLOW:
+                if coalescer is not None:
+                    coalescer.flush()
+                overflow_count += 1
+                pipeline.emit({
+                    "ts": iso_local(),
+                    "kind": "queue_overflow",
+                    "backend": "fanotify",
+                    "overflow_count": overflow_count,
+                })
+                continue
+            # 忽略自身写日志产生的事件以及监控目录之外的事件
+            if pid == own_pid:
+                continue
+            if not (dir_path + "/").startswith(prefixes):
+                continue
+            process_inotify_event(
+                pipeline, engine, coalescer, mask, 0, dir_path, filename, extra=attribution.get(pid),
+            )
+        if coalescer is not None:
+            coalescer.flush(time.time())
+
+
+def read_inotify_limit(name: str) -> Optional[int]:
+    """读取 /proc/sys/fs/inotify 下的内核限制"""
+    try:
+        return int(pathlib.Path("/proc/sys/fs/inotify", name).read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def start_event(engine: InotifyEngine, valid_dirs: List[str]) -> Dict:
+    """构建 filewatcher_start：watch 数量、遍历耗时以及与 max_user_watches 的距离"""
+    watches = len(engine.watches)
+    max_user_watches = read_inotify_limit("max_user_watches")
+    usage = round(watches / max_user_watches, 4) if max_user_watches else None
+    near_limit = usage is not None and usage >= WATCH_LIMIT_WARN_RATIO
+    event = {
+        "ts": iso_local(),
+        "kind": "filewatcher_start",
+        "backend": "inotify",
+        "watch_dirs": valid_dirs,
+        "watch_events": WATCH_EVENTS,
+        "exclude_patterns": EXCLUDE_PATTERNS,
+        "watches": watches,
+        "pruned_dirs": engine.pruned,
+        "walk_seconds": round(engine.walk_seconds, 3) if engine.walk_seconds is not None else None,
+        "max_user_watches": max_user_watches,
+        "watch_usage": usage,
+        "watch_limit_near": near_limit,
+    }
+    if near_limit:
+        log_service_error(
+            "inotify watch 数量接近上限，请调大 fs.inotify.max_user_watches 或增加目录级排除规则",
+            watches=watches,
+            max_user_watches=max_user_watches,
+        )
+    return event
+
+
+def is_synthetic(extra: Optional[Dict]) -> bool:
+    """重建时补发的合成事件不参与合并，也不更新快照"""
+    return bool(extra and extra.get("synthetic"))
+
+
+class PendingGroup:
+    __slots__ = ("mask", "cookie", "watch_path", "filename", "primary_type", "extra", "event_types", "count", "first", "last")
+
+    def __init__(self, mask, cookie, watch_path, filename, primary_type, extra, now) -> None:
+        self.mask = mask
+        self.cookie = cookie
+        self.watch_path = watch_path
+        self.filename = filename
+        self.primary_type = primary_type
+        self.extra = extra
+        self.event_types = [primary_type]
+        self.count = 1
+        self.first = now
+        self.last = now
+
+
+class EventCoalescer:
+    """按路径合并窗口期内的事件，减少重复的 stat 与写入。
+
+    创建、修改、属性变更等事件在 ``window`` 秒内合并为一条记录（带
+    ``event_types``/``count``/``first_ts``/``last_ts``）；删除、移动等事件作为
+    屏障：先输出全部已积累的记录（包括被移动/删除目录下的子路径），再立即
+    输出自身，从而保证创建/删除顺序以及移动事件 cookie 配对的先后顺序。fanotify 事件的 pid
+    与已积累记录不同时同样先输出旧记录，不同进程的写入不会归到同一进程名下。
+    待合并路径数超过 ``max_pending`` 时提前输出最早的记录。
+    """
+
+    def __init__(self, emit, window: float = COALESCE_WINDOW, max_pending: int = COALESCE_MAX_PENDING) -> None:
+        self.emit = emit
+        self.window = window
+        self.max_pending = max_pending
+        self._pending: "OrderedDict[str, PendingGroup]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _emit_group(self, path: str, group: PendingGroup) -> None:
+        self.emit(path, group.mask, group.cookie, group.watch_path, group.filename, group.primary_type, group.extra, group)
+
+    def add(self, path, mask, cookie, watch_path, filename, primary_type, extra=None, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        group = self._pending.get(path)
+        if group is not None and (extra or {}).get("pid") != (group.extra or {}).get("pid"):
+            self._emit_group(path, self._pending.pop(path))
+            group = None
+        synthetic = is_synthetic(extra)
+        if mask & IN_COALESCE and not (mask & IN_CREATE and group is not None) and not synthetic:
+            if group is not None:
+                if primary_type not in group.event_types:
+                    group.event_types.append(primary_type)
+                group.count += 1
+                group.last = now
+                return
+            self._pending[path] = PendingGroup(mask, cookie, watch_path, filename, primary_type, extra, now)
+            while len(self._pending) > self.max_pending:
+                self._emit_group(*self._pending.popitem(last=False))
+            return
+        if mask & IN_COALESCE and not synthetic:
+            # 同一路径的第二次创建：先输出旧记录再重新开始合并
+            self._emit_group(path, self._pending.pop(path))
+            self._pending[path] = PendingGroup(mask, cookie, watch_path, filename, primary_type, extra, now)
+            return
+        # 屏障：目录移动/删除会改变其下所有路径，暂存记录都早于屏障，全部先输出
+        self.flush()
+        self.emit(path, mask, cookie, watch_path, filename, primary_type, extra, None)
+
+    def flush(self, now: Optional[float] = None) -> None:
+        """输出已超过窗口期的记录；now 为 None 时全部输出"""
+        while self._pending:
+            path, group = next(iter(self._pending.items()))
+            if now is not None and now - group.first < self.window:
+                break
+            del self._pending[path]
+            self._emit_group(path, group)
+
+
+def update_snapshot(engine: WatchEngine, full_path: str, mask: int, filename: str, extra: Optional[Dict]) -> None:
+    """维护快照（合成事件来自重新扫描，快照已是最新）"""
+    if engine.snapshot is not None and not is_synthetic(extra) and filename:
+        removed = bool(mask & (IN_DELETE | IN_MOVED_FROM))
+        if engine.updater is not None:
+            # lstat 交给快照线程，读取线程不做文件系统调用
+            engine.updater.update(full_path, removed)
+        elif removed:
+            engine.snapshot.discard(full_path)
+        else:
+            engine.snapshot.refresh(full_path)
+
+
+def process_inotify_event(
+    pipeline: EnrichPipeline,
+    engine: WatchEngine,
+    coalescer: Optional[EventCoalescer],
+    mask: int,
+    cookie: int,
+    watch_path: str,
+    filename: str,
+    extra: Optional[Dict] = None,
+) -> None:
+    """处理单个 inotify 事件：排除、过滤未订阅类型后交给合并器或直接写出"""
+    type_names = mask_names(mask)
+
+    # 构建完整文件路径
+    if filename:
+        full_path = os.path.join(watch_path, filename)
+    else:
+        full_path = watch_path
+
+    # 检查是否应该排除
+    if should_exclude_file(full_path):
+        return
+
+    primary_type = type_names[0] if type_names else "UNKNOWN"
+    if primary_type not in WATCH_EVENTS and not {
+        "IN_MOVED_FROM",
+        "IN_MOVED_TO",
+        "IN_CLOSE_WRITE",
+        "IN_CLOSE_NOWRITE",
+        "IN_DELETE_SELF",
+        "IN_MOVE_SELF",
+    }.intersection(type_names):
+        # 跳过未订阅的事件，减少噪音；快照仍需跟上
+        update_snapshot(engine, full_path, mask, filename, extra)
+        return
+
+    if coalescer is not None:
+        coalescer.add(full_path, mask, cookie, watch_path, filename, primary_type, extra)
+    else:
+        write_file_event(pipeline, engine, full_path, mask, cookie, watch_path, filename, primary_type, extra)
+
+
+def write_file_event(
+    pipeline: EnrichPipeline,
+    engine: WatchEngine,
+    full_path: str,
+    mask: int,
+    cookie: int,
+    watch_path: str,
+    filename: str,
+    primary_type: str,
+    extra: Optional[Dict] = None,
+    group: Optional[PendingGroup] = None,
+) -> None:
+    """维护快照并把 file_event 交给 pipeline 补充文件信息后写出"""
+    update_snapshot(engine, full_path, mask, filename, extra)
+    if pipeline.hasher is not None and mask & (IN_DELETE | IN_MOVED_FROM):
+        pipeline.hasher.discard(full_path)
+
+    event_record = {
+        "ts": iso_local(),
+        "kind": "file_event",
+        "event_type": primary_type,
+        "path": full_path,
+        "watch_path": watch_path,
+        "filename": filename,
+        "mask": mask,
+        "cookie": cookie
+    }
+
+    # 特殊处理移动事件
+    if mask & IN_MOVED_FROM:
+        event_record["event_type"] = "MOVED_FROM"
+    elif mask & IN_MOVED_TO:
+        event_record["event_type"] = "MOVED_TO"
+
+    # 文件信息由 pipeline 补充在基础字段之后
+    tail: Dict = dict(extra) if extra else {}
+    if group is not None:
+        tail["event_types"] = group.event_types
+        tail["count"] = group.count
+        tail["first_ts"] = iso_local(group.first)
+        tail["last_ts"] = iso_local(group.last)
+
+    pipeline.submit(event_record, tail, full_path)
 
 
 def monitor_with_fswatch() -> None:
@@ -290,7 +1651,7 @@ def monitor_with_fswatch() -> None:
     cmd = ["fswatch", "-o", "--event-flags"]
     cmd.extend(WATCH_DIRS)
     
-    with LOG_FILE.open("a", encoding="utf-8") as handle:
+    with EventWriter(LOG_FILE, reopen_signal=True) as handle:
         write_event(handle, {
             "ts": iso_local(),
             "kind": "filewatcher_start",
@@ -333,8 +1694,99 @@ def monitor_with_fswatch() -> None:
             })
 
 
-def main() -> int:
+def baseline_scan(
+    index: HashIndex,
+    roots: List[str],
+    previous: Dict[str, str],
+    workers: int = HASH_WORKERS,
+) -> Dict[str, List[str]]:
+    """一次性扫描 roots 下的全部普通文件并与上次的索引（previous：路径 -> sha256）比对，返回 added/removed/changed 路径"""
+    files: List[str] = []
+    stack = [os.path.abspath(root) for root in roots]
+    while stack:
+        path = stack.pop()
+        if EXCLUDE_MATCHER.under_excluded_dir(path):
+            continue
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and not EXCLUDE_MATCHER.match(entry.path):
+                        files.append(entry.path)
+        except OSError:
+            continue
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fw-hash") as pool:
+        digests = dict(zip(files, pool.map(index.digest, files)))
+
+    scanned = {path for path, (sha, _) in digests.items() if sha is not None}
+    prefixes = tuple(os.path.abspath(root).rstrip("/") + "/" for root in roots)
+    removed = sorted(path for path in previous if path.startswith(prefixes) and path not in scanned)
+    for path in removed:
+        index.discard(path)
+    return {
+        "added": sorted(path for path in scanned if path not in previous),
+        "removed": removed,
+        "changed": sorted(path for path in scanned if path in previous and previous[path] != digests[path][0]),
+    }
+
+
+def run_baseline() -> int:
+    """--baseline：扫描 FIREWALLBOT_HASH_DIRS，写出与上次基线的差异并保存索引"""
+    if not HASH_DIRS:
+        log_service_error("基线扫描需要设置 FIREWALLBOT_HASH_DIRS")
+        return 1
+    index = HashIndex(HASH_INDEX, HASH_DIRS)
+    previous = {path: entry[4] for path, entry in index.files.items()}
+    started = time.monotonic()
+    changes = baseline_scan(index, HASH_DIRS, previous)
+    index.save()
+    summary = {
+        "ts": iso_local(),
+        "kind": "baseline_scan",
+        "roots": HASH_DIRS,
+        "index": str(HASH_INDEX),
+        "initial": not previous,
+        "files": sum(1 for path in index.files if index.covers(path)),
+        "added": len(changes["added"]),
+        "removed": len(changes["removed"]),
+        "changed": len(changes["changed"]),
+        "hashed": index.hashed,
+        "reused": index.reused,
+        "duration": round(time.monotonic() - started, 3),
+    }
+    # 一次性任务：守护进程可能同时在写，不登记 pid 文件
+    with EventWriter(LOG_FILE, stats_interval=0) as handle:
+        # 首次建立基线时不逐条输出 added，避免大量噪音
+        for change, paths in changes.items():
+            if not previous and change == "added":
+                continue
+            for path in paths:
+                event = {"ts": iso_local(), "kind": "baseline_change", "change": change, "path": path}
+                entry = index.files.get(path)
+                if entry is not None:
+                    event["sha256"] = entry[4]
+                if path in previous:
+                    event["sha256_previous"] = previous[path]
+                write_event(handle, event)
+        write_event(handle, summary)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
     """主函数"""
+    parser = argparse.ArgumentParser(description="FireWallBot FileWatcher")
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        help="扫描 FIREWALLBOT_HASH_DIRS 建立/比对 SHA-256 基线后退出",
+    )
+    args = parser.parse_args(argv)
+    if args.baseline:
+        return run_baseline()
+
     inotify_available, fswatch_available = dependency_status()
 
     print("FireWallBot FileWatcher starting...")
@@ -349,12 +1801,18 @@ def main() -> int:
 
     if not inotify_available and not fswatch_available:
         log_service_error(
-            "缺少 inotify.adapters 模块和 fswatch 工具，请安装至少一个依赖后重试",
-            dependency="inotify.adapters,fswatch",
+            "当前系统不支持 inotify（需要 Linux epoll/libc），且未找到 fswatch 工具",
+            dependency="inotify,fswatch",
         )
         return 1
 
     try:
+        if FILEWATCH_BACKEND == "fanotify":
+            try:
+                monitor_with_fanotify()
+                return 0
+            except DependencyError as exc:
+                log_service_error("fanotify 后端不可用，回退到 inotify", details=str(exc))
         monitor_with_inotify()
         return 0
     except DependencyError:
@@ -366,7 +1824,7 @@ def main() -> int:
         log_service_error("inotify 监控发生异常，尝试切换到 fswatch", details=str(exc))
 
     if not fswatch_available:
-        log_service_error("已无法回退到 fswatch，请安装 inotify.adapters 或 fswatch")
+        log_service_error("已无法回退到 fswatch，请安装 fswatch")
         return 1
 
     try:
@@ -2,23 +2,66 @@
 """FireWallBot log rotation helper."""
 from __future__ import annotations
 
+import ctypes
 import datetime as _dt
+import fnmatch
 import gzip
+import json
 import os
 import pathlib
-import shutil
+import re
+import select
+import signal
+import stat as _stat
+import sys
 import time
-from typing import Iterable, List, Sequence
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
 REPO_ROOT = pathlib.Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "scripts" / "common"))
+
+from inotify import (  # noqa: E402
+    IN_CREATE,
+    IN_DELETE,
+    IN_MODIFY,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    inotify_init,
+    load_libc,
+    parse_events,
+)
+
 LOG_DIR = pathlib.Path(os.getenv("FIREWALLBOT_LOG_DIR", str(REPO_ROOT / "log")))
 PATTERNS: Sequence[str] = [p.strip() for p in os.getenv("FIREWALLBOT_LOG_PATTERNS", "*.jsonl").split(",") if p.strip()]
 MAX_BYTES = int(float(os.getenv("FIREWALLBOT_ROTATE_MAX_MB", "20")) * 1024 * 1024)
 MAX_ARCHIVES = int(os.getenv("FIREWALLBOT_ROTATE_KEEP", "10"))
 POLL_INTERVAL = float(os.getenv("FIREWALLBOT_ROTATE_INTERVAL", "60"))
+COMPRESS_LEVEL = int(os.getenv("FIREWALLBOT_ROTATE_COMPRESS_LEVEL", "6"))
+COMPRESS_WORKERS = int(os.getenv("FIREWALLBOT_ROTATE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Raw bytes per gzip member; small members keep indexed time-range lookups cheap.
+CHUNK_BYTES = int(float(os.getenv("FIREWALLBOT_ROTATE_CHUNK_MB", "0.25")) * 1024 * 1024)
+# Time writers get to reopen the original path after a rename (syswatcher/filewatcher check every second).
+ROTATE_GRACE = float(os.getenv("FIREWALLBOT_ROTATE_GRACE", "5"))
+ROTATING_SUFFIX = ".rotating"
+# <stem>-<UTC timestamp>[-<n>]<suffix>.rotating, as produced by archive_name().
+ROTATING_RE = re.compile(r"^(?P<stem>.+)-\d{8}T\d{12}Z(?:-\d+)?(?P<suffix>\.[^.]+)\.rotating$")
+# Minimum spacing between size checks of files reported as modified by inotify.
+CHECK_INTERVAL = float(os.getenv("FIREWALLBOT_ROTATE_CHECK_INTERVAL", "1"))
+
+INDEX_SUFFIX = ".idx"
+# Long-running writers (scripts/common/eventlog.py) publish their pid as <log>.pid
+WRITER_PID_SUFFIX = ".pid"
+TS_RE = re.compile(rb'"ts"\s*:\s*"([^"]+)"')
+KIND_RE = re.compile(rb'"(?:kind|type)"\s*:\s*"([^"]+)"')
 
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
+_COMPRESS_POOL = ThreadPoolExecutor(max_workers=max(1, COMPRESS_WORKERS), thread_name_prefix="logkeeper-gzip")
+_ROTATION_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="logkeeper-rotate")
+
 
 def iter_targets() -> Iterable[pathlib.Path]:
     if not PATTERNS:
@@ -27,36 +70,410 @@ def iter_targets() -> Iterable[pathlib.Path]:
         yield from LOG_DIR.glob(pattern)
 
 
+def is_target(name: str) -> bool:
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in PATTERNS)
+
+
+class DirWatcher:
+    """Minimal inotify watch on LOG_DIR yielding ``(mask, name)`` pairs."""
+
+    MASK = IN_MODIFY | IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+
+    def __init__(self, directory: pathlib.Path) -> None:
+        libc = load_libc()
+        if libc is None:
+            raise OSError("libc inotify functions not available")
+        self.fd = inotify_init(libc)
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch failed: {os.strerror(err)}")
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+
+    def read(self, timeout: Optional[float]) -> List[Tuple[int, str]]:
+        millis = None if timeout is None else max(0, int(timeout * 1000))
+        if not self._poll.poll(millis):
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        return [(mask, name) for _, mask, _, name in parse_events(data)]
+
+
+class SizeCatalog:
+    """Sizes of live log files, refreshed only for files inotify reported as changed.
+
+    Each file is stat'ed at most once per check interval. The interval shrinks
+    (down to a tenth of ``CHECK_INTERVAL``) when the growth since the cached
+    size would reach ``MAX_BYTES`` before the next regular check, so bursts are
+    rotated close to the threshold while idle or slow files cost one stat per
+    interval at most.
+    """
+
+    def __init__(self) -> None:
+        # name -> (size, monotonic time of the stat)
+        self.sizes: Dict[str, Tuple[int, float]] = {}
+        # name -> last observed growth in bytes/s; kept across rotations of the same log
+        self.rates: Dict[str, float] = {}
+        self.due: Dict[str, float] = {}
+        self.dirty: Set[str] = set()
+
+    def observe(self, mask: int, name: str) -> None:
+        if not is_target(name):
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.forget(name)
+        else:
+            self.dirty.add(name)
+
+    def forget(self, name: str) -> None:
+        # The growth rate stays: a rotation renames the log away and recreates it.
+        self.sizes.pop(name, None)
+        self.due.pop(name, None)
+        self.dirty.discard(name)
+
+    def timeout(self, now: float) -> Optional[float]:
+        """Seconds until the next dirty file may be checked; None when idle."""
+        if not self.dirty:
+            return None
+        return max(0.0, min(self.due.get(name, 0.0) for name in self.dirty) - now)
+
+    def check(self, now: float) -> None:
+        for name in [name for name in self.dirty if self.due.get(name, 0.0) <= now]:
+            self.dirty.discard(name)
+            self.update(LOG_DIR / name, now)
+
+    def scan(self, now: float) -> None:
+        """Full directory pass (startup, safety net, inotify overflow or polling mode)."""
+        for target in iter_targets():
+            self.dirty.discard(target.name)
+            self.update(target, now)
+
+    def update(self, path: pathlib.Path, now: float) -> None:
+        name = path.name
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self.forget(name)
+            return
+        if not _stat.S_ISREG(stat.st_mode):
+            return
+        previous = self.sizes.get(name)
+        if previous is not None and now > previous[1]:
+            if stat.st_size > previous[0]:
+                self.rates[name] = (stat.st_size - previous[0]) / (now - previous[1])
+            elif stat.st_size == previous[0]:
+                self.rates.pop(name, None)
+        if stat.st_size >= MAX_BYTES:
+            rotate_file(path, stat)
+            # The recreated file shows up as IN_CREATE and is checked right away.
+            self.forget(name)
+            return
+        interval = CHECK_INTERVAL
+        rate = self.rates.get(name)
+        if rate:
+            headroom = (MAX_BYTES - stat.st_size) / rate
+            interval = min(CHECK_INTERVAL, max(CHECK_INTERVAL / 10, headroom / 2))
+        self.sizes[name] = (stat.st_size, now)
+        self.due[name] = now + interval
+
+
 def archive_name(path: pathlib.Path) -> pathlib.Path:
     timestamp = _dt.datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
     candidate = path.with_name(f"{path.stem}-{timestamp}{path.suffix}.gz")
     counter = 1
-    while candidate.exists():
+    while candidate.exists() or candidate.with_suffix(ROTATING_SUFFIX).exists():
         candidate = path.with_name(f"{path.stem}-{timestamp}-{counter}{path.suffix}.gz")
         counter += 1
     return candidate
 
 
-def rotate_file(path: pathlib.Path) -> None:
+def iter_chunks(handle, start: int, chunk_bytes: int = CHUNK_BYTES, final: bool = True) -> Iterator[bytes]:
+    """Yield line-aligned chunks of roughly ``chunk_bytes`` from ``start`` to EOF.
+
+    Unless ``final``, a trailing partial line is held back so that no line is
+    split across two members.
+    """
+    handle.seek(start)
+    carry = b""
+    while True:
+        block = handle.read(chunk_bytes)
+        if not block:
+            break
+        block = carry + block
+        cut = block.rfind(b"\n") + 1
+        if cut == 0:
+            carry = block
+            continue
+        carry = block[cut:]
+        yield block[:cut]
+    if carry and final:
+        yield carry
+
+
+def parse_ts(value: str) -> Optional[float]:
+    """ISO8601 timestamp (as written by the watchers) to epoch seconds."""
     try:
-        stat = path.stat()
-    except FileNotFoundError:
-        return
-    if stat.st_size < MAX_BYTES:
-        return
-    archive_path = archive_name(path)
+        return _dt.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def summarize_chunk(chunk: bytes) -> Dict:
+    """Index entry for one member: line count, min/max ``ts`` and ``kind``/``type`` values."""
+    stamps = [parse_ts(raw.decode("ascii", "replace")) for raw in set(TS_RE.findall(chunk))]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return {
+        "raw": len(chunk),
+        "lines": chunk.count(b"\n"),
+        "min_ts": min(stamps) if stamps else None,
+        "max_ts": max(stamps) if stamps else None,
+        "kinds": sorted({raw.decode("utf-8", "replace") for raw in KIND_RE.findall(chunk)}),
+    }
+
+
+def compress_member(chunk: bytes, level: int = COMPRESS_LEVEL) -> Tuple[bytes, Dict]:
+    """Compress one chunk into a complete gzip member (zlib releases the GIL) plus its index entry."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(chunk) + compressor.flush(), summarize_chunk(chunk)
+
+
+def compress_range(src: pathlib.Path, dst, start: int, members: List[Dict], final: bool = False) -> int:
+    """Append ``src[start:]`` to ``dst`` as parallel-compressed gzip members; return bytes read."""
+    consumed = 0
+    window = max(1, COMPRESS_WORKERS) * 2
+
+    def emit(future) -> None:
+        member, entry = future.result()
+        entry["offset"] = dst.tell()
+        entry["length"] = len(member)
+        dst.write(member)
+        members.append(entry)
+
+    with src.open("rb") as handle:
+        pending: List = []
+        for chunk in iter_chunks(handle, start, final=final):
+            consumed += len(chunk)
+            pending.append(_COMPRESS_POOL.submit(compress_member, chunk))
+            if len(pending) >= window:
+                emit(pending.pop(0))
+        for future in pending:
+            emit(future)
+    return consumed
+
+
+def index_path(archive: pathlib.Path) -> pathlib.Path:
+    return archive.with_name(archive.name + INDEX_SUFFIX)
+
+
+def write_index(archive: pathlib.Path, members: List[Dict]) -> None:
+    tmp = index_path(archive).with_suffix(INDEX_SUFFIX + ".tmp")
+    with tmp.open("w", encoding="utf-8") as handle:
+        json.dump({"version": 1, "archive": archive.name, "members": members}, handle, separators=(",", ":"))
+    os.replace(tmp, index_path(archive))
+
+
+def read_index(archive: pathlib.Path) -> Optional[List[Dict]]:
+    """Member index of an archive, or None when the sidecar is missing or unreadable."""
+    try:
+        with index_path(archive).open("r", encoding="utf-8") as handle:
+            return json.load(handle)["members"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def select_members(
+    members: List[Dict],
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    kinds: Optional[Set[str]] = None,
+) -> List[Dict]:
+    """Members that may contain records with ``start <= ts <= end`` and a matching kind/type."""
+    selected = []
+    for member in members:
+        if start is not None and member["max_ts"] is not None and member["max_ts"] < start:
+            continue
+        if end is not None and member["min_ts"] is not None and member["min_ts"] > end:
+            continue
+        if kinds and member["kinds"] and kinds.isdisjoint(member["kinds"]):
+            continue
+        selected.append(member)
+    return selected
+
+
+def iter_archive_lines(
+    archive: pathlib.Path,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    kinds: Optional[Set[str]] = None,
+) -> Iterator[bytes]:
+    """Raw lines from the members of ``archive`` the index says may match.
+
+    Without an index the whole archive is decompressed. Lines are not filtered
+    individually; use ``iter_records`` for exact matches.
+    """
+    members = read_index(archive)
+    with archive.open("rb") as handle:
+        if members is None:
+            with gzip.open(handle) as stream:
+                yield from stream
+            return
+        for member in select_members(members, start, end, kinds):
+            handle.seek(member["offset"])
+            data = zlib.decompressobj(31).decompress(handle.read(member["length"]))
+            yield from data.splitlines(keepends=True)
+
+
+def iter_records(
+    archive: pathlib.Path,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    kinds: Optional[Set[str]] = None,
+) -> Iterator[Dict]:
+    """Decoded records of ``archive`` with ``start <= ts <= end`` (epoch seconds) and kind/type in ``kinds``."""
+    for line in iter_archive_lines(archive, start, end, kinds):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if kinds and record.get("kind", record.get("type")) not in kinds:
+            continue
+        if start is not None or end is not None:
+            stamp = parse_ts(record.get("ts", "")) if isinstance(record.get("ts"), str) else None
+            if stamp is None or (start is not None and stamp < start) or (end is not None and stamp > end):
+                continue
+        yield record
+
+
+def compress_rotated(rotated: pathlib.Path) -> None:
+    """Compress a renamed log into ``<name>.gz`` and remove it once writers are done."""
+    archive_path = rotated.with_suffix(".gz")
     tmp_archive = archive_path.with_suffix(archive_path.suffix + ".tmp")
+    elapsed = 0.0
+    offset = 0
+    members: List[Dict] = []
     try:
-        with path.open("rb") as src, gzip.open(tmp_archive, "wb") as dst:
-            shutil.copyfileobj(src, dst)
+        with tmp_archive.open("wb") as dst:
+            # Late appends from writers that have not reopened yet become extra members.
+            last_size = -1
+            while True:
+                started = time.monotonic()
+                offset += compress_range(rotated, dst, offset, members)
+                elapsed += time.monotonic() - started
+                time.sleep(min(1.0, ROTATE_GRACE))
+                size = rotated.stat().st_size
+                if size <= offset or size == last_size:
+                    break
+                last_size = size
+            offset += compress_range(rotated, dst, offset, members, final=True)
+        write_index(archive_path, members)
         tmp_archive.rename(archive_path)
+        rotated.unlink()
     finally:
         if tmp_archive.exists():
             tmp_archive.unlink(missing_ok=True)
-    with path.open("wb"):
+    elapsed = max(elapsed, 1e-6)
+    compressed = archive_path.stat().st_size
+    print(
+        f"[logkeeper] compressed {rotated.name} -> {archive_path.name}:"
+        f" {offset} -> {compressed} bytes ({compressed / max(offset, 1):.1%}),"
+        f" {elapsed:.2f}s, {offset / elapsed / 1024 / 1024:.1f} MiB/s,"
+        f" level={COMPRESS_LEVEL} workers={COMPRESS_WORKERS} members={len(members)}"
+    )
+
+
+def finish_rotation(path: pathlib.Path, rotated: pathlib.Path) -> None:
+    try:
+        time.sleep(ROTATE_GRACE)
+        compress_rotated(rotated)
+        enforce_retention(path)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[logkeeper] failed to compress {rotated.name}: {exc}")
+
+
+def notify_writer(path: pathlib.Path, rotated: pathlib.Path) -> None:
+    """SIGHUP the registered writer of ``path`` so it reopens right away.
+
+    The pid is only signalled if that process really holds ``rotated`` open,
+    so a stale pid file can never hit an unrelated process.
+    """
+    try:
+        pid = int(path.with_name(path.name + WRITER_PID_SUFFIX).read_text(encoding="ascii").strip())
+    except (OSError, ValueError):
+        return
+    fd_dir = pathlib.Path(f"/proc/{pid}/fd")
+    try:
+        holds = any(os.readlink(fd) == str(rotated) for fd in fd_dir.iterdir())
+    except OSError:
+        return
+    if not holds:
+        return
+    try:
+        os.kill(pid, signal.SIGHUP)
+    except OSError:
+        return
+    print(f"[logkeeper] signalled writer {pid} to reopen {path.name}")
+
+
+def rotate_file(path: pathlib.Path, stat: Optional[os.stat_result] = None) -> None:
+    """Rename an oversized log out of the way and compress it in the background.
+
+    Writers append with O_APPEND, so lines written after the rename land in the
+    renamed file until the writer reopens the original path (syswatcher and
+    filewatcher are sent SIGHUP and also check once a second; the cmdwatcher
+    collector checks once a second and shells reopen per command); nothing is
+    lost and the live file is never truncated. The rename never waits for an
+    earlier segment of the same log: each ``.rotating`` name is unique and the
+    compressions queue up on the rotation pool.
+    """
+    try:
+        if stat is None:
+            stat = path.stat()
+        if stat.st_size < MAX_BYTES:
+            return
+        rotated = archive_name(path).with_suffix(ROTATING_SUFFIX)
+        os.rename(path, rotated)
+    except FileNotFoundError:
+        return
+    # Recreate the live file with the same mode/owner so readers never miss it.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, stat.st_mode & 0o7777)
+    try:
+        os.fchown(fd, stat.st_uid, stat.st_gid)
+    except OSError:
         pass
-    print(f"[logkeeper] rotated {path.name} -> {archive_path.name}")
-    enforce_retention(path)
+    finally:
+        os.close(fd)
+    print(f"[logkeeper] rotated {path.name} -> {rotated.name} ({stat.st_size} bytes)")
+    notify_writer(path, rotated)
+    _ROTATION_POOL.submit(finish_rotation, path, rotated)
+
+
+def live_path(rotated: pathlib.Path) -> Optional[pathlib.Path]:
+    """Live log a ``.rotating`` file was renamed from (inverse of ``archive_name``)."""
+    match = ROTATING_RE.match(rotated.name)
+    if match is None:
+        return None
+    return rotated.with_name(match.group("stem") + match.group("suffix"))
+
+
+def resume_rotation(rotated: pathlib.Path) -> None:
+    """Compress a leftover ``.rotating`` file, then prune like a normal rotation."""
+    try:
+        compress_rotated(rotated)
+        path = live_path(rotated)
+        if path is not None:
+            enforce_retention(path)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[logkeeper] failed to compress {rotated.name}: {exc}")
+
+
+def recover_rotating() -> None:
+    """Compress renamed logs left behind by an interrupted run."""
+    for rotated in sorted(LOG_DIR.glob(f"*{ROTATING_SUFFIX}")):
+        print(f"[logkeeper] resuming compression of {rotated.name}")
+        _ROTATION_POOL.submit(resume_rotation, rotated)
 
 
 def enforce_retention(path: pathlib.Path) -> None:
@@ -64,6 +481,7 @@ def enforce_retention(path: pathlib.Path) -> None:
     archives: List[pathlib.Path] = sorted(LOG_DIR.glob(pattern))
     excess = len(archives) - MAX_ARCHIVES
     for victim in archives[:max(0, excess)]:
+        index_path(victim).unlink(missing_ok=True)
         try:
             victim.unlink()
             print(f"[logkeeper] removed old archive {victim.name}")
@@ -76,12 +494,35 @@ def main() -> int:
         "[logkeeper] starting:"
         f" dir={LOG_DIR} patterns={','.join(PATTERNS) or '<none>'} max_bytes={MAX_BYTES}"
         f" keep={MAX_ARCHIVES} interval={POLL_INTERVAL}s"
+        f" level={COMPRESS_LEVEL} workers={COMPRESS_WORKERS} chunk={CHUNK_BYTES}"
     )
+    recover_rotating()
+    try:
+        watcher: Optional[DirWatcher] = DirWatcher(LOG_DIR)
+    except (OSError, AttributeError) as exc:
+        print(f"[logkeeper] inotify unavailable, polling every {POLL_INTERVAL}s: {exc}")
+        watcher = None
+    catalog = SizeCatalog()
+    next_scan = 0.0
     while True:
-        for target in iter_targets():
-            if target.is_file():
-                rotate_file(target)
-        time.sleep(POLL_INTERVAL)
+        now = time.monotonic()
+        if now >= next_scan:
+            # Periodic full scan stays as a safety net for missed or overflowed events.
+            catalog.scan(now)
+            next_scan = now + POLL_INTERVAL
+        if watcher is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        timeout = next_scan - now
+        pending = catalog.timeout(now)
+        if pending is not None:
+            timeout = min(timeout, pending)
+        for mask, name in watcher.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                next_scan = 0.0
+                continue
+            catalog.observe(mask, name)
+        catalog.check(time.monotonic())
     return 0
 
 
@@ -2,20 +2,36 @@
 """FireWallBot system watcher for CPU and network activity."""
 from __future__ import annotations
 
+import abc
+import asyncio
 import datetime as _dt
-import json
+import itertools
 import os
 import pathlib
+import random
 import re
+import socket
+import struct
 import subprocess
 import sys
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Sequence, Set, Tuple
 
 REPO_ROOT = pathlib.Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "scripts" / "common"))
+
+from eventlog import EventWriter, write_event  # noqa: E402
+
 LOG_DIR = pathlib.Path(os.getenv("FIREWALLBOT_LOG_DIR", str(REPO_ROOT / "log")))
 LOG_FILE = pathlib.Path(os.getenv("FIREWALLBOT_SYSWATCH_LOG", str(LOG_DIR / "syswatcher.jsonl")))
 POLL_INTERVAL = float(os.getenv("FIREWALLBOT_POLL_INTERVAL", "10"))
+CPU_INTERVAL = float(os.getenv("FIREWALLBOT_CPU_INTERVAL", str(POLL_INTERVAL)))
+NET_INTERVAL = float(os.getenv("FIREWALLBOT_NET_INTERVAL", str(POLL_INTERVAL)))
+POLL_JITTER = float(os.getenv("FIREWALLBOT_POLL_JITTER", "0.1"))
+POLL_MAX_BACKOFF = float(os.getenv("FIREWALLBOT_POLL_MAX_BACKOFF", "4"))
 CPU_THRESHOLD = float(os.getenv("FIREWALLBOT_CPU_THRESHOLD", "20"))
 CPU_COOLDOWN = float(os.getenv("FIREWALLBOT_CPU_COOLDOWN", "60"))
 NET_STATE_FILTER: Set[str] = {
@@ -24,6 +40,23 @@ NET_STATE_FILTER: Set[str] = {
     if state.strip()
 }
 INCLUDE_LOOPBACK = os.getenv("FIREWALLBOT_NET_INCLUDE_LOOPBACK", "0").lower() in {"1", "true", "yes"}
+CPU_SAMPLER = os.getenv("FIREWALLBOT_CPU_SAMPLER", "proc").strip().lower()
+NET_BACKEND = os.getenv("FIREWALLBOT_NET_BACKEND", "proc").strip().lower()
+NET_STATS_INTERVAL = float(os.getenv("FIREWALLBOT_NET_STATS_INTERVAL", "300"))
+PROC_CACHE_SIZE = int(os.getenv("FIREWALLBOT_PROC_CACHE_SIZE", "4096"))
+PROC_CACHE_TTL = float(os.getenv("FIREWALLBOT_PROC_CACHE_TTL", "30"))
+CGROUP_CPU_THRESHOLD = float(os.getenv("FIREWALLBOT_CGROUP_CPU_THRESHOLD", "80"))
+CGROUP_INTERVAL = float(os.getenv("FIREWALLBOT_CGROUP_INTERVAL", str(CPU_INTERVAL)))
+PROC_EVENTS: Set[str] = {
+    kind.strip().lower()
+    for kind in os.getenv("FIREWALLBOT_PROC_EVENTS", "exec,exit").split(",")
+    if kind.strip()
+}
+ANCESTRY_DEPTH = int(os.getenv("FIREWALLBOT_ANCESTRY_DEPTH", "8"))
+FLOW_TABLE_MAX = int(os.getenv("FIREWALLBOT_FLOW_TABLE_MAX", "65536"))
+NET_ROLLUP = os.getenv("FIREWALLBOT_NET_ROLLUP", "0").lower() in {"1", "true", "yes"}
+NET_ROLLUP_WINDOW = float(os.getenv("FIREWALLBOT_NET_ROLLUP_WINDOW", "60"))
+NET_ROLLUP_MAX_KEYS = int(os.getenv("FIREWALLBOT_NET_ROLLUP_MAX_KEYS", "10000"))
 
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -36,6 +69,84 @@ SS_CMD: Sequence[str] = (
     "ss",
     "-tunapH",
 )
+PROC_ROOT = pathlib.Path("/proc")
+
+
+def default_cgroup_root() -> pathlib.Path:
+    """Locate the cgroup v2 hierarchy (pure v2 or the hybrid ``unified`` mount)."""
+    override = os.getenv("FIREWALLBOT_CGROUP_ROOT")
+    if override:
+        return pathlib.Path(override)
+    base = pathlib.Path("/sys/fs/cgroup")
+    if not (base / "cgroup.controllers").exists() and (base / "unified" / "cgroup.controllers").exists():
+        return base / "unified"
+    return base
+
+
+CGROUP_ROOT = default_cgroup_root()
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+PROC_NET_FILES: Sequence[Tuple[str, str, int]] = (
+    ("tcp", "tcp", socket.AF_INET),
+    ("tcp6", "tcp", socket.AF_INET6),
+    ("udp", "udp", socket.AF_INET),
+    ("udp6", "udp", socket.AF_INET6),
+)
+# Kernel socket states (include/net/tcp_states.h) spelled the way ss prints them.
+TCP_STATE_NAMES: Dict[int, str] = {
+    1: "ESTAB",
+    2: "SYN-SENT",
+    3: "SYN-RECV",
+    4: "FIN-WAIT-1",
+    5: "FIN-WAIT-2",
+    6: "TIME-WAIT",
+    7: "UNCONN",
+    8: "CLOSE-WAIT",
+    9: "LAST-ACK",
+    10: "LISTEN",
+    11: "CLOSING",
+    12: "NEW-SYN-RECV",
+}
+# NETLINK_SOCK_DIAG / inet_diag (linux/sock_diag.h, linux/inet_diag.h).
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+NETLINK_RECV_BUFSIZE = 65536
+NLMSG_HDR = struct.Struct("=IHHII")
+NLMSG_ERRNO = struct.Struct("=i")
+# family, protocol, ext, pad, states, zeroed inet_diag_sockid.
+INET_DIAG_REQ_V2 = struct.Struct("=BBBxI48x")
+# family, state, (timer, retrans), sport, dport, src, dst, (if, cookie,
+# expires, rqueue, wqueue, uid), inode.  Ports are in network byte order.
+INET_DIAG_MSG = struct.Struct("=BB2xHH16s16s12x16xI")
+NETLINK_QUERIES: Sequence[Tuple[int, int, str]] = (
+    (socket.AF_INET, socket.IPPROTO_TCP, "tcp"),
+    (socket.AF_INET6, socket.IPPROTO_TCP, "tcp"),
+    (socket.AF_INET, socket.IPPROTO_UDP, "udp"),
+    (socket.AF_INET6, socket.IPPROTO_UDP, "udp"),
+)
+# Process events connector (linux/connector.h, linux/cn_proc.h).
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+# idx, val, seq, ack, len, flags.
+CN_MSG = struct.Struct("=IIIIHH")
+CN_PROC_OP = struct.Struct("=I")
+# what, cpu, timestamp_ns.
+PROC_EVENT_HDR = struct.Struct("=IIQ")
+# parent_pid, parent_tgid, child_pid, child_tgid.
+PROC_EVENT_FORK_DATA = struct.Struct("=IIII")
+# process_pid, process_tgid.
+PROC_EVENT_EXEC_DATA = struct.Struct("=II")
+# process_pid, process_tgid, exit_code, exit_signal.
+PROC_EVENT_EXIT_DATA = struct.Struct("=IIII")
+PROC_EVENT_TRACK_MAX = 65536
 USERS_RE = re.compile(r"users:\(\(([^\)]+)\)\)")
 PROCESS_RE = re.compile(r"\"(?P<name>[^\"]+)\",pid=(?P<pid>\d+)")
 
@@ -45,19 +156,12 @@ def iso_local(ts: Optional[float] = None) -> str:
     return moment.replace(microsecond=0).isoformat()
 
 
-def write_event(handle, event: Dict) -> None:
-    line = json.dumps(event, ensure_ascii=False)
-    handle.write(line + "\n")
-    handle.flush()
-    print(line, flush=True)
-
-
 def run_command(cmd: Sequence[str]) -> subprocess.CompletedProcess:
     return subprocess.run(cmd, capture_output=True, text=True, check=False)
 
 
 def proc_context(pid: int) -> Dict[str, Optional[str]]:
-    ctx: Dict[str, Optional[str]] = {"cwd": None, "cmdline": None, "exe": None}
+    ctx: Dict[str, Optional[str]] = {"cwd": None, "cmdline": None, "exe": None, "cgroup": None}
     base = pathlib.Path("/proc") / str(pid)
     try:
         ctx["cwd"] = os.readlink(base / "cwd")
@@ -75,10 +179,326 @@ def proc_context(pid: int) -> Dict[str, Optional[str]]:
         ctx["exe"] = os.readlink(base / "exe")
     except OSError:
         pass
+    ctx["cgroup"] = read_proc_cgroup(pid)
     return ctx
 
 
+def read_proc_cgroup(pid: int, proc_root: pathlib.Path = PROC_ROOT) -> Optional[str]:
+    """Return the cgroup v2 path of a process (``0::`` entry), or the v1 cpu controller path."""
+    try:
+        with open(proc_root / str(pid) / "cgroup", "r", encoding="utf-8", errors="replace") as fh:
+            lines = fh.read().splitlines()
+    except OSError:
+        return None
+    fallback = None
+    for line in lines:
+        hierarchy, _, rest = line.partition(":")
+        controllers, _, path = rest.partition(":")
+        if hierarchy == "0" and not controllers:
+            return path
+        if "cpu" in controllers.split(","):
+            fallback = path
+    return fallback
+
+
+class ProcContextCache:
+    """Bounded LRU cache of :func:`proc_context` keyed by (pid, starttime).
+
+    Including the process start time in the key means a recycled PID never
+    returns the previous owner's context.  ``execve()`` and ``chdir()`` keep
+    the key, so a hit is only served while ``/proc/<pid>/exe`` still matches
+    and the entry is younger than ``ttl`` seconds; otherwise it is re-read.
+    Contexts of processes that vanished mid-read (all fields None) are never
+    cached.  ``max_entries <= 0`` disables caching.
+    """
+
+    def __init__(self, max_entries: int = PROC_CACHE_SIZE, ttl: float = PROC_CACHE_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[int, int], Tuple[float, Dict[str, Optional[str]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, pid: int, starttime: Optional[int] = None) -> Dict[str, Optional[str]]:
+        if starttime is None:
+            stat = read_proc_stat(pid)
+            if stat is None:
+                self.misses += 1
+                return proc_context(pid)
+            starttime = stat[3]
+        key = (pid, starttime)
+        cached = self._entries.get(key)
+        now = time.monotonic()
+        if cached is not None:
+            fetched, context = cached
+            if now - fetched < self.ttl and self._same_image(pid, context):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return context
+            del self._entries[key]
+            self.stale += 1
+        self.misses += 1
+        context = proc_context(pid)
+        if self.max_entries > 0 and any(value is not None for value in context.values()):
+            self._entries[key] = (now, context)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return context
+
+    @staticmethod
+    def _same_image(pid: int, context: Dict[str, Optional[str]]) -> bool:
+        """One readlink: has the process exec'd a different binary since it was cached?"""
+        try:
+            return os.readlink(f"/proc/{pid}/exe") == context["exe"]
+        except OSError:
+            return context["exe"] is None
+
+    def invalidate(self, pid: int, starttime: Optional[int] = None) -> None:
+        """Forget a process whose image changed (exec keeps pid and starttime)."""
+        if starttime is None:
+            stat = read_proc_stat(pid)
+            if stat is None:
+                return
+            starttime = stat[3]
+        self._entries.pop((pid, starttime), None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+        }
+
+
+def read_proc_stat(pid: int, proc_root: pathlib.Path = PROC_ROOT) -> Optional[Tuple[bytes, int, int, int, int]]:
+    """Return (comm, ppid, utime+stime, starttime, rss_pages) from /proc/<pid>/stat."""
+    try:
+        with open(proc_root / str(pid) / "stat", "rb") as fh:
+            raw = fh.read()
+    except OSError:
+        return None
+    # comm may contain spaces and parentheses, so split on the last ')'.
+    head, sep, tail = raw.rpartition(b")")
+    if not sep:
+        return None
+    fields = tail.split()
+    if len(fields) < 22:
+        return None
+    try:
+        return (
+            head.partition(b"(")[2],
+            int(fields[1]),
+            int(fields[11]) + int(fields[12]),
+            int(fields[19]),
+            int(fields[21]),
+        )
+    except ValueError:
+        return None
+
+
+class ProcessTree:
+    """``pid -> (ppid, comm, starttime)`` index rebuilt once per CPU cycle.
+
+    :meth:`refresh` takes the ``stat`` fields the CPU sampler already read for
+    every pid (or reads them itself), so a pid reused within one interval, a
+    ``comm`` changed by exec and a reparented child are all picked up without
+    extra reads.  Lookups for a pid the index has not seen yet read that single
+    ``stat`` file.  The index is refreshed from an executor thread and read on
+    the event loop, hence the lock.
+    """
+
+    def __init__(self, proc_root: pathlib.Path = PROC_ROOT, depth: int = ANCESTRY_DEPTH) -> None:
+        self.proc_root = proc_root
+        self.depth = depth
+        self._procs: Dict[int, Tuple[int, str, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._procs)
+
+    def _read(self, pid: int) -> Optional[Tuple[int, str, int]]:
+        stat = read_proc_stat(pid, self.proc_root)
+        if stat is None:
+            return None
+        return stat[1], stat[0].decode("utf-8", "replace"), stat[3]
+
+    def _store(self, records: Dict[int, Optional[Tuple[int, str, int]]]) -> None:
+        with self._lock:
+            for pid, record in records.items():
+                if record is None:
+                    self._procs.pop(pid, None)
+                else:
+                    self._procs[pid] = record
+
+    def refresh(self, stats: Optional[Dict[int, Tuple[bytes, int, int]]] = None) -> None:
+        """Replace the index from ``pid -> (comm, ppid, starttime)``; read /proc when not given."""
+        if stats is None:
+            stats = {}
+            for name in os.listdir(self.proc_root):
+                if not name.isdigit():
+                    continue
+                stat = read_proc_stat(int(name), self.proc_root)
+                if stat is not None:
+                    stats[int(name)] = (stat[0], stat[1], stat[3])
+        procs = {pid: (ppid, comm.decode("utf-8", "replace"), starttime) for pid, (comm, ppid, starttime) in stats.items()}
+        with self._lock:
+            self._procs = procs
+
+    def update(self, pid: int) -> None:
+        """Re-read one pid, e.g. after exec changed its comm."""
+        self._store({pid: self._read(pid)})
+
+    def forget(self, pid: int) -> None:
+        with self._lock:
+            self._procs.pop(pid, None)
+
+    def _get(self, pid: int) -> Optional[Tuple[int, str, int]]:
+        with self._lock:
+            record = self._procs.get(pid)
+        if record is None:
+            record = self._read(pid)
+            if record is not None:
+                self._store({pid: record})
+        return record
+
+    def ancestors(self, pid: int) -> List[Dict]:
+        """Return up to ``depth`` ancestors of ``pid``, nearest first."""
+        chain: List[Dict] = []
+        record = self._get(pid)
+        while record is not None and len(chain) < self.depth:
+            ppid, _comm, starttime = record
+            if ppid <= 0:
+                break
+            parent = self._get(ppid)
+            # A parent cannot be younger than its child: the pid was reused.
+            if parent is None or parent[2] > starttime:
+                break
+            chain.append({"pid": ppid, "comm": parent[1]})
+            record = parent
+        return chain
+
+
+class ProcCpuSampler:
+    """Per-interval CPU usage computed from /proc/[pid]/stat and /proc/stat deltas.
+
+    Unlike ``ps %cpu`` (a lifetime average) the value reported here covers only
+    the time since the previous sample.  The table keeps ``pid -> (starttime,
+    ticks)`` so a recycled PID is detected by a changed starttime and restarts
+    its accounting from zero.
+    """
+
+    def __init__(self, proc_root: pathlib.Path = PROC_ROOT) -> None:
+        self.proc_root = proc_root
+        self._prev: Dict[int, Tuple[int, int]] = {}
+        self._prev_total: Optional[int] = None
+        # ``pid -> (comm, ppid, starttime)`` from the last complete sample, for ProcessTree.
+        self.last_stats: Optional[Dict[int, Tuple[bytes, int, int]]] = None
+
+    def _read_totals(self) -> Tuple[int, int, int]:
+        """Return (aggregate jiffies, cpu count, MemTotal bytes)."""
+        total = 0
+        ncpu = 0
+        with open(self.proc_root / "stat", "rb") as fh:
+            for line in fh:
+                if not line.startswith(b"cpu"):
+                    break
+                if line[3:4] == b" ":
+                    total = sum(int(v) for v in line.split()[1:])
+                else:
+                    ncpu += 1
+        mem_total = 0
+        try:
+            with open(self.proc_root / "meminfo", "rb") as fh:
+                for line in fh:
+                    if line.startswith(b"MemTotal:"):
+                        mem_total = int(line.split()[1]) * 1024
+                        break
+        except (OSError, ValueError, IndexError):
+            pass
+        return total, max(ncpu, 1), mem_total
+
+    def _command(self, pid: int, comm: bytes) -> str:
+        try:
+            raw = (self.proc_root / str(pid) / "cmdline").read_bytes()
+        except OSError:
+            raw = b""
+        parts = [seg.decode("utf-8", "replace") for seg in raw.split(b"\0") if seg]
+        if parts:
+            return " ".join(parts)
+        return f"[{comm.decode('utf-8', 'replace')}]"
+
+    def sample(self, threshold: float) -> List[Dict]:
+        total, ncpu, mem_total = self._read_totals()
+        prev_total = self._prev_total
+        prev = self._prev
+        current: Dict[int, Tuple[int, int]] = {}
+        observed: Dict[int, Tuple[bytes, int, int]] = {}
+        self.last_stats = None
+        # Elapsed wall time of the window expressed in clock ticks of one CPU,
+        # so 100% means one fully busy core (same scale as ps).
+        window = (total - prev_total) / ncpu if prev_total is not None else 0.0
+        findings: List[Dict] = []
+        for name in os.listdir(self.proc_root):
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            stat = read_proc_stat(pid, self.proc_root)
+            if stat is None:
+                continue
+            comm, ppid, ticks, starttime, rss = stat
+            current[pid] = (starttime, ticks)
+            observed[pid] = (comm, ppid, starttime)
+            if window <= 0:
+                continue
+            before = prev.get(pid)
+            # New or recycled PID: everything it consumed happened inside the window.
+            base = before[1] if before is not None and before[0] == starttime else 0
+            cpu = (ticks - base) * 100.0 / window
+            if cpu < threshold:
+                continue
+            mem = rss * PAGE_SIZE * 100.0 / mem_total if mem_total else 0.0
+            findings.append(
+                {
+                    "pid": pid,
+                    "ppid": ppid,
+                    "cpu": round(cpu, 2),
+                    "mem": round(mem, 2),
+                    "cmd": self._command(pid, comm),
+                    "starttime": starttime,
+                }
+            )
+        self._prev = current
+        self._prev_total = total
+        self.last_stats = observed
+        return findings
+
+
+_proc_cpu_sampler: Optional[ProcCpuSampler] = None
+
+
 def sample_cpu(threshold: float) -> List[Dict]:
+    """Sample CPU hogs using the configured backend (``proc`` or ``ps``).
+
+    The ``proc`` backend falls back to ``ps`` when /proc is not usable.
+    """
+    global _proc_cpu_sampler
+    if CPU_SAMPLER != "ps":
+        if _proc_cpu_sampler is None:
+            _proc_cpu_sampler = ProcCpuSampler()
+        try:
+            return _proc_cpu_sampler.sample(threshold)
+        except OSError:
+            pass
+    return sample_cpu_ps(threshold)
+
+
+def sample_cpu_ps(threshold: float) -> List[Dict]:
     proc = run_command(PS_CMD)
     if proc.returncode != 0:
         raise RuntimeError(f"ps failed rc={proc.returncode}: {proc.stderr.strip()}")
@@ -111,6 +531,87 @@ def sample_cpu(threshold: float) -> List[Dict]:
     return findings
 
 
+class CgroupCpuSampler:
+    """Per-interval CPU usage of every cgroup v2 group from ``cpu.stat``.
+
+    ``usage_usec`` is cumulative, so usage is the delta between two samples
+    divided by the elapsed wall time (100% = one fully busy core).  The root
+    group is skipped since it covers the whole host.
+    """
+
+    def __init__(self, root: pathlib.Path = CGROUP_ROOT) -> None:
+        self.root = str(root)
+        self._prev: Dict[str, Tuple[int, int]] = {}
+        self._prev_time: Optional[float] = None
+
+    def _walk(self, path: str, rel: str, out: Dict[str, Tuple[int, int]]) -> None:
+        try:
+            with open(path + "/cpu.stat", "rb") as fh:
+                data = fh.read()
+        except OSError:
+            return
+        usage = throttled = 0
+        valid = True
+        for line in data.splitlines():
+            key, _, value = line.partition(b" ")
+            if key not in (b"usage_usec", b"throttled_usec"):
+                continue
+            value = value.strip()
+            if not value.isdigit():
+                # Half-written during teardown; skip the group rather than record a bogus baseline.
+                valid = False
+                break
+            if key == b"usage_usec":
+                usage = int(value)
+            else:
+                throttled = int(value)
+        if valid:
+            out[rel or "/"] = (usage, throttled)
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                self._walk(entry.path, f"{rel}/{entry.name}", out)
+
+    def procs(self, cgroup: str) -> int:
+        try:
+            with open(self.root + cgroup.rstrip("/") + "/cgroup.procs", "rb") as fh:
+                return len(fh.read().split())
+        except OSError:
+            return 0
+
+    def sample(self, threshold: float) -> List[Dict]:
+        now = time.monotonic()
+        current: Dict[str, Tuple[int, int]] = {}
+        self._walk(self.root, "", current)
+        if not current:
+            raise OSError(f"no cgroup v2 cpu.stat under {self.root}")
+        findings: List[Dict] = []
+        if self._prev_time is not None:
+            elapsed = now - self._prev_time
+            prev = self._prev
+            for cgroup, (usage, throttled) in current.items():
+                before = prev.get(cgroup)
+                if cgroup == "/" or before is None or usage < before[0] or elapsed <= 0:
+                    continue
+                cpu = (usage - before[0]) * 100.0 / (elapsed * 1_000_000)
+                if cpu < threshold:
+                    continue
+                findings.append(
+                    {
+                        "cgroup": cgroup,
+                        "cpu": round(cpu, 2),
+                        "throttled_ms": round(max(0, throttled - before[1]) / 1000, 3),
+                        "window": round(elapsed, 3),
+                    }
+                )
+        self._prev = current
+        self._prev_time = now
+        return findings
+
+
 def split_host_port(value: str) -> Tuple[str, str]:
     value = value.strip()
     if not value:
@@ -172,7 +673,370 @@ def parse_ss_line(line: str) -> Optional[Dict]:
     }
 
 
+def decode_proc_net_addr(value: bytes, family: int) -> Tuple[str, int]:
+    """Decode an ``ADDR:PORT`` hex pair from /proc/net/{tcp,udp}[6]."""
+    addr_hex, _, port_hex = value.partition(b":")
+    raw = bytes.fromhex(addr_hex.decode("ascii"))
+    if sys.byteorder == "little":
+        # The kernel prints each 32-bit word of the address in host byte order.
+        raw = b"".join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+    return socket.inet_ntop(family, raw), int(port_hex, 16)
+
+
+class SocketInodeIndex:
+    """Persistent socket inode -> (pid, comm) map maintained incrementally.
+
+    Each cycle only the fd tables of new processes (or recycled PIDs) are read.
+    Existing processes are rescanned only while some requested inode is still
+    unresolved, starting with those whose CPU time moved since the last cycle.
+    Inodes that no process owns (other namespaces, already closed) are
+    remembered so they do not trigger a full rescan every cycle.
+    """
+
+    def __init__(self, proc_root: pathlib.Path = PROC_ROOT) -> None:
+        self.proc_root = proc_root
+        self._procs: Dict[int, Tuple[int, int, str, Tuple[int, ...]]] = {}
+        self._owners: Dict[int, int] = {}
+        self._orphans: Set[int] = set()
+        self.scanned = 0
+
+    def _scan(self, pid: int, starttime: int, ticks: int, comm: str) -> None:
+        old = self._procs.get(pid)
+        if old is not None:
+            for inode in old[3]:
+                if self._owners.get(inode) == pid:
+                    del self._owners[inode]
+        inodes: List[int] = []
+        fd_dir = f"{self.proc_root}/{pid}/fd/"
+        try:
+            names = os.listdir(fd_dir)
+        except OSError:
+            names = []
+        for name in names:
+            try:
+                target = os.readlink(fd_dir + name)
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inode = int(target[8:-1])
+                inodes.append(inode)
+                self._owners.setdefault(inode, pid)
+        self._procs[pid] = (starttime, ticks, comm, tuple(inodes))
+        self.scanned += 1
+
+    def lookup(self, inode: int) -> Tuple[Optional[int], Optional[str], Optional[int]]:
+        """Return (pid, comm, starttime) of the socket owner, if known."""
+        pid = self._owners.get(inode)
+        if pid is None:
+            return None, None, None
+        record = self._procs[pid]
+        return pid, record[2], record[0]
+
+    def refresh(self, wanted: Set[int]) -> None:
+        self.scanned = 0
+        seen: Dict[int, Tuple[int, int, str]] = {}
+        for name in os.listdir(self.proc_root):
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            stat = read_proc_stat(pid, self.proc_root)
+            if stat is not None:
+                seen[pid] = (stat[3], stat[2], stat[0].decode("utf-8", "replace"))
+        for pid in [pid for pid in self._procs if pid not in seen]:
+            for inode in self._procs.pop(pid)[3]:
+                if self._owners.get(inode) == pid:
+                    del self._owners[inode]
+        changed: List[int] = []
+        unchanged: List[int] = []
+        for pid, (starttime, ticks, comm) in seen.items():
+            known = self._procs.get(pid)
+            if known is None or known[0] != starttime:
+                self._scan(pid, starttime, ticks, comm)
+            elif known[1] != ticks:
+                changed.append(pid)
+            else:
+                unchanged.append(pid)
+        self._orphans &= wanted
+        missing = {inode for inode in wanted if inode not in self._owners} - self._orphans
+        for pid in changed + unchanged:
+            if not missing:
+                break
+            starttime, ticks, comm = seen[pid]
+            self._scan(pid, starttime, ticks, comm)
+            missing = {inode for inode in missing if inode not in self._owners}
+        self._orphans |= missing
+
+
+ConnRow = Tuple[str, str, str, int, str, int, int]
+
+
+class ConnectionSampler(abc.ABC):
+    """Base for in-process connection backends.
+
+    Subclasses implement ``_rows()`` returning already-filtered
+    ``(proto, state, local, local_port, remote, remote_port, inode)`` tuples;
+    owners are resolved through a shared :class:`SocketInodeIndex`.
+    """
+
+    name = "base"
+
+    def __init__(self, proc_root: pathlib.Path = PROC_ROOT) -> None:
+        self.proc_root = proc_root
+        self.index = SocketInodeIndex(proc_root)
+        self.last_stats: Dict[str, float] = {}
+
+    @abc.abstractmethod
+    def _rows(self) -> List[ConnRow]:
+        """Connections of one poll as ``ConnRow`` tuples."""
+
+    def sample(self) -> List[Dict]:
+        started = time.perf_counter()
+        rows = self._rows()
+        parsed = time.perf_counter()
+        self.index.refresh({row[6] for row in rows if row[6]})
+        resolved = time.perf_counter()
+        findings: List[Dict] = []
+        for proto, state, local, local_port, remote, remote_port, inode in rows:
+            pid, comm, starttime = self.index.lookup(inode)
+            findings.append(
+                {
+                    "proto": proto,
+                    "state": state,
+                    "local_addr": local,
+                    "local_port": str(local_port),
+                    "remote_addr": remote,
+                    "remote_port": str(remote_port),
+                    "process": comm,
+                    "pid": pid,
+                    "starttime": starttime,
+                }
+            )
+        self.last_stats = {
+            "parse_ms": round((parsed - started) * 1000, 3),
+            "resolve_ms": round((resolved - parsed) * 1000, 3),
+            "total_ms": round((time.perf_counter() - started) * 1000, 3),
+            "sockets": len(rows),
+            "pids_scanned": self.index.scanned,
+        }
+        return findings
+
+
+def state_codes(states: Set[str]) -> Set[int]:
+    name_to_code = {name: code for code, name in TCP_STATE_NAMES.items()}
+    return {name_to_code[state] for state in states if state in name_to_code}
+
+
+class ProcNetSampler(ConnectionSampler):
+    """Connection sampler reading /proc/net/{tcp,tcp6,udp,udp6} in bulk."""
+
+    name = "proc"
+
+    def __init__(self, proc_root: pathlib.Path = PROC_ROOT) -> None:
+        super().__init__(proc_root)
+        self._addr_cache: Dict[Tuple[bytes, int], Tuple[str, int]] = {}
+        self._states: Optional[Set[bytes]] = None
+        if NET_STATE_FILTER:
+            self._states = {b"%02X" % code for code in state_codes(NET_STATE_FILTER)}
+
+    def _decode(self, value: bytes, family: int) -> Tuple[str, int]:
+        key = (value, family)
+        cached = self._addr_cache.get(key)
+        if cached is None:
+            if len(self._addr_cache) >= 65536:
+                self._addr_cache.clear()
+            cached = self._addr_cache[key] = decode_proc_net_addr(value, family)
+        return cached
+
+    def _rows(self) -> List[ConnRow]:
+        rows: List[ConnRow] = []
+        states = self._states
+        for filename, proto, family in PROC_NET_FILES:
+            try:
+                with open(self.proc_root / "net" / filename, "rb") as fh:
+                    data = fh.read()
+            except FileNotFoundError:
+                continue
+            for line in data.splitlines()[1:]:
+                fields = line.split()
+                if len(fields) < 10:
+                    continue
+                if states is not None and fields[3] not in states:
+                    continue
+                remote, remote_port = self._decode(fields[2], family)
+                if remote_port == 0:
+                    continue
+                if not INCLUDE_LOOPBACK and is_loopback(remote):
+                    continue
+                local, local_port = self._decode(fields[1], family)
+                rows.append(
+                    (
+                        proto,
+                        TCP_STATE_NAMES.get(int(fields[3], 16), fields[3].decode("ascii")),
+                        local,
+                        local_port,
+                        remote,
+                        remote_port,
+                        int(fields[9]),
+                    )
+                )
+        return rows
+
+
+class NetlinkDiagSampler(ConnectionSampler):
+    """Connection sampler speaking NETLINK_SOCK_DIAG (inet_diag) directly.
+
+    ``FIREWALLBOT_NET_STATES`` is pushed into the dump request as a state
+    bitmask, so the kernel only returns matching sockets.
+    """
+
+    name = "netlink"
+
+    def __init__(self, proc_root: pathlib.Path = PROC_ROOT) -> None:
+        super().__init__(proc_root)
+        self._sock: Optional[socket.socket] = None
+        self._seq = 0
+        self._addr_cache: Dict[Tuple[int, bytes], str] = {}
+        if NET_STATE_FILTER:
+            self._state_mask = 0
+            for code in state_codes(NET_STATE_FILTER):
+                self._state_mask |= 1 << code
+        else:
+            self._state_mask = 0xFFFFFFFF
+
+    def _socket(self) -> socket.socket:
+        if self._sock is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+            try:
+                sock.bind((0, 0))
+            except OSError:
+                sock.close()
+                raise
+            self._sock = sock
+        return self._sock
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _addr(self, family: int, raw: bytes) -> str:
+        key = (family, raw)
+        cached = self._addr_cache.get(key)
+        if cached is None:
+            if len(self._addr_cache) >= 65536:
+                self._addr_cache.clear()
+            packed = raw[:4] if family == socket.AF_INET else raw
+            cached = self._addr_cache[key] = socket.inet_ntop(family, packed)
+        return cached
+
+    def _dump(self, family: int, protocol: int) -> Tuple[int, List[bytes]]:
+        """Send one dump request; return its sequence number and the raw replies."""
+        sock = self._socket()
+        self._seq += 1
+        seq = self._seq
+        request = NLMSG_HDR.pack(
+            NLMSG_HDR.size + INET_DIAG_REQ_V2.size,
+            SOCK_DIAG_BY_FAMILY,
+            NLM_F_REQUEST | NLM_F_DUMP,
+            seq,
+            0,
+        ) + INET_DIAG_REQ_V2.pack(family, protocol, 0, self._state_mask)
+        sock.sendto(request, (0, 0))
+        chunks: List[bytes] = []
+        while True:
+            data = sock.recv(NETLINK_RECV_BUFSIZE)
+            chunks.append(data)
+            offset = 0
+            while offset + NLMSG_HDR.size <= len(data):
+                length, msg_type, _flags, msg_seq, _pid = NLMSG_HDR.unpack_from(data, offset)
+                if length < NLMSG_HDR.size:
+                    return seq, chunks
+                if msg_seq == seq:
+                    if msg_type == NLMSG_DONE:
+                        return seq, chunks
+                    if msg_type == NLMSG_ERROR:
+                        (err,) = NLMSG_ERRNO.unpack_from(data, offset + NLMSG_HDR.size)
+                        if err:
+                            raise OSError(-err, os.strerror(-err))
+                        return seq, chunks
+                offset += (length + 3) & ~3
+
+    def _rows(self) -> List[ConnRow]:
+        rows: List[ConnRow] = []
+        header_size = NLMSG_HDR.size
+        for family, protocol, proto in NETLINK_QUERIES:
+            seq, chunks = self._dump(family, protocol)
+            for data in chunks:
+                offset = 0
+                while offset + header_size <= len(data):
+                    length, msg_type, _flags, msg_seq, _pid = NLMSG_HDR.unpack_from(data, offset)
+                    if length < header_size:
+                        break
+                    # Replies left over from an earlier, interrupted dump carry an older seq.
+                    if msg_type == SOCK_DIAG_BY_FAMILY and msg_seq == seq:
+                        (
+                            msg_family,
+                            state,
+                            sport,
+                            dport,
+                            src,
+                            dst,
+                            inode,
+                        ) = INET_DIAG_MSG.unpack_from(data, offset + header_size)
+                        if dport and (INCLUDE_LOOPBACK or not is_loopback(self._addr(msg_family, dst))):
+                            rows.append(
+                                (
+                                    proto,
+                                    TCP_STATE_NAMES.get(state, str(state)),
+                                    self._addr(msg_family, src),
+                                    socket.ntohs(sport),
+                                    self._addr(msg_family, dst),
+                                    socket.ntohs(dport),
+                                    inode,
+                                )
+                            )
+                    offset += (length + 3) & ~3
+        return rows
+
+    def sample(self) -> List[Dict]:
+        try:
+            return super().sample()
+        except OSError:
+            self.close()
+            raise
+
+
+CONNECTION_SAMPLERS = {
+    ProcNetSampler.name: ProcNetSampler,
+    NetlinkDiagSampler.name: NetlinkDiagSampler,
+}
+_connection_sampler: Optional[ConnectionSampler] = None
+
+
 def sample_connections() -> List[Dict]:
+    """Sample connections using the configured backend (``proc``, ``netlink`` or ``ss``).
+
+    In-process backends fall back to ``ss`` when their kernel interface is not usable.
+    """
+    global _connection_sampler
+    factory = CONNECTION_SAMPLERS.get(NET_BACKEND)
+    if factory is not None:
+        if _connection_sampler is None:
+            _connection_sampler = factory()
+        try:
+            return _connection_sampler.sample()
+        except OSError:
+            pass
+    return sample_connections_ss()
+
+
+def net_backend_stats() -> Optional[Dict[str, float]]:
+    if _connection_sampler is None or not _connection_sampler.last_stats:
+        return None
+    return _connection_sampler.last_stats
+
+
+def sample_connections_ss() -> List[Dict]:
     proc = run_command(SS_CMD)
     if proc.returncode != 0:
         raise RuntimeError(f"ss failed rc={proc.returncode}: {proc.stderr.strip()}")
@@ -185,96 +1049,627 @@ def sample_connections() -> List[Dict]:
     return findings
 
 
-def main() -> int:
-    last_cpu_alert: Dict[Tuple[int, str], float] = {}
-    known_connections: Set[Tuple[str, str, str, str, str, Optional[int]]] = set()
-    cooldown_cleanup_interval = max(CPU_COOLDOWN * 3, POLL_INTERVAL * 6)
-    last_cleanup = time.time()
-    with LOG_FILE.open("a", encoding="utf-8") as handle:
-        write_event(handle, {"ts": iso_local(), "kind": "syswatcher_start", "poll_interval": POLL_INTERVAL})
+FlowKey = Tuple[str, str, int, str, int, Optional[int]]
+
+
+class FlowRecord:
+    __slots__ = ("state", "process", "first_seen", "last_seen", "generation", "summarized", "evicted")
+
+    def __init__(self, state: str, process: Optional[str], now: float, generation: int) -> None:
+        self.state = state
+        self.process = process
+        self.first_seen = now
+        self.last_seen = now
+        self.generation = generation
+        self.summarized = False
+        self.evicted = False
+
+
+def _port(value: str) -> int:
+    return int(value) if value.isdigit() else 0
+
+
+class FlowTable:
+    """Connections tracked across polls and diffed incrementally.
+
+    Keys are ``(proto, local_addr, local_port, remote_addr, remote_port, pid)``
+    with interned address strings and integer ports; values are slotted
+    :class:`FlowRecord` objects.  A flow missing from a poll is reported as
+    closed.  When the table exceeds ``max_entries`` the oldest flows are
+    reported as closed with ``evicted`` set (keeping their real
+    ``first_seen``/``last_seen``) and counted in ``evictions``.  Up to
+    ``max_entries`` evicted keys are remembered while they stay live, so they
+    are not announced as new again; beyond that the least recently seen key
+    is forgotten and may be reported once more.  Memory stays bounded by
+    twice ``max_entries`` keys.
+    """
+
+    def __init__(self, max_entries: int = FLOW_TABLE_MAX) -> None:
+        self.max_entries = max_entries
+        self._flows: Dict[FlowKey, FlowRecord] = {}
+        self._evicted: "OrderedDict[FlowKey, int]" = OrderedDict()
+        self._generation = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._flows)
+
+    def update(
+        self, conns: List[Dict], now: float
+    ) -> Tuple[List[Tuple[FlowKey, FlowRecord, Dict]], List[Tuple[FlowKey, FlowRecord]]]:
+        """Apply one poll; return (opened, closed) flows."""
+        self._generation += 1
+        generation = self._generation
+        flows = self._flows
+        evicted = self._evicted
+        intern = sys.intern
+        opened: List[Tuple[FlowKey, FlowRecord, Dict]] = []
+        for conn in conns:
+            key = (
+                intern(conn["proto"]),
+                intern(conn["local_addr"]),
+                _port(conn["local_port"]),
+                intern(conn["remote_addr"]),
+                _port(conn["remote_port"]),
+                conn["pid"],
+            )
+            record = flows.get(key)
+            if record is None:
+                if key in evicted:
+                    evicted[key] = generation
+                    evicted.move_to_end(key)
+                    continue
+                record = FlowRecord(intern(conn["state"]), conn["process"], now, generation)
+                flows[key] = record
+                opened.append((key, record, conn))
+            else:
+                record.state = intern(conn["state"])
+                record.last_seen = now
+                record.generation = generation
+        closed = [(key, record) for key, record in flows.items() if record.generation != generation]
+        for key, _record in closed:
+            del flows[key]
+        if evicted:
+            for key in [key for key, seen in evicted.items() if seen != generation]:
+                del evicted[key]
+        excess = len(flows) - self.max_entries
+        if self.max_entries > 0 and excess > 0:
+            for key in list(itertools.islice(flows, excess)):
+                record = flows.pop(key)
+                record.evicted = True
+                closed.append((key, record))
+                evicted[key] = generation
+            self.evictions += excess
+            while len(evicted) > self.max_entries:
+                evicted.popitem(last=False)
+        return opened, closed
+
+
+RollupKey = Tuple[Optional[str], str, str]
+
+
+class RollupEntry:
+    __slots__ = ("window_start", "last_seen", "count", "local_ports", "pids")
+
+    def __init__(self, now: float) -> None:
+        self.window_start = now
+        self.last_seen = now
+        self.count = 0
+        self.local_ports: Set[str] = set()
+        self.pids: Set[int] = set()
+
+
+class ConnectionRollup:
+    """Suppress repeated connections per (exe, remote_addr, remote_port).
+
+    The first connection for a key is logged in full; later ones inside the
+    window are only counted and reported by :meth:`flush` as one summary.  A
+    key whose window passes without repeats is dropped, so the next
+    connection is logged in full again.  At most ``max_keys`` keys are kept;
+    the least recently seen key is evicted (and summarised) first.
+    """
+
+    def __init__(self, window: float = NET_ROLLUP_WINDOW, max_keys: int = NET_ROLLUP_MAX_KEYS) -> None:
+        self.window = window
+        self.max_keys = max_keys
+        self._entries: "OrderedDict[RollupKey, RollupEntry]" = OrderedDict()
+        self._evicted: List[Tuple[RollupKey, RollupEntry]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def admit(self, key: RollupKey, local_port: str, pid: Optional[int], now: float) -> bool:
+        """Return True when the connection should be logged in full."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = RollupEntry(now)
+            while self.max_keys > 0 and len(self._entries) > self.max_keys:
+                victim = self._entries.popitem(last=False)
+                if victim[1].count:
+                    self._evicted.append(victim)
+            return True
+        self._entries.move_to_end(key)
+        entry.last_seen = now
+        entry.count += 1
+        entry.local_ports.add(local_port)
+        if pid is not None:
+            entry.pids.add(pid)
+        return False
+
+    def flush(self, now: float) -> List[Tuple[RollupKey, RollupEntry, float]]:
+        """Return ``(key, entry, window_end)`` for every window with suppressed connections."""
+        due: List[Tuple[RollupKey, RollupEntry, float]] = [
+            (key, entry, entry.last_seen) for key, entry in self._evicted
+        ]
+        self._evicted = []
+        for key in list(self._entries):
+            entry = self._entries[key]
+            if now - entry.window_start < self.window:
+                continue
+            if not entry.count:
+                del self._entries[key]
+                continue
+            due.append((key, entry, now))
+            self._entries[key] = RollupEntry(now)
+        return due
+
+
+def apply_context(event: Dict, context: Dict[str, Optional[str]]) -> None:
+    if context["cwd"]:
+        event["cwd"] = context["cwd"]
+    if context["cmdline"]:
+        event["cmdline"] = context["cmdline"]
+    if context["exe"]:
+        event["exe"] = context["exe"]
+    if context.get("cgroup"):
+        event["cgroup"] = context["cgroup"]
+
+
+class CpuWatch:
+    """CPU sampling cycle: ``sample()`` runs in an executor, ``process()`` on the loop."""
+
+    name = "cpu"
+
+    def __init__(
+        self,
+        handle,
+        context_cache: ProcContextCache,
+        tree: Optional[ProcessTree] = None,
+        interval: float = CPU_INTERVAL,
+    ) -> None:
+        self.handle = handle
+        self.context_cache = context_cache
+        self.tree = tree
+        self.interval = interval
+        self.last_alert: Dict[Tuple[int, str], float] = {}
+        self.cleanup_interval = max(CPU_COOLDOWN * 3, interval * 6)
+        self.last_cleanup = time.time()
+
+    def sample(self) -> List[Dict]:
+        findings = sample_cpu(CPU_THRESHOLD)
+        if self.tree is not None:
+            sampler = _proc_cpu_sampler if CPU_SAMPLER != "ps" else None
+            self.tree.refresh(sampler.last_stats if sampler is not None else None)
+        return findings
+
+    def process(self, findings: List[Dict], now: float, ts: str) -> None:
+        active_keys: Set[Tuple[int, str]] = set()
+        for item in findings:
+            key = (item["pid"], item["cmd"])
+            active_keys.add(key)
+            last = self.last_alert.get(key, 0.0)
+            if now - last < CPU_COOLDOWN:
+                continue
+            context = self.context_cache.get(item["pid"], item.get("starttime"))
+            event = {
+                "ts": ts,
+                "kind": "cpu_high",
+                "pid": item["pid"],
+                "ppid": item["ppid"],
+                "process": item["cmd"],
+                "cpu": item["cpu"],
+                "mem": item["mem"],
+                "threshold": CPU_THRESHOLD,
+            }
+            apply_context(event, context)
+            if self.tree is not None:
+                event["ancestors"] = self.tree.ancestors(item["pid"])
+            write_event(self.handle, event)
+            self.last_alert[key] = now
+        if now - self.last_cleanup >= self.cleanup_interval:
+            for key in list(self.last_alert):
+                if key not in active_keys and now - self.last_alert[key] > self.cleanup_interval:
+                    del self.last_alert[key]
+            self.last_cleanup = now
+
+
+class CgroupWatch:
+    """cgroup CPU sampling cycle emitting ``cgroup_cpu_high``."""
+
+    name = "cgroup"
+
+    def __init__(self, handle, interval: float = CGROUP_INTERVAL, root: pathlib.Path = CGROUP_ROOT) -> None:
+        self.handle = handle
+        self.interval = interval
+        self.sampler = CgroupCpuSampler(root)
+        self.last_alert: Dict[str, float] = {}
+
+    def sample(self) -> List[Dict]:
+        return self.sampler.sample(CGROUP_CPU_THRESHOLD)
+
+    def process(self, findings: List[Dict], now: float, ts: str) -> None:
+        for item in findings:
+            cgroup = item["cgroup"]
+            if now - self.last_alert.get(cgroup, 0.0) < CPU_COOLDOWN:
+                continue
+            event = {"ts": ts, "kind": "cgroup_cpu_high", **item, "threshold": CGROUP_CPU_THRESHOLD}
+            event["procs"] = self.sampler.procs(cgroup)
+            write_event(self.handle, event)
+            self.last_alert[cgroup] = now
+        for cgroup in [c for c, last in self.last_alert.items() if now - last > CPU_COOLDOWN]:
+            del self.last_alert[cgroup]
+
+
+class ProcEventWatch:
+    """Event-driven exec/exit stream from the netlink process connector.
+
+    Subscribing needs CAP_NET_ADMIN; without it :meth:`run` records a
+    ``proc_events_unavailable`` event and returns, leaving the polling watches
+    as the only process coverage.  Fork events only feed a bounded
+    child -> parent map so that very short-lived processes still get a ppid.
+    """
+
+    name = "proc_events"
+
+    def __init__(
+        self,
+        handle,
+        context_cache: ProcContextCache,
+        tree: Optional[ProcessTree] = None,
+        kinds: Set[str] = PROC_EVENTS,
+    ) -> None:
+        self.handle = handle
+        self.context_cache = context_cache
+        self.tree = tree
+        self.kinds = kinds
+        self._sock: Optional[socket.socket] = None
+        self._parents: "OrderedDict[int, int]" = OrderedDict()
+        self._execs: "OrderedDict[int, Tuple[int, Optional[str], Optional[str]]]" = OrderedDict()
+
+    def _open(self) -> socket.socket:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            sock.bind((os.getpid(), CN_IDX_PROC))
+            payload = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, CN_PROC_OP.size, 0) + CN_PROC_OP.pack(
+                PROC_CN_MCAST_LISTEN
+            )
+            sock.send(NLMSG_HDR.pack(NLMSG_HDR.size + len(payload), NLMSG_DONE, 0, 0, os.getpid()) + payload)
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    @staticmethod
+    def _remember(table: "OrderedDict", key: int, value) -> None:
+        table[key] = value
+        if len(table) > PROC_EVENT_TRACK_MAX:
+            table.popitem(last=False)
+
+    def _on_readable(self) -> None:
+        sock = self._sock
+        if sock is None:
+            return
         while True:
-            loop_started = time.time()
-            ts = iso_local(loop_started)
             try:
-                cpu_findings = sample_cpu(CPU_THRESHOLD)
-            except Exception as exc:  # noqa: BLE001
-                write_event(handle, {"ts": ts, "kind": "error", "source": "cpu", "message": str(exc)})
-                cpu_findings = []
-            active_keys: Set[Tuple[int, str]] = set()
-            for item in cpu_findings:
-                key = (item["pid"], item["cmd"])
-                active_keys.add(key)
-                last = last_cpu_alert.get(key, 0.0)
-                if loop_started - last < CPU_COOLDOWN:
+                data = sock.recv(NETLINK_RECV_BUFSIZE)
+            except BlockingIOError:
+                return
+            except OSError as exc:
+                # ENOBUFS: the socket buffer overflowed and events were dropped.
+                write_event(
+                    self.handle,
+                    {"ts": iso_local(), "kind": "proc_events_lost", "message": str(exc)},
+                )
+                return
+            self._dispatch(data)
+
+    def _dispatch(self, data: bytes) -> None:
+        offset = 0
+        body = NLMSG_HDR.size + CN_MSG.size
+        while offset + body + PROC_EVENT_HDR.size <= len(data):
+            length = NLMSG_HDR.unpack_from(data, offset)[0]
+            if length < body:
+                break
+            what, _cpu, timestamp_ns = PROC_EVENT_HDR.unpack_from(data, offset + body)
+            event_at = offset + body + PROC_EVENT_HDR.size
+            if what == PROC_EVENT_FORK:
+                _ppid, parent_tgid, child_pid, child_tgid = PROC_EVENT_FORK_DATA.unpack_from(data, event_at)
+                if child_pid == child_tgid:
+                    self._remember(self._parents, child_tgid, parent_tgid)
+            elif what == PROC_EVENT_EXEC:
+                _tid, tgid = PROC_EVENT_EXEC_DATA.unpack_from(data, event_at)
+                self._on_exec(tgid, timestamp_ns)
+            elif what == PROC_EVENT_EXIT:
+                tid, tgid, exit_code, _exit_signal = PROC_EVENT_EXIT_DATA.unpack_from(data, event_at)
+                if tid == tgid:
+                    self._on_exit(tgid, exit_code, timestamp_ns)
+            offset += (length + 3) & ~3
+
+    def _on_exec(self, pid: int, timestamp_ns: int) -> None:
+        stat = read_proc_stat(pid)
+        starttime = stat[3] if stat is not None else None
+        self.context_cache.invalidate(pid, starttime)
+        if self.tree is not None:
+            self.tree.update(pid)
+        context = self.context_cache.get(pid, starttime) if starttime is not None else proc_context(pid)
+        self._remember(self._execs, pid, (timestamp_ns, context["exe"], context["cmdline"]))
+        if "exec" not in self.kinds:
+            return
+        event: Dict = {"ts": iso_local(), "kind": "process_exec", "pid": pid}
+        ppid = stat[1] if stat is not None else self._parents.get(pid)
+        if ppid is not None:
+            event["ppid"] = ppid
+        apply_context(event, context)
+        if self.tree is not None:
+            event["ancestors"] = self.tree.ancestors(pid)
+        write_event(self.handle, event)
+
+    def _on_exit(self, pid: int, exit_code: int, timestamp_ns: int) -> None:
+        ppid = self._parents.pop(pid, None)
+        execd = self._execs.pop(pid, None)
+        if self.tree is not None:
+            self.tree.forget(pid)
+        if "exit" not in self.kinds:
+            return
+        event: Dict = {"ts": iso_local(), "kind": "process_exit", "pid": pid}
+        if ppid is not None:
+            event["ppid"] = ppid
+        if exit_code & 0x7F:
+            event["signal"] = exit_code & 0x7F
+        else:
+            event["exit_code"] = (exit_code >> 8) & 0xFF
+        if execd is not None:
+            exec_ns, exe, cmdline = execd
+            event["lifetime"] = round(max(0, timestamp_ns - exec_ns) / 1e9, 6)
+            if exe:
+                event["exe"] = exe
+            if cmdline:
+                event["cmdline"] = cmdline
+        write_event(self.handle, event)
+
+    async def run(self) -> None:
+        try:
+            self._sock = self._open()
+        except OSError as exc:
+            write_event(
+                self.handle,
+                {"ts": iso_local(), "kind": "proc_events_unavailable", "message": str(exc)},
+            )
+            return
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self._sock.fileno(), self._on_readable)
+        try:
+            await loop.create_future()
+        finally:
+            loop.remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+
+
+class NetWatch:
+    """Network sampling cycle: ``sample()`` runs in an executor, ``process()`` on the loop."""
+
+    name = "network"
+
+    def __init__(
+        self,
+        handle,
+        context_cache: ProcContextCache,
+        tree: Optional[ProcessTree] = None,
+        interval: float = NET_INTERVAL,
+    ) -> None:
+        self.handle = handle
+        self.context_cache = context_cache
+        self.tree = tree
+        self.interval = interval
+        self.flow_table = FlowTable()
+        self.rollup = ConnectionRollup() if NET_ROLLUP else None
+        self.cycles = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_stats = time.time()
+        self.last_elapsed_ms = 0.0
+
+    def sample(self) -> List[Dict]:
+        started = time.perf_counter()
+        try:
+            return sample_connections()
+        finally:
+            self.last_elapsed_ms = (time.perf_counter() - started) * 1000
+
+    def process(self, conns: List[Dict], now: float, ts: str) -> None:
+        handle = self.handle
+        self.cycles += 1
+        self.total_ms += self.last_elapsed_ms
+        self.max_ms = max(self.max_ms, self.last_elapsed_ms)
+        if NET_STATS_INTERVAL > 0 and now - self.last_stats >= NET_STATS_INTERVAL:
+            self.write_stats(ts)
+            self.last_stats = now
+        opened, closed = self.flow_table.update(conns, now)
+        for key, record, conn in opened:
+            context = None
+            if conn["pid"] is not None:
+                context = self.context_cache.get(conn["pid"], conn.get("starttime"))
+            if self.rollup is not None:
+                exe = (context and context["exe"]) or conn["process"]
+                rollup_key = (exe, key[3], conn["remote_port"])
+                if not self.rollup.admit(rollup_key, conn["local_port"], conn["pid"], now):
+                    record.summarized = True
                     continue
-                context = proc_context(item["pid"])
+            event = {
+                "ts": ts,
+                "kind": "network_connection",
+                "proto": key[0],
+                "state": record.state,
+                "local_addr": key[1],
+                "local_port": conn["local_port"],
+                "remote_addr": key[3],
+                "remote_port": conn["remote_port"],
+            }
+            if context is not None:
+                event["pid"] = conn["pid"]
+                apply_context(event, context)
+                if self.tree is not None:
+                    event["ancestors"] = self.tree.ancestors(conn["pid"])
+            if conn["process"]:
+                event["process"] = conn["process"]
+            write_event(handle, event)
+        for key, record in closed:
+            if record.summarized:
+                continue
+            event = {
+                "ts": ts,
+                "kind": "network_connection_closed",
+                "proto": key[0],
+                "state": record.state,
+                "local_addr": key[1],
+                "local_port": str(key[2]),
+                "remote_addr": key[3],
+                "remote_port": str(key[4]),
+                "first_seen": iso_local(record.first_seen),
+                "last_seen": iso_local(record.last_seen),
+                "duration": round(record.last_seen - record.first_seen, 3),
+            }
+            if key[5] is not None:
+                event["pid"] = key[5]
+            if record.process:
+                event["process"] = record.process
+            if record.evicted:
+                event["evicted"] = True
+            write_event(handle, event)
+        if self.rollup is not None:
+            for (exe, remote_addr, remote_port), entry, window_end in self.rollup.flush(now):
                 event = {
                     "ts": ts,
-                    "kind": "cpu_high",
-                    "pid": item["pid"],
-                    "ppid": item["ppid"],
-                    "process": item["cmd"],
-                    "cpu": item["cpu"],
-                    "mem": item["mem"],
-                    "threshold": CPU_THRESHOLD,
+                    "kind": "network_connection_summary",
+                    "remote_addr": remote_addr,
+                    "remote_port": remote_port,
+                    "count": entry.count,
+                    "distinct_local_ports": len(entry.local_ports),
+                    "window_start": iso_local(entry.window_start),
+                    "window_end": iso_local(window_end),
                 }
-                if context["cwd"]:
-                    event["cwd"] = context["cwd"]
-                if context["cmdline"]:
-                    event["cmdline"] = context["cmdline"]
-                if context["exe"]:
-                    event["exe"] = context["exe"]
+                if exe:
+                    event["exe"] = exe
+                if entry.pids:
+                    event["pids"] = sorted(entry.pids)[:32]
                 write_event(handle, event)
-                last_cpu_alert[key] = loop_started
-            if loop_started - last_cleanup >= cooldown_cleanup_interval:
-                for key in list(last_cpu_alert):
-                    if key not in active_keys and loop_started - last_cpu_alert[key] > cooldown_cleanup_interval:
-                        del last_cpu_alert[key]
-                last_cleanup = loop_started
+
+    def write_stats(self, ts: str) -> None:
+        stats_event = {
+            "ts": ts,
+            "kind": "network_sample_stats",
+            "backend": NET_BACKEND,
+            "cycles": self.cycles,
+            "avg_ms": round(self.total_ms / self.cycles, 3),
+            "max_ms": round(self.max_ms, 3),
+            "flows": len(self.flow_table),
+            "flow_evictions": self.flow_table.evictions,
+        }
+        if self.rollup is not None:
+            stats_event["rollup_keys"] = len(self.rollup)
+        last_cycle = net_backend_stats()
+        if last_cycle:
+            stats_event["last_cycle"] = last_cycle
+        write_event(self.handle, stats_event)
+        write_event(self.handle, {"ts": ts, "kind": "proc_context_cache_stats", **self.context_cache.stats()})
+        self.cycles = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+async def run_periodic(watch, handle) -> None:
+    """Drive one watch on its own cadence.
+
+    Blocking sampling runs in a dedicated single-thread executor so a slow
+    backend never delays the other watches.  A cycle that takes longer than
+    the current interval emits ``sampler_cycle_skipped`` and doubles the
+    interval (up to ``POLL_MAX_BACKOFF`` times the configured one); cycles that
+    finish within half the budget shrink it back towards the configured value.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"syswatcher-{watch.name}")
+    base = watch.interval
+    current = base
+    try:
+        while True:
+            started = loop.time()
+            now = time.time()
+            ts = iso_local(now)
             try:
-                conn_findings = sample_connections()
+                findings = await loop.run_in_executor(executor, watch.sample)
             except Exception as exc:  # noqa: BLE001
-                write_event(handle, {"ts": ts, "kind": "error", "source": "network", "message": str(exc)})
-                conn_findings = []
-            current_keys: Set[Tuple[str, str, str, str, str, Optional[int]]] = set()
-            for conn in conn_findings:
-                key = (
-                    conn["proto"],
-                    conn["local_addr"],
-                    conn["local_port"],
-                    conn["remote_addr"],
-                    conn["remote_port"],
-                    conn["pid"],
+                # A failed sample says nothing about what changed: skip process()
+                # so stateful watches (the flow table) keep their state.
+                write_event(handle, {"ts": ts, "kind": "error", "source": watch.name, "message": str(exc)})
+            else:
+                watch.process(findings, now, ts)
+            elapsed = loop.time() - started
+            if elapsed > current:
+                backed_off = min(base * POLL_MAX_BACKOFF, current * 2)
+                write_event(
+                    handle,
+                    {
+                        "ts": iso_local(),
+                        "kind": "sampler_cycle_skipped",
+                        "sampler": watch.name,
+                        "elapsed": round(elapsed, 3),
+                        "interval": current,
+                        "skipped": int(elapsed // current),
+                        "next_interval": backed_off,
+                    },
                 )
-                current_keys.add(key)
-                if key in known_connections:
-                    continue
-                event = {
-                    "ts": ts,
-                    "kind": "network_connection",
-                    "proto": conn["proto"],
-                    "state": conn["state"],
-                    "local_addr": conn["local_addr"],
-                    "local_port": conn["local_port"],
-                    "remote_addr": conn["remote_addr"],
-                    "remote_port": conn["remote_port"],
-                }
-                if conn["pid"] is not None:
-                    event["pid"] = conn["pid"]
-                    context = proc_context(conn["pid"])
-                    if context["cwd"]:
-                        event["cwd"] = context["cwd"]
-                    if context["cmdline"]:
-                        event["cmdline"] = context["cmdline"]
-                    if context["exe"]:
-                        event["exe"] = context["exe"]
-                if conn["process"]:
-                    event["process"] = conn["process"]
-                write_event(handle, event)
-            known_connections = current_keys
-            elapsed = time.time() - loop_started
-            sleep_for = max(0.0, POLL_INTERVAL - elapsed)
-            time.sleep(sleep_for)
+                current = backed_off
+            elif current > base and elapsed < current / 2:
+                current = max(base, current * 0.75)
+            delay = started + current - loop.time()
+            if POLL_JITTER > 0:
+                delay += random.uniform(0, POLL_JITTER * current)
+            await asyncio.sleep(max(0.0, delay))
+    finally:
+        executor.shutdown(wait=False)
+
+
+async def run_watches(handle) -> None:
+    context_cache = ProcContextCache()
+    tree = ProcessTree() if ANCESTRY_DEPTH > 0 else None
+    watches = [CpuWatch(handle, context_cache, tree), NetWatch(handle, context_cache, tree)]
+    if CGROUP_CPU_THRESHOLD > 0 and (CGROUP_ROOT / "cpu.stat").exists():
+        watches.append(CgroupWatch(handle))
+    tasks = [run_periodic(watch, handle) for watch in watches]
+    if PROC_EVENTS:
+        tasks.append(ProcEventWatch(handle, context_cache, tree).run())
+    await asyncio.gather(*tasks)
+
+
+def main() -> int:
+    # Mirror to stdout (journald) except for the high-volume kinds
+    with EventWriter(LOG_FILE, mirror=True, reopen_signal=True) as handle:
+        write_event(
+            handle,
+            {
+                "ts": iso_local(),
+                "kind": "syswatcher_start",
+                "poll_interval": POLL_INTERVAL,
+                "cpu_interval": CPU_INTERVAL,
+                "net_interval": NET_INTERVAL,
+                "cpu_sampler": CPU_SAMPLER,
+                "net_backend": NET_BACKEND,
+                "cgroup_root": str(CGROUP_ROOT),
+            },
+        )
+        asyncio.run(run_watches(handle))
     return 0
 
 
@@ -9,6 +9,7 @@
 # Modules live under scripts/<module>/
 # - Service module: <module>.service.tmpl -> installs firewallbot-<module>.service
 # - Profile module: profile.sh -> installs /etc/profile.d/99-firewallbot-<module>.sh
+# - A module with both (e.g. cmdwatcher's collector + hook) gets both installed
 
 set -euo pipefail
 
@@ -161,6 +162,9 @@ module_profile_src() {
 module_type() {
   local mod="$1"
   if [[ -f "$(module_template "$mod")" ]]; then
+    if [[ -f "$(module_profile_src "$mod")" ]]; then
+      echo both; return
+    fi
     echo service; return
   fi
   if [[ -f "$(module_profile_src "$mod")" ]]; then
@@ -185,7 +189,7 @@ cmd_install() {
   (( ${#mods[@]} )) || { echo "No modules to install"; exit 2; }
   for m in "${mods[@]}"; do
     case "$(module_type "$m")" in
-      service)
+      service|both)
         local src dst unit tmp
         unit=$(module_unit_name "$m")
         src=$(module_template "$m")
@@ -201,8 +205,8 @@ cmd_install() {
         log_info "启用并启动 ${unit}"
         systemctl enable --now "$unit"
         check_service_status "$unit"
-        ;;
-      profile)
+        ;;&
+      profile|both)
         local src dest ts lower
         src=$(module_profile_src "$m")
         lower=$(echo "$m" | tr '[:upper:]' '[:lower:]')
@@ -281,7 +285,7 @@ EOF
           log_info "非登录 Shell 通常不加载 /etc/profile.d，可使用 bash -l 测试"
         fi
         ;;
-      *) echo "Skipping unknown module: $m" ;;
+      unknown) echo "Skipping unknown module: $m" ;;
     esac
   done
 }
@@ -293,7 +297,7 @@ cmd_uninstall() {
   (( ${#mods[@]} )) || { echo "No modules to uninstall"; exit 2; }
   for m in "${mods[@]}"; do
     case "$(module_type "$m")" in
-      service)
+      service|both)
         local unit dst
         unit=$(module_unit_name "$m")
         dst="${UNIT_DIR_DST}/${unit}"
@@ -301,8 +305,8 @@ cmd_uninstall() {
         systemctl disable --now "$unit" 2>/dev/null || true
         rm -f "$dst" || true
         remove_module_virtualenv "$m"
-        ;;
-      profile)
+        ;;&
+      profile|both)
         local lower dest dest_brcd bashrc marker_begin marker_end
         lower=$(echo "$m" | tr '[:upper:]' '[:lower:]')
         dest="/etc/profile.d/99-firewallbot-${lower}.sh"
@@ -319,7 +323,7 @@ cmd_uninstall() {
         fi
         remove_module_virtualenv "$m"
         ;;
-      *) echo "Skipping unknown module: $m" ;;
+      unknown) echo "Skipping unknown module: $m" ;;
     esac
   done
   systemctl daemon-reload
@@ -331,7 +335,7 @@ cmd_status() {
   (( ${#mods[@]} )) || { echo "No modules to query"; exit 2; }
   for m in "${mods[@]}"; do
     case "$(module_type "$m")" in
-      service)
+      service|both)
         local u unit_path enabled active
         local enabled_rc=0 active_rc=0
         local enabled_out="" active_out=""
@@ -371,14 +375,14 @@ cmd_status() {
           fi
         fi
         printf '%-18s kind=service unit=%-30s enabled=%-14s active=%s\n' "$m" "$u" "$enabled" "$active"
-        ;;
-      profile)
+        ;;&
+      profile|both)
         local dest state
         dest="/etc/profile.d/99-firewallbot-$(echo "$m" | tr '[:upper:]' '[:lower:]').sh"
         if [[ -e "$dest" || -L "$dest" ]]; then state="installed"; else state="not-installed"; fi
         printf '%-18s kind=profile path=%-44s state=%s\n' "$m" "$dest" "$state"
         ;;
-      *) printf '%-18s kind=unknown\n' "$m" ;;
+      unknown) printf '%-18s kind=unknown\n' "$m" ;;
     esac
   done
 }
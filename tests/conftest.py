@@ -0,0 +1,15 @@
+"""Shared setup: make the single-file modules importable without touching the repo's log directory."""
+import os
+import pathlib
+import sys
+import tempfile
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+# Module-level configuration is read from the environment at import time.
+os.environ.setdefault("FIREWALLBOT_LOG_DIR", tempfile.mkdtemp(prefix="firewallbot-test-log-"))
+
+for module_dir in ("scripts/common", "scripts/filewatcher", "scripts/logkeeper", "scripts/syswatcher", ""):
+    path = str(REPO_ROOT / module_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
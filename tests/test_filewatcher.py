@@ -0,0 +1,92 @@
+import io
+import json
+import os
+
+import pytest
+
+import filewatcher
+from filewatcher import IN_CREATE, IN_DELETE, IN_ISDIR, IN_MODIFY, IN_MOVED_FROM, IN_MOVED_TO, EnrichPipeline, EventCoalescer
+
+
+def make_coalescer():
+    emitted = []
+    coalescer = EventCoalescer(lambda path, mask, *_rest: emitted.append((path, mask)), window=1.0)
+    return coalescer, emitted
+
+
+def test_directory_move_flushes_pending_children_first():
+    coalescer, emitted = make_coalescer()
+    coalescer.add("/w/d/x", IN_CREATE, 0, "/w/d", "x", "IN_CREATE", now=0.0)
+    coalescer.add("/w/d", IN_MOVED_FROM | IN_ISDIR, 7, "/w", "d", "IN_MOVED_FROM", now=0.1)
+    coalescer.add("/w/e", IN_MOVED_TO | IN_ISDIR, 7, "/w", "e", "IN_MOVED_TO", now=0.1)
+    coalescer.add("/w/e/x", IN_DELETE, 0, "/w/e", "x", "IN_DELETE", now=0.2)
+    coalescer.flush()
+    assert emitted == [
+        ("/w/d/x", IN_CREATE),
+        ("/w/d", IN_MOVED_FROM | IN_ISDIR),
+        ("/w/e", IN_MOVED_TO | IN_ISDIR),
+        ("/w/e/x", IN_DELETE),
+    ]
+
+
+def test_same_path_events_merge_within_window():
+    coalescer, emitted = make_coalescer()
+    coalescer.add("/w/a", IN_CREATE, 0, "/w", "a", "IN_CREATE", now=0.0)
+    coalescer.add("/w/a", IN_MODIFY, 0, "/w", "a", "IN_MODIFY", now=0.5)
+    coalescer.flush(now=0.9)
+    assert emitted == []
+    coalescer.flush(now=1.0)
+    assert emitted == [("/w/a", IN_CREATE)]
+
+
+def test_enrich_failure_keeps_order_and_workers(monkeypatch):
+    def file_info(path):
+        if path.endswith("bad"):
+            raise PermissionError(13, "Permission denied", path)
+        return {"size": 1}
+
+    monkeypatch.setattr(filewatcher, "get_file_info", file_info)
+    handle = io.StringIO()
+    pipeline = EnrichPipeline(handle, workers=1, queue_size=16)
+    for name in ("a", "bad", "c"):
+        pipeline.submit({"path": name, "mask": IN_MODIFY}, {}, "/w/" + name)
+    pipeline.close()
+    records = [json.loads(line) for line in handle.getvalue().splitlines()]
+    assert [record["path"] for record in records] == ["a", "bad", "c"]
+    assert records[1]["enriched"] is False
+    assert records[2]["size"] == 1
+    assert pipeline.failed == 1
+
+
+class FakeFanotifyLibc:
+    def __init__(self):
+        self.marks = []
+
+    def fanotify_init(self, flags, event_flags):
+        return os.open(os.devnull, os.O_RDONLY)
+
+    def fanotify_mark(self, fd, flags, mask, dirfd, path):
+        self.marks.append(flags)
+        return -1
+
+    def open_by_handle_at(self, *args):
+        return -1
+
+
+def test_fanotify_without_filesystem_mark_falls_back_for_dirent_events(monkeypatch, tmp_path):
+    libc = FakeFanotifyLibc()
+    monkeypatch.setattr(filewatcher, "load_libc", lambda: libc)
+    with pytest.raises(filewatcher.DependencyError):
+        filewatcher.FanotifyEngine(IN_CREATE | IN_MODIFY, [str(tmp_path)])
+    assert libc.marks == [filewatcher.FAN_MARK_ADD | filewatcher.FAN_MARK_FILESYSTEM]
+
+
+def test_fanotify_mount_mark_still_used_for_content_events(monkeypatch, tmp_path):
+    libc = FakeFanotifyLibc()
+    monkeypatch.setattr(filewatcher, "load_libc", lambda: libc)
+    with pytest.raises(filewatcher.DependencyError):
+        filewatcher.FanotifyEngine(IN_MODIFY, [str(tmp_path)])
+    assert libc.marks == [
+        filewatcher.FAN_MARK_ADD | filewatcher.FAN_MARK_FILESYSTEM,
+        filewatcher.FAN_MARK_ADD | filewatcher.FAN_MARK_MOUNT,
+    ]
@@ -0,0 +1,70 @@
+import monitor
+from monitor import CgroupCpuSampler, FlowTable
+
+
+def conn(index):
+    return {
+        "proto": "tcp",
+        "local_addr": "10.0.0.1",
+        "local_port": str(40000 + index),
+        "remote_addr": "10.0.0.2",
+        "remote_port": "443",
+        "state": "ESTAB",
+        "pid": 100,
+        "process": "curl",
+    }
+
+
+def test_flow_table_memory_bounded_with_live_set_over_twice_the_cap():
+    table = FlowTable(max_entries=10)
+    live = [conn(index) for index in range(25)]
+    opened, closed = table.update(live, now=1.0)
+    assert len(opened) == 25
+    assert len(table) == 10
+    assert len(closed) == 15
+    for _key, record in closed:
+        assert record.evicted
+        assert record.first_seen == 1.0 and record.last_seen == 1.0
+    for now in (2.0, 3.0, 4.0):
+        opened, closed = table.update(live, now)
+        assert len(table) <= 10
+        assert len(table._evicted) <= 10
+        assert all(record.evicted for _key, record in closed)
+
+
+def test_flow_table_evicted_key_not_reannounced_within_bound():
+    table = FlowTable(max_entries=10)
+    live = [conn(index) for index in range(15)]
+    table.update(live, now=1.0)
+    opened, closed = table.update(live, now=2.0)
+    assert opened == [] and closed == []
+    # The evicted flows end; their close was already reported at eviction time.
+    opened, closed = table.update(live[5:], now=3.0)
+    assert opened == [] and closed == []
+    assert len(table._evicted) == 0
+
+
+def write_cpu_stat(path, usage, throttled=0):
+    path.mkdir(parents=True, exist_ok=True)
+    (path / "cpu.stat").write_text(
+        f"usage_usec {usage}\nuser_usec {usage}\nsystem_usec 0\nnr_throttled 0\nthrottled_usec {throttled}\n"
+    )
+
+
+def test_cgroup_cpu_sampler_delta_vanished_and_malformed(tmp_path, monkeypatch):
+    clock = iter([100.0, 101.0])
+    monkeypatch.setattr(monitor.time, "monotonic", lambda: next(clock))
+    write_cpu_stat(tmp_path, 10_000_000)
+    write_cpu_stat(tmp_path / "busy", 1_000_000, throttled=2_000)
+    write_cpu_stat(tmp_path / "gone", 1_000_000)
+    write_cpu_stat(tmp_path / "odd", 1_000_000)
+    sampler = CgroupCpuSampler(tmp_path)
+    assert sampler.sample(threshold=10.0) == []
+
+    write_cpu_stat(tmp_path, 20_000_000)
+    write_cpu_stat(tmp_path / "busy", 1_500_000, throttled=5_000)
+    (tmp_path / "gone" / "cpu.stat").unlink()
+    (tmp_path / "gone").rmdir()
+    (tmp_path / "odd" / "cpu.stat").write_text("usage_usec 2000\nthrottled_usec \n")
+    findings = sampler.sample(threshold=10.0)
+    assert findings == [{"cgroup": "/busy", "cpu": 50.0, "throttled_ms": 3.0, "window": 1.0}]
@@ -0,0 +1,31 @@
+import json
+
+import query
+
+RECORDS = [
+    {"ts": "2026-10-17T10:00:00+00:00", "kind": "file_event", "event_type": "IN_MODIFY", "path": "/etc/a.conf"},
+    {"ts": "2026-10-17T10:00:01+00:00", "kind": "file_event", "event_type": "IN_MODIFY", "path": "/etc/a.conf"},
+    {"ts": "2026-10-17T10:00:02+00:00", "kind": "file_event", "event_type": "IN_CREATE", "path": "/etc/b.conf"},
+    {"ts": "2026-10-17T10:00:03+00:00", "kind": "file_event", "event_type": "MOVED_TO", "path": "/etc/c.conf"},
+]
+
+
+def write_log(tmp_path):
+    with (tmp_path / "filewatcher.jsonl").open("w", encoding="utf-8") as handle:
+        for record in RECORDS:
+            handle.write(json.dumps(record) + "\n")
+
+
+def test_readme_top_path_example(tmp_path, capsys):
+    # README: python3 query.py --event-type IN_MODIFY --top path
+    write_log(tmp_path)
+    assert query.main(["--log-dir", str(tmp_path), "--event-type", "IN_MODIFY", "--top", "path", "-j", "1"]) == 0
+    assert capsys.readouterr().out == "2\t/etc/a.conf\n"
+
+
+def test_event_type_without_in_prefix(tmp_path, capsys):
+    write_log(tmp_path)
+    assert query.main(["--log-dir", str(tmp_path), "--event-type", "MODIFY", "--top", "path", "-j", "1"]) == 0
+    assert capsys.readouterr().out == "2\t/etc/a.conf\n"
+    assert query.main(["--log-dir", str(tmp_path), "--event-type", "IN_MOVED_TO", "--count", "-j", "1"]) == 0
+    assert json.loads(capsys.readouterr().out)["total"] == 1